@@ -0,0 +1,79 @@
+"""End-to-end check and timing of the batch-inference export/import round trip.
+
+Usage: python benchmarks/bench_batch_inference.py [--docs 50] [--pages 3] [--fast-path] [--malformed-rate 0.05] [--error-rate 0.01]
+
+Writes synthetic agreements to a temporary directory, exports their section requests, answers
+them with FakeBedrock's simulated batch job, ingests the output and reports the time of each step.
+A sample of the ingested records is then compared with what the synchronous pipeline returns for
+the same documents against a fresh cache, so any drift between the two paths shows up as a mismatch.
+No AWS credentials or network access are needed.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import mdima_batch_inference
+import mdima_pipeline
+from bench_pdf import synthetic_pdf
+from bench_pipeline import CLOSING_LINES, RECORDINGS
+from mdima_cache import ResultCache
+from mdima_fake_bedrock import FakeBedrock
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=3, help="pages per synthetic agreement")
+    parser.add_argument("--fast-path", action="store_true", help="answer dates and fee schedules with rules when they are complete")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of batch outputs with an unusable <output>")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of batch records that come back with an error")
+    parser.add_argument("--compare", type=int, default=5, help="documents re-run synchronously and compared")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdfs = os.path.join(tmp, "pdfs")
+        os.makedirs(pdfs)
+        for n in range(args.docs):
+            with open(os.path.join(pdfs, f"agreement_{n:05d}.pdf"), "wb") as f:
+                f.write(synthetic_pdf(args.pages, lines_per_page=30, title=f"Agreement {n}", closing_lines=CLOSING_LINES))
+        mdima_pipeline.set_cache(ResultCache(os.path.join(tmp, "cache.sqlite3")))
+        # repairs during ingest are synchronous calls
+        mdima_pipeline.set_bedrock(FakeBedrock.from_file(RECORDINGS))
+        export_dir = os.path.join(tmp, "batch")
+        output = os.path.join(tmp, "results.jsonl")
+        log = io.StringIO()
+
+        started = time.perf_counter()
+        counts = mdima_batch_inference.export_batch(pdfs, export_dir, fast_path=args.fast_path, log=log)
+        exported = time.perf_counter() - started
+        started = time.perf_counter()
+        mdima_batch_inference.simulate(export_dir, RECORDINGS, malformed_rate=args.malformed_rate, error_rate=args.error_rate, seed=0)
+        simulated = time.perf_counter() - started
+        started = time.perf_counter()
+        ingested_counts = mdima_batch_inference.ingest_batch(export_dir, [], output, log=log)
+        ingested = time.perf_counter() - started
+
+        print(f"{'step':<10} {'seconds':>8}  counts")
+        print(f"{'export':<10} {exported:>8.2f}  {json.dumps(counts)}")
+        print(f"{'simulate':<10} {simulated:>8.2f}")
+        print(f"{'ingest':<10} {ingested:>8.2f}  {json.dumps(ingested_counts)}")
+
+        with open(output) as f:
+            records = [json.loads(line) for line in f]
+        mdima_pipeline.set_cache(ResultCache(os.path.join(tmp, "sync_cache.sqlite3")))
+        matches = 0
+        for record in records[:args.compare]:
+            synchronous = mdima_pipeline.run_pipeline(os.path.join(pdfs, record["File Name"]), record["File Name"], fast_path=args.fast_path)
+            matches += synchronous == record
+        print(f"\n{matches}/{min(args.compare, len(records))} ingested records identical to the synchronous pipeline's")
+
+
+if __name__ == "__main__":
+    main()
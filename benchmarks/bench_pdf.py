@@ -0,0 +1,125 @@
+"""Compare the original page loop in extract() with mdima_pdf.extract_pages.
+
+Usage: python benchmarks/bench_pdf.py [--pages 50,200,500] [--processes N]
+
+Every measurement runs in a fresh process so peak RSS is reported per variant.
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdfplumber
+
+from mdima_pdf import extract_pages, join_pages
+
+BUNDLED_PDF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Discretionary Investment Management Agreement.pdf")
+
+LINE = "The Investment Manager shall manage the Portfolio in accordance with the Investment Guidelines set out in Schedule {page}."
+
+
+def synthetic_pdf(pages, lines_per_page=45, title=None, closing_lines=()):
+    # minimal single-font PDF writer so the benchmark needs nothing beyond pdfplumber;
+    # a distinct title makes otherwise identical documents hash differently. closing_lines are
+    # appended to the last page and must not contain parentheses or backslashes
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for page in range(1, pages + 1):
+        lines = [f"({LINE.format(page=page)} {n})'" for n in range(lines_per_page)]
+        if title and page == 1:
+            lines.insert(0, f"({title})'")
+        if page == pages:
+            lines.extend(f"({line})'" for line in closing_lines)
+        stream = ("BT /F1 9 Tf 12 TL 40 760 Td " + " ".join(lines) + f" (Page {page} of {pages})' ET").encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_ref = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>"
+            % content_ref
+        )
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), pages)
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def legacy_loop(path):
+    # the loop extract() used to run: quadratic concatenation plus a full print per page
+    text = ""
+    with open(os.devnull, "w") as devnull, pdfplumber.open(path) as pdf:
+        for page in pdf.pages:
+            text = text + (page.extract_text() or "")
+            print(text, file=devnull)
+    return len(text)
+
+
+def serial_pages(path):
+    return len(join_pages(extract_pages(path, processes=1)))
+
+
+def parallel_pages(path, processes=None):
+    return len(join_pages(extract_pages(path, processes=processes)))
+
+
+def _measure(variant, path, processes):
+    start = time.perf_counter()
+    if variant == "parallel":
+        chars = parallel_pages(path, processes)
+    else:
+        chars = {"legacy": legacy_loop, "serial": serial_pages}[variant](path)
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return elapsed, peak, chars
+
+
+def measure(variant, path, processes):
+    # a fresh interpreter per measurement keeps the peak RSS numbers independent
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(_measure, variant, path, processes).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default="50,200,500", help="comma separated synthetic document sizes")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes for the parallel variant")
+    args = parser.parse_args()
+
+    documents = [("bundled agreement", BUNDLED_PDF)]
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in [int(p) for p in args.pages.split(",") if p]:
+            path = os.path.join(tmp, f"synthetic_{pages}.pdf")
+            with open(path, "wb") as f:
+                f.write(synthetic_pdf(pages))
+            documents.append((f"synthetic {pages} pages", path))
+
+        print(f"{'document':<24} {'variant':<10} {'seconds':>9} {'peak rss MB':>12} {'chars':>10}")
+        for name, path in documents:
+            for variant in ("legacy", "serial", "parallel"):
+                elapsed, peak, chars = measure(variant, path, args.processes)
+                print(f"{name:<24} {variant:<10} {elapsed:>9.2f} {peak / 1024:>12.1f} {chars:>10}")
+
+
+if __name__ == "__main__":
+    main()
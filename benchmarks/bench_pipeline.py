@@ -0,0 +1,163 @@
+"""Offline benchmark of the extraction pipeline against the local FakeBedrock.
+
+Usage: python benchmarks/bench_pipeline.py [--docs 1,10,1000] [--in-flight 8] [--latency 2.0 --latency-sd 0.5]
+                                           [--throttle-rate 0.02] [--error-rate 0.01] [--malformed-rate 0.05] [--mode combined] [--stream]
+
+Stage micro-benchmarks (PDF text extraction, completion parsing, final_json) run first, then extract()'s
+pipeline runs end to end over 1, 10 and 1000 distinct synthetic agreements. Each document count is
+measured in a fresh process against an empty cache and reports throughput, p50/p99 per-document
+latency and peak RSS. No AWS credentials or network access are needed.
+"""
+import argparse
+import math
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import timeit
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import mdima_pipeline
+from bench_pdf import BUNDLED_PDF, synthetic_pdf
+from mdima_cache import ResultCache
+from mdima_fake_bedrock import FakeBedrock
+from mdima_metrics import Metrics
+from mdima_normalize import normalize_pages
+from mdima_pdf import extract_pages
+from mdima_scheduler import BedrockScheduler
+
+RECORDINGS = os.path.join(ROOT, "benchmarks", "recordings", "dima_sample.json")
+# fee, effective date and signature clauses on the last page, in forms the fast-path rules can answer
+CLOSING_LINES = [
+    "1.8 The Effective Date of this Agreement is 1st March 2023.",
+    "5. Fees",
+    "5.1 The Client shall pay the Investment Manager an annual fee of 1.00% of the market value of the Portfolio.",
+    "5.2 The Client shall bear all custody and brokerage expenses of the Portfolio.",
+    "CLIENT:",
+    "JOHN SMITH",
+    "By: John Smith",
+    "Date: March 2, 2023",
+    "INVESTMENT MANAGER:",
+    "ACME WEALTH MANAGEMENT LLC",
+    "By: Jane Doe",
+    "Name: Jane Doe",
+    "Title: Principal",
+    "Date: March 1, 2023",
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def stage_benchmarks():
+    fake = FakeBedrock.from_file(RECORDINGS)
+    texts = [entry["response"]["content"][0]["text"] for entry in fake.responses[1:]]
+    results = {section: {"json": {"k": "v"}} for section in mdima_pipeline.SECTIONS}
+
+    started = time.perf_counter()
+    pages = extract_pages(BUNDLED_PDF, processes=1)
+    pdf_seconds = time.perf_counter() - started
+    normalize_runs = 20
+    normalize_seconds = timeit.timeit(lambda: normalize_pages(pages), number=normalize_runs)
+    report = normalize_pages(pages)[1]
+    parse_runs = 2000
+    parse_seconds = timeit.timeit(lambda: [mdima_pipeline.parse_completion(text) for text in texts], number=parse_runs)
+    final_runs = 100000
+    final_seconds = timeit.timeit(lambda: mdima_pipeline.build_final_json(results, "agreement.pdf"), number=final_runs)
+
+    print("stage                          time")
+    print(f"{'pdf text (bundled, 24 pages)':<30} {pdf_seconds * 1000:>9.1f} ms")
+    print(f"{'normalize (bundled, 24 pages)':<30} {normalize_seconds / normalize_runs * 1000:>9.1f} ms"
+          f"   {report['tokens_before']} -> {report['tokens_after']} tokens")
+    print(f"{'parse_completion (4 tags)':<30} {parse_seconds / (parse_runs * len(texts)) * 1e6:>9.1f} us")
+    print(f"{'final_json':<30} {final_seconds / final_runs * 1e6:>9.2f} us")
+    print()
+
+
+def run_documents(count, args):
+    # runs in a fresh process: empty cache, fresh fake client, independent peak RSS
+    with tempfile.TemporaryDirectory() as tmp:
+        mdima_pipeline.set_cache(ResultCache(os.path.join(tmp, "cache.sqlite3")))
+        mdima_pipeline.chunk_tokens = args.chunk_tokens
+        fake = FakeBedrock.from_file(RECORDINGS, latency=args.latency, latency_sd=args.latency_sd,
+                                     throttle_rate=args.throttle_rate, error_rate=args.error_rate, seed=count,
+                                     model_latency={mdima_pipeline.fast_model_id: args.fast_latency},
+                                     max_input_tokens=args.max_input_tokens, malformed_rate=args.malformed_rate)
+        scheduler = BedrockScheduler(fake, **{**mdima_pipeline.scheduler_options, "base_delay": args.retry_delay})
+        mdima_pipeline.set_bedrock(fake if args.no_scheduler else scheduler)
+        documents = [synthetic_pdf(args.pages, lines_per_page=30, title=f"Agreement {count}-{n}", closing_lines=CLOSING_LINES)
+                     for n in range(count)]
+
+        latencies = []
+        failed = 0
+        input_tokens = 0
+        escalated = 0
+        fast = 0
+        repaired = 0
+
+        def one(n):
+            metrics = Metrics()
+            started = time.perf_counter()
+            record = mdima_pipeline.run_pipeline(documents[n], f"agreement_{n}.pdf", max_workers=args.section_workers,
+                                                 mode=args.mode, stream=args.stream, metrics=metrics, tiering=args.tiering,
+                                                 fast_path=args.fast_path)
+            summary = metrics.summary()
+            return (time.perf_counter() - started, "Errors" in record, summary["totals"]["input_tokens"], summary["tiering"]["escalated"],
+                    summary["fast_path"]["fast_path"], summary["parsing"]["repaired"])
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.in_flight) as pool:
+            for seconds, errored, tokens, escalations, fast_sections, repairs in pool.map(one, range(count)):
+                latencies.append(seconds)
+                repaired += repairs
+                fast += fast_sections
+                failed += errored
+                input_tokens += tokens
+                escalated += escalations
+        wall = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"docs": count, "wall": wall, "p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99),
+            "peak_mb": peak / 1024, "calls": fake.calls, "failed": failed, "input_tokens": input_tokens,
+            "escalated": escalated, "fast_path": fast, "repaired": repaired, "retries": scheduler.stats()["retries"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", default="1,10,1000", help="comma separated document counts")
+    parser.add_argument("--pages", type=int, default=2, help="pages per synthetic agreement")
+    parser.add_argument("--in-flight", type=int, default=8, help="documents processed at the same time")
+    parser.add_argument("--section-workers", type=int, default=mdima_pipeline.max_workers)
+    parser.add_argument("--mode", choices=mdima_pipeline.EXTRACTION_MODES, default="sections")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--tiering", action="store_true", help="fast model first, escalate uncertain sections")
+    parser.add_argument("--fast-path", action="store_true", help="answer dates and fee schedules with rules when they are complete")
+    parser.add_argument("--latency", type=float, default=0.2, help="mean simulated Bedrock latency in seconds")
+    parser.add_argument("--latency-sd", type=float, default=0.05)
+    parser.add_argument("--fast-latency", type=float, default=0.07, help="mean simulated latency of the fast tier model")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of calls that raise ThrottlingException")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls that raise a server error")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of responses with an unusable <output>")
+    parser.add_argument("--max-input-tokens", type=int, help="reject prompts longer than this, like a model context window")
+    parser.add_argument("--chunk-tokens", type=int, default=mdima_pipeline.chunk_tokens, help="window size for --mode chunked")
+    parser.add_argument("--no-scheduler", action="store_true", help="call the fake client directly, without BedrockScheduler")
+    parser.add_argument("--retry-delay", type=float, default=0.2, help="scheduler backoff base delay in seconds")
+    args = parser.parse_args()
+
+    stage_benchmarks()
+    print(f"{'docs':>6} {'wall s':>8} {'docs/s':>8} {'p50 s':>7} {'p99 s':>7} {'peak MB':>8} {'calls':>7} {'failed':>7} {'in tokens':>10} {'escalated':>10} {'fast path':>10} {'repaired':>9} {'retries':>8}")
+    for count in [int(n) for n in args.docs.split(",") if n]:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            r = pool.submit(run_documents, count, args).result()
+        print(f"{r['docs']:>6} {r['wall']:>8.2f} {r['docs'] / r['wall']:>8.2f} {r['p50']:>7.2f} {r['p99']:>7.2f} "
+              f"{r['peak_mb']:>8.1f} {r['calls']:>7} {r['failed']:>7} {r['input_tokens']:>10} {r['escalated']:>10} {r['fast_path']:>10} {r['repaired']:>9} {r['retries']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Bulk-load and query benchmark for the indexed result store.
+
+Usage: python benchmarks/bench_store.py [--records 200000] [--runs 20]
+
+Generates synthetic result records (random parties, objectives, fee structures, custodians and
+dates), loads them into a fresh store with add_many and reports load throughput, then the
+median and worst latency of typical cross-portfolio queries and the store's size on disk.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mdima_cache import hash_bytes
+from mdima_parsing import OBJECTIVE_CATEGORIES
+from mdima_store import ResultStore
+
+FEE_TYPES = ["Asset-based Fee", "Tiered Asset-based Fee", "Performance-based fee", "Fixed Fee", "Additional Expenses"]
+CUSTODIANS = ["ABC Trust Company", "XYZ Custodial Services, LLC", "DEF Bank", "Northern Custody Bank", "State Street Bank"]
+BROKERS = ["GHI Brokerage Firm", "JKL Securities, LLC", "MNO Clearing Corporation", "brokers selected under the Execution Policy"]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
+
+
+def synthetic_record(n, rng):
+    year = rng.randint(1995, 2024)
+    date = f"{rng.randint(1, 28)} {rng.choice(MONTHS)} {year}"
+    fees = rng.sample(FEE_TYPES, rng.randint(1, 2))
+    return {
+        "File Name": f"agreement_{n}.pdf",
+        "Data": {
+            "Party": {"Parties Involved": {"Client Name": f"Client {n % 50000}", "Client Firm": f"Client Holdings {n % 20000} Ltd",
+                                           "Investment Manager Name": f"Manager {n % 3000}", "Investment Manager Firm": f"Asset Manager {n % 500} LLC"}},
+            "Objective": {"Investment Objectives": {f"Objective{i + 1}": objective
+                                                    for i, objective in enumerate(rng.sample(OBJECTIVE_CATEGORIES, rng.randint(1, 3)))}},
+            "Custodian and Brokerage": {"Custodian and Brokerage": {
+                "Custodian": f"The assets shall be held by {rng.choice(CUSTODIANS)}, or such other custodian as the parties agree.",
+                "Brokerage": f"Transactions are executed through {rng.choice(BROKERS)}."}},
+            "Fee": {"Fee": {"Fee Structure": ", ".join(fees), "Compensation Details": f"An annual fee of {rng.randint(25, 150) / 100:.2f}% of assets."}},
+            "Effective Date": {"Effective Date": {"Effective Date": date, "Client Signature Date": date, "Investment Firm Signature Date": date}},
+        },
+        "Document Hash": hash_bytes(f"document {n}"),
+        "Confidence": {section: rng.choice(["High", "High", "Medium", "Low"]) for section in ("Party", "Objective", "Custodian and Brokerage", "Fee", "Effective Date")},
+        "Explanation": {"Fee": "Clause 9.1 sets the fee."},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--runs", type=int, default=20, help="repetitions of each query")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    records = [synthetic_record(n, rng) for n in range(args.records)]
+    queries = {
+        "fee structure + custodian": {"fee_structure": "Tiered Asset-based Fee", "custodian": "ABC Trust Company"},
+        "client firm": {"client": "Client Holdings 1234 Ltd"},
+        "manager + objective": {"manager": "Asset Manager 42 LLC", "objective": "Growth"},
+        "effective date range": {"effective_from": "2007-12-01", "effective_to": "2007-12-31", "min_confidence": "High"},
+        "brokerage phrase": {"brokerage": "JKL Securities"},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "results.sqlite3")
+        store = ResultStore(path)
+        started = time.perf_counter()
+        store.add_many(records)
+        load = time.perf_counter() - started
+        print(f"loaded {len(records)} records in {load:.1f}s ({len(records) / load:,.0f} records/s), "
+              f"{os.path.getsize(path) / 2**20:.0f} MB on disk")
+        print()
+        print(f"{'query':<28} {'matches':>8} {'p50 ms':>8} {'max ms':>8}")
+        for name, filters in queries.items():
+            seconds = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                rows = store.query(limit=100, **filters)
+                seconds.append(time.perf_counter() - started)
+            matches = store.count(**filters)
+            print(f"{name:<28} {matches:>8} {statistics.median(seconds) * 1000:>8.2f} {max(seconds) * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
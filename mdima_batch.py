@@ -0,0 +1,167 @@
+"""Headless batch extraction for directories or manifests of agreements.
+
+Usage:
+    python mdima_batch.py agreements/ --output results.jsonl --documents-in-flight 8
+    python mdima_batch.py manifest.txt --output results.jsonl
+
+A manifest is a text file with one PDF path per line, or a .jsonl file whose lines
+carry a "path" and optionally a "file_name". Every finished document is appended to
+the output as one JSON line and recorded in the checkpoint file; re-running the same
+command skips documents that are already checkpointed. Documents with a failed section
+are reported on stderr and left unchecked so the next run retries them (the sections
+that did succeed come back from the cache at no cost). With --incremental, a document that
+amends one processed earlier (matched by shared pages) only re-runs the sections whose
+pages changed, and its record carries an "Amendment" report of the changed fields.
+Completed records are also bulk-loaded into the indexed result store (--store, see
+mdima_store) so they can be queried later; --no-store skips it.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from mdima_metrics import JsonlSink, Metrics, default_sink
+from mdima_pipeline import (EXTRACTION_MODES, extraction_mode, fast_path, incremental, max_workers, model_tiering, normalize_text,
+                            retrieval_token_budget, retrieval_top_k, run_pipeline, streaming)
+from mdima_scheduler import PRIORITY_BATCH, priority
+from mdima_store import BULK_ROWS, DEFAULT_PATH as STORE_PATH, STORE_RESULTS, ResultStore
+
+
+def iter_documents(source):
+    # yields (path, file_name) pairs from a directory tree or a manifest file
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(".pdf"):
+                    yield os.path.join(root, name), name
+        return
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if source.endswith(".jsonl"):
+                entry = json.loads(line)
+                path, file_name = entry["path"], entry.get("file_name")
+            else:
+                path, file_name = line, None
+            path = os.path.join(base, path)
+            yield path, file_name or os.path.basename(path)
+
+
+def load_checkpoint(path):
+    done = set()
+    if os.path.exists(path):
+        with open(path) as checkpoint:
+            for line in checkpoint:
+                if line.strip():
+                    done.add(json.loads(line)["path"])
+    return done
+
+
+def run_batch(source, output, checkpoint=None, documents_in_flight=4, section_workers=max_workers, mode=extraction_mode,
+              top_k=retrieval_top_k, token_budget=retrieval_token_budget, stream=streaming, stop_early=False, tiering=model_tiering,
+              fast_path=fast_path, incremental=incremental, normalize=normalize_text, metrics_sink=None, store=None, log=sys.stderr):
+    # store, when given, is a ResultStore that completed records are added to in bulk
+    checkpoint = checkpoint or output + ".checkpoint"
+    done = load_checkpoint(checkpoint)
+    counts = {"completed": 0, "skipped": 0, "failed": 0}
+    started = time.monotonic()
+
+    metrics_sink = metrics_sink or default_sink()
+
+    def process(path, file_name):
+        metrics = Metrics(sink=metrics_sink, path=path)
+        # batch work queues behind interactive sessions sharing the same scheduler
+        with priority(PRIORITY_BATCH):
+            return run_pipeline(path, file_name, max_workers=section_workers, mode=mode, top_k=top_k, token_budget=token_budget,
+                                stream=stream, stop_early=stop_early, metrics=metrics, tiering=tiering,
+                                fast_path=fast_path, incremental=incremental, normalize=normalize)
+
+    with open(output, "a") as out, open(checkpoint, "a") as ckpt, ThreadPoolExecutor(max_workers=documents_in_flight) as executor:
+        pending = {}
+        # records waiting to be added to the store; the output file has them already, so a crash loses
+        # nothing that `mdima_store.py import` cannot reload
+        unstored = []
+
+        def drain(return_when):
+            finished, _ = wait(pending, return_when=return_when)
+            for future in finished:
+                path = pending.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    counts["failed"] += 1
+                    print(f"FAILED {path}: {type(e).__name__}: {e}", file=log)
+                    continue
+                if "Errors" in record:
+                    counts["failed"] += 1
+                    print(f"INCOMPLETE {path}: {json.dumps(record['Errors'])}", file=log)
+                    continue
+                # output first, then the checkpoint: a crash in between repeats a record rather than losing one
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                ckpt.write(json.dumps({"path": path, "document_hash": record["Document Hash"]}) + "\n")
+                ckpt.flush()
+                if store is not None:
+                    unstored.append(record)
+                    if len(unstored) >= BULK_ROWS:
+                        store.add_many(unstored)
+                        unstored.clear()
+                counts["completed"] += 1
+                print(f"done {path} ({counts['completed']} completed, {time.monotonic() - started:.0f}s)", file=log)
+
+        for path, file_name in iter_documents(source):
+            if path in done:
+                counts["skipped"] += 1
+                continue
+            # keep at most documents_in_flight documents queued so huge backfills stay bounded in memory
+            while len(pending) >= documents_in_flight:
+                drain(FIRST_COMPLETED)
+            pending[executor.submit(process, path, file_name)] = path
+        while pending:
+            drain(FIRST_COMPLETED)
+        if unstored:
+            store.add_many(unstored)
+
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="directory of PDFs or a manifest file")
+    parser.add_argument("--output", required=True, help="JSONL file that final_json records are appended to")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--documents-in-flight", type=int, default=4, help="documents processed at the same time")
+    parser.add_argument("--section-workers", type=int, default=max_workers, help="concurrent section extractors per document")
+    parser.add_argument("--mode", choices=EXTRACTION_MODES, default=extraction_mode, help="one request per section or one combined request")
+    parser.add_argument("--retrieval-top-k", type=int, default=retrieval_top_k, help="clauses sent per section, 0 sends the whole document")
+    parser.add_argument("--retrieval-token-budget", type=int, default=retrieval_token_budget, help="token budget for each section's clauses")
+    parser.add_argument("--stream", action="store_true", default=streaming, help="use streaming Bedrock responses")
+    parser.add_argument("--stop-early", action="store_true", help="with --stream, stop reading once <output> and <confidence> arrive")
+    parser.add_argument("--tiering", action="store_true", default=model_tiering, help="try a faster model first and escalate uncertain sections")
+    parser.add_argument("--fast-path", action="store_true", default=fast_path, help="answer dates and fee schedules with rules when they are complete")
+    parser.add_argument("--incremental", action="store_true", default=incremental, help="re-run only the sections whose pages changed in amended versions")
+    parser.add_argument("--no-normalize", action="store_false", dest="normalize", default=normalize_text,
+                        help="send the raw page text, without stripping headers, footers and page numbers")
+    parser.add_argument("--store", default=STORE_PATH, help="result store file that completed records are added to")
+    parser.add_argument("--no-store", action="store_false", dest="use_store", default=STORE_RESULTS, help="do not add records to the result store")
+    parser.add_argument("--metrics", help="JSONL file that per-stage timing and token records are appended to")
+    args = parser.parse_args(argv)
+
+    counts = run_batch(args.source, args.output, checkpoint=args.checkpoint,
+                       documents_in_flight=args.documents_in_flight, section_workers=args.section_workers, mode=args.mode,
+                       top_k=args.retrieval_top_k, token_budget=args.retrieval_token_budget,
+                       stream=args.stream, stop_early=args.stop_early, tiering=args.tiering, fast_path=args.fast_path,
+                       incremental=args.incremental, normalize=args.normalize, metrics_sink=JsonlSink(args.metrics) if args.metrics else None,
+                       store=ResultStore(args.store) if args.use_store else None)
+    print(json.dumps(counts), file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
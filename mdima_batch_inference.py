@@ -0,0 +1,323 @@
+"""Bedrock batch-inference export and import for overnight backfills.
+
+Usage:
+    python mdima_batch_inference.py export agreements/ --output-dir batch/ [--retrieval-top-k 8] [--fast-path]
+    python mdima_batch_inference.py simulate batch/ --recordings benchmarks/recordings/dima_sample.json
+    python mdima_batch_inference.py ingest batch/ [outputs/] --output results.jsonl
+
+export renders each agreement's five section requests (the same system prompts and request
+bodies the synchronous extractors send) into batch-inference JSONL input files, one
+{"recordId", "modelInput"} line per request, and writes manifest.jsonl next to them. Record ids
+are the section's cache key in base62, cut to 11 characters, so re-exporting the same document
+with the same settings gives the same ids, and identical requests are only exported once. Two
+different requests with the same id are not expected, but the second one is then left out and
+counted as a collision; ingest reports that section as missing, so its document is retried.
+Sections already in the cache, and with --fast-path the ones the rules answer, are not exported.
+
+Upload the records-*.jsonl files as the job input and download the job's *.jsonl.out files.
+ingest matches the output lines to the manifest by recordId, parses and validates every
+completion like the synchronous path (unusable ones get the usual repair prompt, as a synchronous
+call, unless --no-repair), caches the usable ones and writes one final_json record per complete
+document. Documents with a failed or missing section are listed in <output>.retry.jsonl, a
+manifest mdima_batch.py can re-run synchronously; the sections that did succeed come back from the
+cache at no cost. simulate answers the input files with the local FakeBedrock instead of a job, so
+the round trip can be run end to end without AWS access.
+"""
+import argparse
+import json
+import string
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import mdima_config
+from mdima_batch import iter_documents
+from mdima_cache import section_key
+from mdima_fake_bedrock import FakeBedrock
+from mdima_metrics import JsonlSink, Metrics, default_sink
+from mdima_parsing import COMPLETION_TAGS, check_completion, parse_tags
+from mdima_pipeline import (SECTION_PROMPTS, SECTIONS, _section_result, build_final_json, build_index, fast_path, get_cache, load_pages,
+                            model_id, normalize_text, prepare_text, read_source, repair_attempts, repair_completion, request_body,
+                            result_record, retrieval_token_budget, retrieval_top_k, run_fast_path, section_content)
+from mdima_store import BULK_ROWS, DEFAULT_PATH as STORE_PATH, STORE_RESULTS, ResultStore
+
+# batch-inference record ids are 11 character alphanumeric strings
+RECORD_ID_CHARS = 11
+RECORD_ID_DIGITS = string.digits + string.ascii_uppercase + string.ascii_lowercase
+# records per input file, keep it within the account's batch-inference records-per-file quota
+RECORDS_PER_FILE = int(os.getenv('batch_records_per_file', 50000))
+MANIFEST = "manifest.jsonl"
+
+
+def record_id(key):
+    # section cache keys are sha256 hex digests; base62 packs ~65 of their bits into the 11 characters, a hex prefix only 44
+    value = int(key, 16)
+    digits = []
+    for _ in range(RECORD_ID_CHARS):
+        value, digit = divmod(value, len(RECORD_ID_DIGITS))
+        digits.append(RECORD_ID_DIGITS[digit])
+    return "".join(digits)
+
+
+def document_requests(path, file_name, top_k=retrieval_top_k, token_budget=retrieval_token_budget, fast_path=fast_path, normalize=normalize_text,
+                      model_id=model_id, temperature=0.5, metrics=None):
+    """The manifest entry and batch records for one agreement.
+
+    The entry maps every section to its cache key (the record id is derived from it) and keeps the
+    fast-path completions; records maps the key of every section that is neither answered by the
+    rules nor already cached to its {"recordId", "modelInput"} request.
+    """
+    metrics = Metrics() if metrics is None else metrics
+    pdf = read_source(path)
+    document_hash, raw_pages = load_pages(pdf, metrics=metrics)
+    pages, text = prepare_text(raw_pages, metrics=metrics, normalize=normalize)
+    fast_results = run_fast_path(pdf, document_hash, pages, metrics=metrics) if fast_path else {}
+    index = build_index(pages, top_k=top_k, token_budget=token_budget)
+    entry = {"path": os.path.abspath(path), "file_name": file_name, "document_hash": document_hash, "model_id": model_id,
+             "temperature": temperature, "sections": {}, "fast_path": fast_results}
+    records = {}
+    for section in SECTIONS:
+        if section in fast_results:
+            continue
+        system_prompt, max_tokens = SECTION_PROMPTS[section]
+        content = section_content(section, text, index)
+        key = section_key(content, system_prompt, model_id, max_tokens, temperature)
+        entry["sections"][section] = key
+        if get_cache().get("section", key) is None:
+            records[key] = {"recordId": record_id(key), "modelInput": request_body(system_prompt, content, max_tokens, temperature)}
+    return entry, records
+
+
+def export_batch(source, output_dir, documents_in_flight=4, records_per_file=RECORDS_PER_FILE, top_k=retrieval_top_k,
+                 token_budget=retrieval_token_budget, fast_path=fast_path, normalize=normalize_text, model_id=model_id,
+                 metrics_sink=None, log=sys.stderr):
+    # writes records-00001.jsonl, ... and manifest.jsonl to output_dir; returns the counts
+    os.makedirs(output_dir, exist_ok=True)
+    metrics_sink = metrics_sink or default_sink()
+    counts = {"documents": 0, "failed": 0, "records": 0, "duplicates": 0, "collisions": 0, "cached": 0, "fast_path": 0, "files": 0}
+    # record id -> cache key of every request written so far
+    seen = {}
+    records_file = None
+    in_file = 0
+
+    def prepare(path, file_name):
+        return document_requests(path, file_name, top_k=top_k, token_budget=token_budget, fast_path=fast_path, normalize=normalize,
+                                 model_id=model_id, metrics=Metrics(sink=metrics_sink, path=path))
+
+    def write(path, future):
+        nonlocal records_file, in_file
+        try:
+            entry, records = future.result()
+        except Exception as e:
+            counts["failed"] += 1
+            print(f"FAILED {path}: {type(e).__name__}: {e}", file=log)
+            return
+        counts["documents"] += 1
+        counts["fast_path"] += len(entry["fast_path"])
+        counts["cached"] += len(entry["sections"]) - len(records)
+        for key, record in records.items():
+            if record["recordId"] in seen:
+                if seen[record["recordId"]] != key:
+                    # the output would be taken for the other request's; ingest treats the section as missing instead
+                    entry.setdefault("collisions", []).append(key)
+                    counts["collisions"] += 1
+                    print(f"COLLISION {path}: record id {record['recordId']} is shared by two different requests", file=log)
+                    continue
+                counts["duplicates"] += 1
+                continue
+            seen[record["recordId"]] = key
+            if records_file is None or in_file >= records_per_file:
+                if records_file is not None:
+                    records_file.close()
+                counts["files"] += 1
+                records_file = open(os.path.join(output_dir, f"records-{counts['files']:05d}.jsonl"), "w")
+                in_file = 0
+            records_file.write(json.dumps(record) + "\n")
+            in_file += 1
+            counts["records"] += 1
+        manifest.write(json.dumps(entry) + "\n")
+
+    with open(os.path.join(output_dir, MANIFEST), "w") as manifest, ThreadPoolExecutor(max_workers=documents_in_flight) as executor:
+        pending = deque()
+        try:
+            for path, file_name in iter_documents(source):
+                # documents are written in source order, with at most documents_in_flight being read ahead
+                pending.append((path, executor.submit(prepare, path, file_name)))
+                if len(pending) > documents_in_flight:
+                    write(*pending.popleft())
+            while pending:
+                write(*pending.popleft())
+        finally:
+            if records_file is not None:
+                records_file.close()
+    print(f"exported {counts['records']} records for {counts['documents']} documents to {output_dir}", file=log)
+    return counts
+
+
+def input_files(export_dir):
+    return sorted(os.path.join(export_dir, name) for name in os.listdir(export_dir) if name.startswith("records-") and name.endswith(".jsonl"))
+
+
+def read_outputs(paths):
+    # recordId -> output line, from batch output files or directories holding them (searched for *.out)
+    outputs = {}
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names if name.endswith(".out"))
+        else:
+            files = [path]
+        for name in files:
+            with open(name) as f:
+                for line in f:
+                    if line.strip():
+                        output = json.loads(line)
+                        outputs[output["recordId"]] = output
+    return outputs
+
+
+def section_result(section, key, output, model_id=model_id, temperature=0.5, repair=True):
+    # a section's result from its batch output line (or the cache), with the same checks as invoke_section
+    system_prompt, max_tokens = SECTION_PROMPTS[section]
+    attempt = {"model_id": model_id}
+    cached = get_cache().get("section", key)
+    problem = None
+    if cached is not None:
+        attempt["cached"] = True
+        completion = tuple(cached)
+    elif output is None:
+        return {"json": None, "confidence": "", "show_work": "", "error": f"no batch output for record {record_id(key)}", "stats": {"batch": True}}
+    elif "modelOutput" not in output:
+        error = output.get("error") or {}
+        return {"json": None, "confidence": "", "show_work": "",
+                "error": f"batch record {record_id(key)} failed: {error.get('errorCode')} {error.get('errorMessage')}", "stats": {"batch": True}}
+    else:
+        usage = output["modelOutput"].get("usage", {})
+        attempt.update(input_tokens=usage.get("input_tokens"), output_tokens=usage.get("output_tokens"))
+        llmOutput = output["modelOutput"]["content"][0]["text"]
+        tags = parse_tags(llmOutput)
+        problem = check_completion(section, tags)
+        if problem and repair:
+            tags, problem = repair_completion(section, system_prompt, llmOutput, tags, problem, max_tokens, temperature, model_id, stats=attempt)
+        elif problem:
+            attempt["parse_error"] = problem
+        completion = tuple(tags.get(tag, "") for tag in COMPLETION_TAGS)
+        if problem is None:
+            get_cache().set("section", key, list(completion))
+    try:
+        result = _section_result(section, completion)
+    except ValueError as e:
+        result = {"json": None, "confidence": "", "show_work": "", "error": f"{type(e).__name__}: {e}"}
+    result["stats"] = {"batch": True, **attempt, "attempts": [attempt]}
+    return result
+
+
+def ingest_document(entry, outputs, repair=True, metrics=None):
+    # the result record for one manifest entry
+    metrics = Metrics() if metrics is None else metrics
+    results = {}
+    with metrics.timer("document", file_name=entry["file_name"], mode="batch"):
+        for section in SECTIONS:
+            if section in entry["fast_path"]:
+                result = _section_result(section, tuple(entry["fast_path"][section]))
+                result["stats"] = {"batch": True, "fast_path": True}
+            else:
+                key = entry["sections"][section]
+                output = None if key in entry.get("collisions", ()) else outputs.get(record_id(key))
+                result = section_result(section, key, output, entry["model_id"], entry["temperature"], repair=repair)
+            results[section] = result
+            metrics.emit("section", section=section, error=result["error"], **result["stats"])
+    return result_record(build_final_json(results, entry["file_name"]), results, entry["document_hash"])
+
+
+def ingest_batch(export_dir, outputs, output, repair=True, store=None, metrics_sink=None, log=sys.stderr):
+    # appends complete records to output (and store), lists incomplete documents in <output>.retry.jsonl
+    metrics_sink = metrics_sink or default_sink()
+    outputs = read_outputs(outputs or [export_dir])
+    counts = {"completed": 0, "incomplete": 0}
+    started = time.monotonic()
+    unstored = []
+    with open(os.path.join(export_dir, MANIFEST)) as manifest, open(output, "a") as out, open(output + ".retry.jsonl", "a") as retry:
+        for line in manifest:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            record = ingest_document(entry, outputs, repair=repair, metrics=Metrics(sink=metrics_sink, path=entry["path"]))
+            if "Errors" in record:
+                counts["incomplete"] += 1
+                print(f"INCOMPLETE {entry['path']}: {json.dumps(record['Errors'])}", file=log)
+                retry.write(json.dumps({"path": entry["path"], "file_name": entry["file_name"]}) + "\n")
+                continue
+            out.write(json.dumps(record) + "\n")
+            counts["completed"] += 1
+            if store is not None:
+                unstored.append(record)
+                if len(unstored) >= BULK_ROWS:
+                    store.add_many(unstored)
+                    unstored.clear()
+    if unstored:
+        store.add_many(unstored)
+    print(f"ingested {counts['completed'] + counts['incomplete']} documents in {time.monotonic() - started:.1f}s", file=log)
+    return counts
+
+
+def simulate(export_dir, recordings, model_id=model_id, **options):
+    # answers every input file with FakeBedrock, writing <input file>.out next to it like a finished job
+    fake = FakeBedrock.from_file(recordings, **options)
+    return [fake.run_batch(path, path + ".out", model_id) for path in input_files(export_dir)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="write batch-inference input files and a manifest for a directory or manifest of PDFs")
+    export.add_argument("source", help="directory of PDFs or a manifest file (see mdima_batch.py)")
+    export.add_argument("--output-dir", required=True, help="directory for records-*.jsonl and manifest.jsonl")
+    export.add_argument("--documents-in-flight", type=int, default=4, help="documents read at the same time")
+    export.add_argument("--records-per-file", type=int, default=RECORDS_PER_FILE)
+    export.add_argument("--retrieval-top-k", type=int, default=retrieval_top_k, help="clauses sent per section, 0 sends the whole document")
+    export.add_argument("--retrieval-token-budget", type=int, default=retrieval_token_budget, help="token budget for each section's clauses")
+    export.add_argument("--fast-path", action="store_true", default=fast_path, help="answer dates and fee schedules with rules when they are complete")
+    export.add_argument("--no-normalize", action="store_false", dest="normalize", default=normalize_text,
+                        help="send the raw page text, without stripping headers, footers and page numbers")
+    export.add_argument("--model-id", default=model_id, help="model the batch job will run (part of the record ids)")
+    export.add_argument("--metrics", help="JSONL file that per-stage timing records are appended to")
+    sim = commands.add_parser("simulate", help="answer the input files with the local FakeBedrock, as a batch job would")
+    sim.add_argument("export_dir")
+    sim.add_argument("--recordings", required=True, help="FakeBedrock recordings file")
+    sim.add_argument("--model-id", default=model_id)
+    sim.add_argument("--error-rate", type=float, default=0.0, help="fraction of records that come back with an error")
+    sim.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of records with an unusable <output>")
+    sim.add_argument("--seed", type=int)
+    ingest = commands.add_parser("ingest", help="assemble final_json records from the batch output files")
+    ingest.add_argument("export_dir", help="the export's output directory (holds manifest.jsonl)")
+    ingest.add_argument("outputs", nargs="*", help="batch output files or directories of them (default: export_dir)")
+    ingest.add_argument("--output", required=True, help="JSONL file that complete records are appended to")
+    ingest.add_argument("--no-repair", action="store_false", dest="repair", default=repair_attempts > 0,
+                        help="report unusable completions instead of re-asking the model synchronously")
+    ingest.add_argument("--store", default=STORE_PATH, help="result store file that complete records are added to")
+    ingest.add_argument("--no-store", action="store_false", dest="use_store", default=STORE_RESULTS, help="do not add records to the result store")
+    ingest.add_argument("--metrics", help="JSONL file that per-section records are appended to")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        counts = export_batch(args.source, args.output_dir, documents_in_flight=args.documents_in_flight, records_per_file=args.records_per_file,
+                              top_k=args.retrieval_top_k, token_budget=args.retrieval_token_budget, fast_path=args.fast_path,
+                              normalize=args.normalize, model_id=args.model_id, metrics_sink=JsonlSink(args.metrics) if args.metrics else None)
+        print(json.dumps(counts), file=sys.stderr)
+        return 1 if counts["failed"] else 0
+    if args.command == "simulate":
+        for path in simulate(args.export_dir, args.recordings, model_id=args.model_id, error_rate=args.error_rate,
+                             malformed_rate=args.malformed_rate, seed=args.seed):
+            print(path)
+        return 0
+    counts = ingest_batch(args.export_dir, args.outputs, args.output, repair=args.repair,
+                          store=ResultStore(args.store) if args.use_store else None,
+                          metrics_sink=JsonlSink(args.metrics) if args.metrics else None)
+    print(json.dumps(counts), file=sys.stderr)
+    return 1 if counts["incomplete"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
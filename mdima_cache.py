@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import mdima_config
+
+# default location and limits, all of which can be overridden from the environment
+DEFAULT_PATH = os.getenv('cache_path', '.mdima_cache.sqlite3')
+DEFAULT_MAX_BYTES = int(os.getenv('cache_max_bytes', 512 * 1024 * 1024))
+DEFAULT_MAX_AGE = int(os.getenv('cache_max_age', 30 * 24 * 60 * 60))
+
+# run an eviction pass after this many writes
+EVICT_EVERY = 50
+
+
+def hash_bytes(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def section_key(text, system_prompt, model_id, max_tokens, temperature):
+    # everything that can change a section's completion goes into the key
+    parts = [hash_bytes(text), hash_bytes(system_prompt), model_id, str(max_tokens), str(temperature)]
+    return hash_bytes("\x1f".join(parts))
+
+
+class ResultCache:
+    """Disk-backed, content-addressed cache for PDF text and parsed section outputs."""
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL,"
+            " PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stats ("
+            " namespace TEXT PRIMARY KEY, hits INTEGER NOT NULL DEFAULT 0, misses INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.evict()
+
+    def get(self, namespace, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is not None and now - row[1] > self.max_age:
+                self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+                row = None
+            if row is None:
+                self._count(namespace, "misses")
+                return None
+            self._conn.execute(
+                "UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?", (now, namespace, key)
+            )
+            self._count(namespace, "hits")
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value):
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, data, len(data), now, now),
+            )
+            self._writes += 1
+            due = self._writes % EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        # drop expired entries, then least recently used ones until we are under the size budget
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.max_age,))
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self._conn.execute("SELECT namespace, key, size FROM entries ORDER BY accessed").fetchall()
+            stale = []
+            for namespace, key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                stale.append((namespace, key))
+                total -= size
+            self._conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", stale)
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT namespace, hits, misses FROM stats").fetchall()
+            sizes = self._conn.execute(
+                "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY namespace"
+            ).fetchall()
+        stats = {namespace: {"hits": hits, "misses": misses, "entries": 0, "bytes": 0} for namespace, hits, misses in rows}
+        for namespace, count, size in sizes:
+            stats.setdefault(namespace, {"hits": 0, "misses": 0})
+            stats[namespace].update(entries=count, bytes=size)
+        return stats
+
+    def _count(self, namespace, column):
+        self._conn.execute("INSERT OR IGNORE INTO stats (namespace) VALUES (?)", (namespace,))
+        self._conn.execute(f"UPDATE stats SET {column} = {column} + 1 WHERE namespace = ?", (namespace,))
@@ -0,0 +1,184 @@
+import re
+
+from mdima_retrieval import estimate_tokens
+
+# confidence values the section prompts ask for, best first
+CONFIDENCE_ORDER = ("High", "Medium", "Low")
+# answers that only say a window did not contain the field
+NOT_FOUND = re.compile(
+    r"^\s*(?:n/?a|none|unknown|other or not found|not\s+\w+|no\s+[\w\s]{0,40}?(?:mentioned|found|provided|specified|stated|identified))\b"
+    r"|^\s*(?:\(.*\))?\s*$",
+    re.I,
+)
+# numbered fields ("Objective1", "Objective2", ...) that are merged as one list across windows
+NUMBERED_FIELD = re.compile(r"^(.*?)(\d+)$")
+# fields holding a comma separated list of categories, merged as a union across windows
+CATEGORY_FIELDS = {("Fee", "Fee Structure")}
+# free-text fields where each window can describe a different part; their answers are joined in page order
+DESCRIPTIVE_FIELDS = {("Fee", "Compensation Details"), ("Custodian and Brokerage", "Custodian"), ("Custodian and Brokerage", "Brokerage")}
+
+
+def page_windows(pages, max_tokens, overlap_pages=1):
+    """Group {page number: text} into windows (lists of page numbers) of at most max_tokens each.
+
+    Consecutive windows share overlap_pages pages so a clause split across a page break is seen
+    whole by at least one window. A single page larger than max_tokens gets a window of its own.
+    """
+    numbers = sorted(pages)
+    windows = []
+    start = 0
+    while start < len(numbers):
+        end = start
+        tokens = 0
+        while end < len(numbers) and (end == start or tokens + estimate_tokens(pages[numbers[end]]) <= max_tokens):
+            tokens += estimate_tokens(pages[numbers[end]])
+            end += 1
+        windows.append(numbers[start:end])
+        if end == len(numbers):
+            break
+        # step back for the overlap, but always move forward
+        start = max(end - overlap_pages, start + 1)
+    return windows
+
+
+def window_text(pages, window):
+    # page markers let the model (and a reviewer) see where the excerpt comes from
+    return "\n".join(f'<page number="{number}">\n{pages[number]}\n</page>' for number in window)
+
+
+def _informative(value):
+    return not (isinstance(value, str) and NOT_FOUND.match(value))
+
+
+def _flatten(value, path=()):
+    # {path tuple: leaf value} for nested json objects
+    if isinstance(value, dict):
+        leaves = {}
+        for key, child in value.items():
+            leaves.update(_flatten(child, path + (key,)))
+        return leaves
+    return {path: value}
+
+
+def _unflatten(leaves):
+    value = {}
+    for path, leaf in leaves.items():
+        node = value
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = leaf
+    return value
+
+
+def _normalize(text):
+    return " ".join(str(text).lower().split())
+
+
+def _cite(value, pages, windows):
+    # pages of the contributing windows whose text contains the value, or all of their pages
+    window_pages = sorted({number for window in windows for number in window})
+    needle = _normalize(value)
+    found = [number for number in window_pages if needle and needle in _normalize(pages[number])]
+    return found or window_pages
+
+
+def _page_range(window):
+    return f"Page {window[0]}" if len(window) == 1 else f"Pages {window[0]}-{window[-1]}"
+
+
+def merge_partials(section_key, partials, pages):
+    """Reduce per-window answers for one section into a single answer in the section's schema.
+
+    partials is [(window, output json, confidence, show_work)] in window order; section_key is the
+    section's top-level output key. Returns (json, confidence, show_work, citations) where citations
+    maps each field ("Fee.Fee Structure") to the pages its value was taken from.
+    """
+    rank = {confidence: index for index, confidence in enumerate(CONFIDENCE_ORDER)}
+    # most confident first, earlier windows first among equals
+    ranked = sorted(range(len(partials)), key=lambda index: (rank.get(partials[index][2].strip(), len(rank)), index))
+    leaves = [_flatten(partial[1]) for partial in partials]
+    paths = list(dict.fromkeys(path for partial_leaves in leaves for path in partial_leaves))
+
+    merged = {}
+    citations = {}
+    contributors = set()
+    conflict = False
+    numbered = {}
+    for path in paths:
+        numbered_field = NUMBERED_FIELD.match(path[-1]) if len(path) > 1 else None
+        if numbered_field:
+            # collected below into one renumbered list
+            numbered.setdefault(path[:-1] + (numbered_field.group(1),), []).append(path)
+            continue
+        candidates = [(index, leaves[index][path]) for index in ranked if path in leaves[index]]
+        useful = [(index, value) for index, value in candidates if _informative(value)]
+        if path in CATEGORY_FIELDS:
+            categories = []
+            sources = set()
+            for index, value in sorted(useful):
+                for category in str(value).split(","):
+                    category = category.strip()
+                    if category and category.lower() not in [known.lower() for known in categories]:
+                        categories.append(category)
+                        sources.add(index)
+            if not categories:
+                merged[path] = candidates[0][1]
+                continue
+            merged[path] = ", ".join(categories)
+            contributors |= sources
+            citations[".".join(path)] = _cite("", pages, [partials[index][0] for index in sorted(sources)])
+            continue
+        if not useful:
+            merged[path] = candidates[0][1]
+            continue
+        if path in DESCRIPTIVE_FIELDS:
+            texts = []
+            sources = []
+            for index, value in sorted(useful):
+                if _normalize(value) not in [_normalize(text) for text in texts]:
+                    texts.append(str(value))
+                    sources.append(index)
+            merged[path] = " ".join(texts)
+            contributors.update(sources)
+            citations[".".join(path)] = _cite(merged[path] if len(texts) == 1 else "", pages, [partials[index][0] for index in sources])
+            continue
+        best_index, best = useful[0]
+        best_rank = rank.get(partials[best_index][2].strip())
+        if any(_normalize(value) != _normalize(best) and rank.get(partials[index][2].strip()) == best_rank for index, value in useful[1:]):
+            # two equally confident windows disagree
+            conflict = True
+        merged[path] = best
+        contributors.add(best_index)
+        citations[".".join(path)] = _cite(best, pages, [partials[best_index][0]])
+
+    for (*parent, name), field_paths in numbered.items():
+        values = []
+        sources = []
+        for index, partial_leaves in enumerate(leaves):
+            for path in field_paths:
+                value = partial_leaves.get(path)
+                if path in partial_leaves and _informative(value) and _normalize(value) not in (_normalize(v) for v in values):
+                    values.append(value)
+                    sources.append(index)
+                    contributors.add(index)
+        if not values:
+            # every window said "not found"; keep the most confident window's answer
+            first = next(index for index in ranked if any(path in leaves[index] for path in field_paths))
+            values = [leaves[first][path] for path in field_paths if path in leaves[first]][:1]
+            sources = [first]
+        for number, (value, index) in enumerate(zip(values, sources), start=1):
+            path = tuple(parent) + (f"{name}{number}",)
+            merged[path] = value
+            citations[".".join(path)] = _cite(value, pages, [partials[index][0]])
+
+    used = sorted(contributors) or ranked[:1]
+    worst = max(rank.get(partials[index][2].strip(), len(rank) - 1) for index in used)
+    confidence = CONFIDENCE_ORDER[min(worst, len(rank) - 1)]
+    if conflict and confidence == "High":
+        confidence = "Medium"
+    show_work = "\n".join(f"{_page_range(partials[index][0])}: {partials[index][3].strip()}" for index in used if partials[index][3].strip())
+    if conflict:
+        show_work += "\nWindows disagreed on at least one field; the most confident answer was kept."
+    output = _unflatten(merged)
+    output.setdefault(section_key, {})
+    return output, confidence, show_work, citations
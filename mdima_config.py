@@ -0,0 +1,9 @@
+"""Loads .env into the environment.
+
+Every module that reads its settings with os.getenv at import time imports this one before
+anything else of ours, so the .env values are in place whichever module a process imports first.
+Variables already set in the environment win over .env.
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
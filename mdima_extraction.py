@@ -1,482 +1,207 @@
-import boto3
-import botocore
-import json
-import streamlit as st
-import pdfplumber
-from dotenv import load_dotenv
 import os
 
-# loading in environment variables
-load_dotenv()
-# setting default session with AWS CLI Profile
-boto3.setup_default_session(profile_name=os.getenv('profile_name'))
-# Setup Bedrock client
-config = botocore.config.Config(connect_timeout=300, read_timeout=300)
-bedrock = boto3.client('bedrock-runtime' , 'us-east-1', config = config)
-
-
-
-def parse_xml(xml, tag):
-  start_tag = f"<{tag}>"
-  end_tag = f"</{tag}>"
-  
-  start_index = xml.find(start_tag)
-  if start_index == -1:
-    return ""
-
-  end_index = xml.find(end_tag)
-  if end_index == -1:
-    return ""
-
-  value = xml[start_index+len(start_tag):end_index]
-  return value
-
-
-def extract(pdf, file_name):
+import streamlit as st
+import mdima_config
+from mdima_jobs import LOCAL_WORKERS, JobStore, launch_workers
+from mdima_metrics import Metrics, default_sink
+from mdima_store import STORE_RESULTS, ResultStore
+from mdima_pipeline import (EXTRACTION_MODES, SECTIONS, extraction_mode, fast_path, get_bedrock, get_cache, incremental, max_workers,
+                            model_tiering, normalize_text, retrieval_token_budget, retrieval_top_k, run_pipeline, streaming)
+
+# label shown in the status panel when each section completes
+SECTION_LABELS = {
+    "Party": "Party Information Extracted",
+    "Objective": "Investment Objectives Categorized",
+    "Custodian and Brokerage": "Custodian and Brokerage Information Extracted",
+    "Fee": "Fee Details Extracted",
+    "Effective Date": "Effective Date Extracted",
+}
+# run extractions as background jobs (see mdima_jobs) so they survive reruns and page refreshes;
+# job_queue=false runs them inline in the script thread instead
+job_queue = os.getenv('job_queue', 'true').lower() == 'true'
+# seconds between job status checks while a job is queued or running
+JOB_POLL_SECONDS = 2
+
+
+@st.cache_resource
+def job_store():
+    # one store, and unless jobs_local_workers=0 one set of worker processes, per Streamlit server
+    if LOCAL_WORKERS:
+        launch_workers(LOCAL_WORKERS)
+    return JobStore()
+
+
+@st.cache_resource
+def result_store():
+    # extracted agreements, kept for the search panel (the job workers add theirs to the same file)
+    return ResultStore()
+
+
+def show_result(section, result):
+    label = SECTION_LABELS[section]
+    if result["error"]:
+        st.write(f":x: {label} Failed")
+        st.error(f"{section}: {result['error']}")
+        return
+    st.write(f":heavy_check_mark: {label}")
+    st.json(result["json"])
+    st.write(f"Confidence: {result['confidence']}")
+    if result["show_work"]:
+        st.write(f"Explanation: {result['show_work']}")
+    if result.get("citations"):
+        st.caption("Pages: " + "; ".join(f"{field} p. {', '.join(map(str, pages))}" for field, pages in result["citations"].items()))
+
+
+def show_amendment(amendment):
+    # what changed since the previous version of the agreement, field by field
+    st.write(f"Compared with {amendment['Previous File Name']} ({amendment['Previous Document Hash'][:12]})")
+    st.write(f"Changed pages: {', '.join(map(str, amendment['Changed Pages'])) or 'none'}; "
+             f"removed pages: {', '.join(map(str, amendment['Removed Pages'])) or 'none'}")
+    st.write(f"Re-extracted: {', '.join(amendment['Re-extracted']) or 'none'}; reused: {', '.join(amendment['Reused']) or 'none'}")
+    st.dataframe([{"field": field, **entry} for field, entry in amendment["Fields"].items()])
+
+
+def show_performance(summary):
+    st.write("Totals")
+    st.json(summary["totals"])
+    st.write("Stages")
+    st.dataframe([{"stage": stage, **values} for stage, values in summary["stages"].items()])
+    st.write("Sections")
+    st.dataframe(summary["sections"])
+    if summary["tiering"]["sections"]:
+        st.write("Model Tiering")
+        st.json(summary["tiering"])
+    if summary["fast_path"]["sections"]:
+        st.write("Fast Path")
+        st.json(summary["fast_path"])
+    if summary["parsing"]["parse_failures"] or summary["parsing"]["combined_fallbacks"]:
+        st.write("Parse Failures and Repairs")
+        st.json(summary["parsing"])
+    if summary["normalization"]["documents"]:
+        st.write("Text Normalization")
+        st.json(summary["normalization"])
+
+
+
+def extract(pdf, file_name, max_workers=max_workers, mode=extraction_mode, top_k=retrieval_top_k, token_budget=retrieval_token_budget,
+            stream=streaming, stop_early=False, tiering=model_tiering, fast=fast_path, amended=incremental, normalize=normalize_text):
    # Open the PDF file
-    text = ""
     with st.status("Processing PDF", expanded=False, state="running") as status:
-        with pdfplumber.open(pdf) as pdf:
-        # Loop through each page in the PDF
-            for page in pdf.pages:
-                # Extract the text from the page
-                #concat the full text
-                text = text + page.extract_text()
-
+        metrics = Metrics(sink=default_sink(), file_name=file_name)
+        completed = []
+        shown_early = set()
 
-                # Print the extracted text
-                print(text)
-
-        #save text to streamlit session state
-        if 'text' not in st.session_state:
+        def show_pages(pages, text):
+            #save text to streamlit session state, replacing any earlier upload
             st.session_state['text'] = text
-        
-        status.update(label=":heavy_check_mark: PDF Processing Complete", state="running", expanded=False)
-        st.write(":heavy_check_mark: PDF Processing Complete")
-
-        #extract info on the parties involved
-        status.update(label="Extracting Party Information", state="running", expanded=False)
-        scratch, party_output, party_confidence, party_work=extract_party_info(text)
-        st.write(f":heavy_check_mark: Party Information Extracted")
-        json_party=json.loads(party_output)
-        st.json(json_party)
-        st.write(f"Confidence: {party_confidence}")
-        st.write(f"Explanation: {party_work}")
-
-        #Categorize Investment Objectives
-        status.update(label="Categorizing Investment Objectives", state="running", expanded=False)
-        scratch, objective_output, objective_confidence,objective_work=extract_investment_objectives(text)
-        st.write(f":heavy_check_mark: Investment Objectives Categorized")
-        json_objective=json.loads(objective_output)
-        st.json(json_objective)
-        st.write(f"Confidence: {objective_confidence}")
-        st.write(f"Explanation: {objective_work}")
-
-        #Custodian and Brokerage infromation
-        status.update(label="Extracting Custodian and Brokerage Information", state="running", expanded=False)
-        scratch, custodian_output, custodian_confidence, custodian_work=extract_custodian_info(text)
-        st.write(f":heavy_check_mark: Custodian and Brokerage Information Extracted")
-        json_custodian=json.loads(custodian_output)
-        st.json(json_custodian)
-        st.write(f"Confidence: {custodian_confidence}")
-        st.write(f"Explanation: {custodian_work}")
-
-        #Fee Details
-        status.update(label="Extracting Fee Details", state="running", expanded=False)
-        scratch, fee_output, fee_confidence, fee_work=extract_fee_info(text)
-        st.write(f":heavy_check_mark: Fee Details Extracted")
-        json_fee=json.loads(fee_output)
-        st.json(json_fee)
-        st.write(f"Confidence: {fee_confidence}")
-        st.write(f"Explanation: {fee_work}")
-
-        #Effective Date
-        status.update(label="Extracting Effective Date", state="running", expanded=False)
-        scratch, effective_output, effective_confidence, effective_work=extract_effective_date(text)
-        st.write(f":heavy_check_mark: Effective Date Extracted")
-        json_effective=json.loads(effective_output)
-        st.json(json_effective)
-        st.write(f"Confidence: {effective_confidence}")
-        st.write(f"Explanation: {effective_work}")
+            st.session_state['pages'] = pages
+
+            status.update(label=":heavy_check_mark: PDF Processing Complete", state="running", expanded=False)
+            st.write(":heavy_check_mark: PDF Processing Complete")
+            #the section extractors run concurrently, each one reports back as soon as it finishes
+            status.update(label=f"Extracting Agreement Details (0/{len(SECTIONS)})", state="running", expanded=False)
+
+        def show_partial(section, partial):
+            # streamed output and confidence, rendered before the explanation has arrived
+            shown_early.add(section)
+            st.write(f":heavy_check_mark: {SECTION_LABELS[section]}")
+            st.json(partial["json"])
+            st.write(f"Confidence: {partial['confidence']}")
+
+        def show_section(section, result):
+            if section not in shown_early or result["error"]:
+                show_result(section, result)
+            elif result["show_work"]:
+                st.write(f"Explanation: {result['show_work']}")
+            if not result["error"]:
+                stats = result.get("stats", {})
+                if stats.get("reused"):
+                    st.caption(f"{section}: source pages unchanged since the previous version, previous result reused")
+                elif stats.get("fast_path"):
+                    st.caption(f"{section}: answered by the fast-path rules, no model call")
+                if stats.get("escalated"):
+                    reasons = ", ".join(attempt["escalation_reason"] for attempt in stats["attempts"][:-1])
+                    st.caption(f"{section}: answered by {stats.get('model_id', 'a larger model')} after escalating ({reasons})")
+                if stats.get("repaired"):
+                    st.caption(f"{section}: output repaired after a parse failure ({stats['parse_error']})")
+                if "time_to_result" in stats:
+                    st.caption(f"{section}: output after {stats['time_to_result']:.1f}s, last token after {stats['time_to_last_token']:.1f}s")
+            completed.append(section)
+            status.update(label=f"Extracting Agreement Details ({len(completed)}/{len(SECTIONS)})", state="running", expanded=False)
+
+        record = run_pipeline(pdf, file_name, max_workers=max_workers, on_section=show_section, mode=mode, top_k=top_k, token_budget=token_budget,
+                              stream=stream, stop_early=stop_early, metrics=metrics, tiering=tiering, fast_path=fast, incremental=amended,
+                              normalize=normalize, on_partial=show_partial, on_pages=show_pages)
+        amendment = record.get("Amendment")
 
         #create final json
         status.update(label="Creating Final JSON", state="running", expanded=False)
-        combined_json = final_json(json_party, json_objective, json_custodian, json_fee, json_effective, file_name)
+        combined_json = {key: record[key] for key in ("File Name", "Data")}
         st.write(f":heavy_check_mark: Final JSON Created")
         st.json(combined_json)
+        # like the batch CLI, only complete records go to the store
+        if STORE_RESULTS and "Errors" not in record:
+            result_store().add(record)
 
         status.update(label=":heavy_check_mark: Details Extracted", state="complete", expanded=False)
 
     with st.expander("Full JSON Payload"):
         st.json(combined_json)
 
-
-
-def extract_party_info(content):
-
-    system_prompt="""
-You are an AI Data Processor whose goal is to identify and extract key information from an Investment Management Agreement for a wealth management client. You will be provided a Wealth Management Agreement (DIMA, IMA, or MDIMA)
-Using the context of the provided agreement Identify and Extract the following information and return it in json format:
-    Parties Involved
-        Client Name (name of the person acting as or on behalf of the client - often times this will be the Signee for the Client)
-        Client Firm (Client Firm name, "individual" if no associated client firm)
-        Investment Manager Name (name of the person acting as or on behalf of the client - often times this will be the Signee for the Investment Firm)
-        Investment Manager Firm (Investment Firm name, "individual" if no associated investment firm)
-
-<example_format>
-{
-  "Parties Involved": {
-    "Client Name": "(Client Name)",
-    "Client Firm": "(Client Firm Name or "individual")",
-    "Investment Manager Name": "(Investment Manager Name)",
-    "Investment Manager Firm": "(Investment Management Firm, or "individual")"
-  }
-}
-</example_format>
-
-Also return your confidence level representing how confident you that you were able to accurately identify and categorize the requested information. Your confidence value should be one of "High", "Medium", or "Low"
-Use High Confidence in cases you have no doubt you have identified and captured ALL the correct information and there was no ambiguity and there is no need for a human to review
-Use Medium Confidence in cases where you are reasonably confident you have identified most of the information, but there might be some ambiguity and a human review would be beneficial
-Use Low Confidence in cases where you are not confident in the information you have captured or the data provided didn't include enough information, and a human needs to review
-
-
-Think through each step of your thought process and write your thoughts down in <scratchpad> xml tags
-return the valid json array with the extracted details in <output> xml tags, only including the valid json
-return your confidence level (Low, Medium, or High) in <confidence> xml tags
-record your explanation for your response and cite your work and reasoning in <show_work> xml tags
-
-"""
-
-    
-    prompt = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 2000,
-        "temperature": 0.5,
-        "system": system_prompt,
-        "messages": [    
-            {
-                "role": "user",
-                "content": f"<document> {content} </document>"
-            }
-        ]
-    }
-
-    prompt = json.dumps(prompt)
-
-    print("------------------------------------------------------")
-
-    response = bedrock.invoke_model(body=prompt, modelId="anthropic.claude-3-sonnet-20240229-v1:0", accept="application/json", contentType="application/json")
-    response_body = json.loads(response.get('body').read())
-    llmOutput=response_body['content'][0]['text']
-
-    
-    scratch = parse_xml(llmOutput, "scratchpad")
-    output = parse_xml(llmOutput, "output")
-    confidence = parse_xml(llmOutput, "confidence")
-    show_work = parse_xml(llmOutput, "show_work")
-
-    return scratch, output, confidence, show_work
-
-
-
-def extract_investment_objectives(content):
-
-    system_prompt="""
-You are an AI Data Processor whose goal is to identify and extract key information from an Investment Management Agreement for a wealth management client. You will be provided a Wealth Management Agreement (DIMA, IMA, or MDIMA)
-Using the document context of the provided agreement Categorize the Investment Objective using valid categories provided in <valid_categories> -- do not make any assumptions when determining your categorization (if no objective is mentioned or there are reference to other documents not provided that would contain this information select "Other or Not Found" and use a "Low" confidence rating)
-Return your Categorization in a valid json object using the <example_format> provided below 
-If multiple categories apply, include all applicable categories in the json object
-
-Only the below categories are valid options
-<valid_categories>
-Capital Preservation
-Income Generation
-Growth
-Balanced Growth and Income
-Aggressive Growth
-Tax-efficient investing
-Socially Responsible Investing
-Retirement Planning
-Education Funding
-Other or Not Found
-</valid_categories>
-
-<example_format>
-{
-  "Investment Objectives": {
-    "Objective1": "(Objective)",
-    "ObjectiveX": "(Objective - X representing the next number in order, only include these if there were multiple categories identified)"
-  }
-}
-</example_format>
-
-Also return your confidence level representing how confident you that you were able to accurately identify and categorize the requested information. Your confidence value should be one of "High", "Medium", or "Low"
-Use High Confidence in cases you have no doubt you have identified and captured ALL the correct information and there was no ambiguity and there is no need for a human to review
-Use Medium Confidence in cases where you are reasonably confident you have identified most of the information, but there might be some ambiguity and a human review would be beneficial
-Use Low Confidence in cases where you are not confident in the information you have captured or the data provided didn't include enough information, and a human needs to review
-
-
-Think through each step of your thought process and write your thoughts down in <scratchpad> xml tags
-return the valid json array with the extracted details in <output> xml tags, only including the valid json
-return your confidence level (Low, Medium, or High) in <confidence> xml tags
-record your explanation for your response and cite your work and reasoning in <show_work> xml tags
-
-"""
-
-    
-    prompt = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 2000,
-        "temperature": 0.5,
-        "system": system_prompt,
-        "messages": [    
-            {
-                "role": "user",
-                "content": f"<document> {content} </document>"
-            }
-        ]
-    }
-
-    prompt = json.dumps(prompt)
-
-    print("------------------------------------------------------")
-
-    response = bedrock.invoke_model(body=prompt, modelId="anthropic.claude-3-sonnet-20240229-v1:0", accept="application/json", contentType="application/json")
-    response_body = json.loads(response.get('body').read())
-    llmOutput=response_body['content'][0]['text']
-
-    
-    scratch = parse_xml(llmOutput, "scratchpad")
-    output = parse_xml(llmOutput, "output")
-    confidence = parse_xml(llmOutput, "confidence")
-    show_work = parse_xml(llmOutput, "show_work")
-
-    return scratch, output, confidence, show_work
-
-
-def extract_custodian_info(content):
-
-    system_prompt="""
-You are an AI Data Processor whose goal is to identify and extract key information from an Investment Management Agreement for a wealth management client. You will be provided a Wealth Management Agreement (DIMA, IMA, or MDIMA)
-Using the document context of the provided agreement Identify and extract (making no changes) the details of information relevant to the roles, respososbilites, and all other information pertatining to the Custodian and Brokerage agreements present in the agreement. Make sure to capture all pertinent agreement information and relevant passages
-Return your Results in a valid json object using the <example_format> provided below
-
-<custodian_example>
-"1. The assets comprising the Client's account shall be held by ABC Trust Company, a nationally recognized custodian, or such other custodian as the parties may mutually agree upon in writing." 
-"2. XYZ Custodial Services, LLC, shall act as the custodian for the Client's account and shall provide custody and safekeeping services for the assets in the account." 
-"3. The Client's assets shall be held in a separate account at DEF Bank, a member of the Federal Deposit Insurance Corporation (FDIC)."
-</custodian_example>
-
-
-<brokerage_example>
-"1. All transactions for the Client's account shall be executed through GHI Brokerage Firm, a registered broker-dealer and member of the Financial Industry Regulatory Authority (FINRA)." 
-"2. The Investment Manager is authorized to select and utilize various broker-dealers for the execution of transactions on behalf of the Client's account, provided that such broker-dealers are registered with the Securities and Exchange Commission (SEC) and are members of FINRA." 
-"3. JKL Securities, LLC, shall serve as the introducing broker-dealer for the Client's account, and all transactions shall be cleared and settled through MNO Clearing Corporation."
-
-</brokerage_example>
-
-<example_format>
-{
-    "Custodian and Brokerage": {
-        "Custodian": "(Information Pertinent to the Custodian agreements)",
-        "Brokerage": "(Information Pertinent to the Brokerage agreements)"
-    }
-}
-</example_format>
-
-Also return your confidence level representing how confident you that you were able to accurately identify and extract the requested information. Your confidence value should be one of "High", "Medium", or "Low"
-Use High Confidence in cases you have no doubt you have identified and captured ALL the correct information and there was no ambiguity and there is no need for a human to review
-Use Medium Confidence in cases where you are reasonably confident you have identified most of the information, but there might be some ambiguity and a human review would be beneficial
-Use Low Confidence in cases where you are not confident in the information you have captured, and a human needs to review
-
-
-Think through each step of your thought process and write your thoughts down in <scratchpad> xml tags
-return the valid json array with the extracted details in <output> xml tags, only including the valid json
-return your confidence level (Low, Medium, or High) in <confidence> xml tags
-record your explanation for your response and cite your work and reasoning in <show_work> xml tags, ask yourself did i capture ALL of the pertinent Custodian and Brokerage information in the agreement?
-
-"""
-
-    
-    prompt = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 3000,
-        "temperature": 0.5,
-        "system": system_prompt,
-        "messages": [    
-            {
-                "role": "user",
-                "content": f"<document> {content} </document>"
-            }
-        ]
-    }
-
-    prompt = json.dumps(prompt)
-
-    print("------------------------------------------------------")
-
-    response = bedrock.invoke_model(body=prompt, modelId="anthropic.claude-3-sonnet-20240229-v1:0", accept="application/json", contentType="application/json")
-    response_body = json.loads(response.get('body').read())
-    llmOutput=response_body['content'][0]['text']
-
-    
-    scratch = parse_xml(llmOutput, "scratchpad")
-    output = parse_xml(llmOutput, "output")
-    confidence = parse_xml(llmOutput, "confidence")
-    show_work = parse_xml(llmOutput, "show_work")
-
-    return scratch, output, confidence, show_work
-
-
-def extract_fee_info(content):
-
-    system_prompt="""
-You are an AI Data Processor whose goal is to identify and extract key information from an Investment Management Agreement for a wealth management client. You will be provided a Wealth Management Agreement (DIMA, IMA, or MDIMA)
-Using the document context of the provided agreement Extract the Fee Structure and Compensation details in the agreement and Categorize the Fee type
-Categorize the Fee Structure into one of the provided categories (Dont make assumptions - if no objective is mentioned or there are reference to other documents not provided that would contain this information select "Other or Not Found" and use a "Low" confidence rating)
-Return your Categorization in a valid json object using the <example_format> provided below 
-If multiple categories apply, include all applicable categories in the json object
-
-Only the below categories are valid options
-<valid_categories>
-Asset-based Fee
-Tiered Asset-based Fee
-Performance-based fee
-Fixed Fee
-Hourly or Project-based Fee
-Subscription or Retainer Fee
-Transaction-based Fee
-Additional Expenses
-Other or Not Found
-</valid_categories>
-
-<example_format>
-{
-  "Fee": {
-    "Fee Structure": "(Identified Fee Structure, if multiple apply include as comma separated value)",
-    "Compensation Details": "(Details of the Fee Structure and Compensation - Example: "The Investment Manager's fee shall be calculated based on the following tiered schedule: - First $1,000,000 of assets: [X%] - Next $2,000,000 of assets: [Y%] - Assets over $3,000,000: [Z%]")"
-  }
-}
-</example_format>
-
-Also return your confidence level representing how confident you that you were able to accurately identify and extract, and categorize the requested information. Your confidence value should be one of "High", "Medium", or "Low"
-Use High Confidence in cases you have no doubt you have identified and captured ALL the correct information and there was no ambiguity and there is no need for a human to review
-Use Medium Confidence in cases where you are reasonably confident you have identified most of the information, but there might be some ambiguity and a human review would be beneficial
-Use Low Confidence in cases where you are not confident in the information you have captured or the data provided didn't include enough information, and a human needs to review
-
-
-Think through each step of your thought process and write your thoughts down in <scratchpad> xml tags
-return the valid json array with the extracted details in <output> xml tags, only including the valid json
-return your confidence level (Low, Medium, or High) in <confidence> xml tags
-record your explanation for your response and cite your work and reasoning in <show_work> xml tags
-
-"""
-
-    
-    prompt = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 2000,
-        "temperature": 0.5,
-        "system": system_prompt,
-        "messages": [    
-            {
-                "role": "user",
-                "content": f"<document> {content} </document>"
-            }
-        ]
-    }
-
-    prompt = json.dumps(prompt)
-
-    print("------------------------------------------------------")
-
-    response = bedrock.invoke_model(body=prompt, modelId="anthropic.claude-3-sonnet-20240229-v1:0", accept="application/json", contentType="application/json")
-    response_body = json.loads(response.get('body').read())
-    llmOutput=response_body['content'][0]['text']
-
-    
-    scratch = parse_xml(llmOutput, "scratchpad")
-    output = parse_xml(llmOutput, "output")
-    confidence = parse_xml(llmOutput, "confidence")
-    show_work = parse_xml(llmOutput, "show_work")
-
-    return scratch, output, confidence, show_work
-
-
-def extract_effective_date(content):
-
-    system_prompt="""
-You are an AI Data Processor whose goal is to identify and extract key information from an Investment Management Agreement for a wealth management client. You will be provided a Wealth Management Agreement (DIMA, IMA, or MDIMA)
-Using the document context of the provided agreement Identify and extract (making no changes)Effective Date of the Agreement
-Also capture the signature dates for the Client and the Investment Firm
-Return your Results in a valid json object using the <example_format> provided below
-
-<example_format>
-{
-    "Effective Date": {
-        "Effective Date": "(The Effective Date of the Agreement)",
-        "Client Signature Date": "(The Date the Client Signed the Agreement)",
-        "Investment Firm Signature Date": "(The Date the Investment Firm Signed the agreement)"
-    }
-}
-</example_format>
-
-Also return your confidence level representing how confident you that you were able to accurately identify and extract the requested information. Your confidence value should be one of "High", "Medium", or "Low"
-Use High Confidence in cases you have no doubt you have identified and captured ALL the correct information and there was no ambiguity and there is no need for a human to review
-Use Medium Confidence in cases where you are reasonably confident you have identified most of the information, but there might be some ambiguity and a human review would be beneficial
-Use Low Confidence in cases where you are not confident in the information you have captured or the data provided didn't include enough information, and a human needs to review
-
-
-Think through each step of your thought process and write your thoughts down in <scratchpad> xml tags
-return the valid json array with the extracted details in <output> xml tags, only including the valid json
-return your confidence level (Low, Medium, or High) in <confidence> xml tags
-record your explanation for your response and cite your work and reasoning in <show_work> xml tags
-
-"""
-
-    
-    prompt = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 3000,
-        "temperature": 0.5,
-        "system": system_prompt,
-        "messages": [    
-            {
-                "role": "user",
-                "content": f"<document> {content} </document>"
-            }
-        ]
-    }
-
-    prompt = json.dumps(prompt)
-
-    print("------------------------------------------------------")
-
-    response = bedrock.invoke_model(body=prompt, modelId="anthropic.claude-3-sonnet-20240229-v1:0", accept="application/json", contentType="application/json")
-    response_body = json.loads(response.get('body').read())
-    llmOutput=response_body['content'][0]['text']
-
-    
-    scratch = parse_xml(llmOutput, "scratchpad")
-    output = parse_xml(llmOutput, "output")
-    confidence = parse_xml(llmOutput, "confidence")
-    show_work = parse_xml(llmOutput, "show_work")
-
-    return scratch, output, confidence, show_work
-
-
-def final_json(party_json, objective_json, custodian_json, fee_json, effective_date_json, file_name):
-    final_json = {
-        "File Name": file_name,
-        "Data": {
-            "Party": party_json,
-            "Objective": objective_json,
-            "Custodian and Brokerage": custodian_json,
-            "Fee": fee_json,
-            "Effective Date": effective_date_json
-        }
-    }
-    return final_json
+    if amendment:
+        with st.expander("Changes Since Previous Version", expanded=True):
+            show_amendment(amendment)
+
+    with st.expander("Performance"):
+        show_performance(metrics.summary())
+        if hasattr(get_bedrock(), "stats"):
+            # shared by every session in this server process
+            st.write("Bedrock Scheduler")
+            st.json(get_bedrock().stats())
+
+    with st.expander("Cache Statistics"):
+        st.json(get_cache().stats())
+
+
+def show_job(job):
+    # renders a job from the store: its progress while it runs, its results once it is done
+    finished = job["status"] in ("done", "failed")
+    sections = job["sections"]
+    if job["status"] == "queued":
+        label = f"Queued: {job['file_name']} ({job_store().counts()['queued']} jobs waiting)"
+    elif job["status"] == "running":
+        label = f"Extracting Agreement Details ({len(sections)}/{len(SECTIONS)})"
+    elif job["status"] == "done":
+        label = ":heavy_check_mark: Details Extracted"
+    else:
+        label = ":x: Extraction Failed"
+    state = {"done": "complete", "failed": "error"}.get(job["status"], "running")
+    with st.status(label, expanded=not finished, state=state):
+        for section in SECTIONS:
+            if section in sections:
+                show_result(section, sections[section])
+        if job["error"]:
+            # a failed attempt that is being retried, or the final error
+            st.error(f"Attempt {job['attempts']}: {job['error']}")
+    if job["status"] != "done":
+        return
+    with st.expander("Full JSON Payload", expanded=True):
+        st.json(job["result"])
+    if "Amendment" in job["result"]:
+        with st.expander("Changes Since Previous Version", expanded=True):
+            show_amendment(job["result"]["Amendment"])
+    if job["summary"]:
+        with st.expander("Performance"):
+            show_performance(job["summary"])
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def poll_job(job_id):
+    # re-renders from the store every few seconds, then reruns the page once so polling stops
+    job = job_store().get(job_id)
+    show_job(job)
+    if job["status"] in ("done", "failed"):
+        st.rerun()
 
 
 
@@ -486,10 +211,62 @@ st.title(f""":rainbow[Investment Management  Entity Extraction]""")
 
 st.write("---")
 uploaded_file = st.file_uploader('Upload a .pdf file', type="pdf")
+mode = st.radio("Extraction mode", EXTRACTION_MODES, index=EXTRACTION_MODES.index(extraction_mode), horizontal=True,
+                help="sections: one request per section. combined: one request for every section, with per-section retries for anything missing. "
+                     "chunked: every section over overlapping page windows, merged with page citations (for very long agreements)")
+with st.expander("Model Tiering"):
+    tiering = st.checkbox("Run each section on a faster model first and escalate only Low/Medium confidence or invalid answers", value=model_tiering)
+with st.expander("Fast Path"):
+    fast = st.checkbox("Extract effective/signature dates and fee schedules with rules first and skip the model when they are complete", value=fast_path)
+with st.expander("Amended Agreements"):
+    amended = st.checkbox("Diff against the earlier version of this agreement and only re-extract sections whose pages changed", value=incremental)
+with st.expander("Text Normalization"):
+    normalize = st.checkbox("Strip running headers, footers and page numbers, rejoin hyphenated words and collapse whitespace before extraction",
+                            value=normalize_text)
+with st.expander("Streaming"):
+    stream = st.checkbox("Stream responses and show each section's output as soon as it arrives", value=streaming)
+    stop_early = st.checkbox("Stop each response once its output and confidence have arrived (skips the explanation)", value=False, disabled=not stream)
+with st.expander("Clause Retrieval"):
+    top_k = st.number_input("Passages per section (0 sends the whole document)", min_value=0, max_value=50, value=retrieval_top_k)
+    token_budget = st.number_input("Token budget per section", min_value=250, max_value=50000, value=retrieval_token_budget, step=250)
 st.write("---")
 
 go=st.button("Go!")
 if go and uploaded_file is not None:
     st.balloons()
     file_name = uploaded_file.name
-    extract(uploaded_file, file_name)
+    if job_queue:
+        # the job id lives in the URL, so a rerun, a refresh or another tab picks the same job back up
+        st.query_params["job"] = job_store().submit(uploaded_file.getvalue(), file_name, mode=mode, top_k=top_k, token_budget=token_budget,
+                                                    stream=stream, stop_early=stop_early, tiering=tiering, fast_path=fast,
+                                                    incremental=amended, normalize=normalize)
+    else:
+        extract(uploaded_file, file_name, mode=mode, top_k=top_k, token_budget=token_budget, stream=stream, stop_early=stop_early, tiering=tiering, fast=fast,
+                amended=amended, normalize=normalize)
+
+if job_queue and "job" in st.query_params:
+    job = job_store().get(st.query_params["job"])
+    if job is None:
+        st.error(f"Job {st.query_params['job']} not found")
+    elif job["status"] in ("done", "failed"):
+        show_job(job)
+    else:
+        poll_job(job["id"])
+if STORE_RESULTS:
+    with st.expander("Search Extracted Agreements"):
+        columns = st.columns(4)
+        filters = {
+            "client": columns[0].text_input("Client name or firm"),
+            "fee_structure": columns[1].text_input("Fee structure", placeholder="Tiered Asset-based Fee"),
+            "custodian": columns[2].text_input("Custodian mentions"),
+            "objective": columns[3].text_input("Objective", placeholder="Growth"),
+        }
+        filters = {name: value.strip() for name, value in filters.items() if value.strip()}
+        if filters:
+            rows = result_store().query(limit=200, **filters)
+            st.write(f"{result_store().count(**filters)} matching agreements")
+            st.dataframe(rows)
+if job_queue:
+    with st.expander("Recent Jobs"):
+        st.json(job_store().counts())
+        st.dataframe(job_store().jobs(limit=20))
@@ -0,0 +1,187 @@
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+# errors a real bedrock-runtime endpoint can raise besides throttling
+SERVER_ERRORS = ("ModelTimeoutException", "ServiceUnavailableException", "InternalServerException")
+# HTTP status a batch-inference output record carries for each simulated error
+BATCH_ERROR_CODES = {"ValidationException": 400, "ThrottlingException": 429}
+# ways a completion can come back unusable: cut off inside <output>, or with broken json in it
+MALFORMATIONS = ("truncated", "invalid_json")
+
+
+def system_sha256(body):
+    return hashlib.sha256(json.loads(body).get("system", "").encode("utf-8")).hexdigest()
+
+
+class FakeBedrock:
+    """Local stand-in for the bedrock-runtime client that replays recorded responses.
+
+    Recordings are a JSON file of {"responses": [...]} where each entry has a "response" (a Bedrock
+    messages response body) and either a "system_sha256" (exact system prompt) or a "contains"
+    substring of the system prompt; the first matching entry wins. Latency, throttling and server
+    errors are drawn from the configured distributions, so concurrency, retry and caching changes
+    can be measured without network access. malformed_rate is the fraction of responses that come
+    back with an unusable <output>, for exercising the parse-repair path.
+    """
+
+    def __init__(self, recordings, latency=0.0, latency_sd=0.0, seconds_per_output_token=0.0,
+                 throttle_rate=0.0, error_rate=0.0, seed=None, chunk_chars=40, model_latency=None, max_input_tokens=None,
+                 malformed_rate=0.0):
+        self.responses = recordings["responses"] if isinstance(recordings, dict) else recordings
+        self.latency = latency
+        self.latency_sd = latency_sd
+        # modelId -> mean latency, for models that should answer faster or slower than the default
+        self.model_latency = model_latency or {}
+        self.seconds_per_output_token = seconds_per_output_token
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.chunk_chars = chunk_chars
+        # requests estimated above this many input tokens fail the way an over-long prompt does
+        self.max_input_tokens = max_input_tokens
+        self.malformed_rate = malformed_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, **options):
+        with open(path) as f:
+            return cls(json.load(f), **options)
+
+    def _match(self, body):
+        system = json.loads(body).get("system", "")
+        digest = hashlib.sha256(system.encode("utf-8")).hexdigest()
+        for entry in self.responses:
+            if entry.get("system_sha256") == digest or ("contains" in entry and entry["contains"] in system):
+                return json.loads(json.dumps(entry["response"]))
+        raise ClientError({"Error": {"Code": "ValidationException", "Message": "No recorded response matches this request"}}, "InvokeModel")
+
+    def _respond(self, body, model_id, operation):
+        latency = self.model_latency.get(model_id, self.latency)
+        with self._lock:
+            self.calls += 1
+            roll = self._random.random()
+            malformed = self._random.random() < self.malformed_rate
+            delay = max(0.0, self._random.gauss(latency, self.latency_sd)) if self.latency_sd else latency
+        if self.max_input_tokens and len(body) // 4 > self.max_input_tokens:
+            raise ClientError({"Error": {"Code": "ValidationException", "Message": "Input is too long for requested model."}}, operation)
+        if roll < self.throttle_rate:
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests, please wait before trying again."}}, operation)
+        if roll < self.throttle_rate + self.error_rate:
+            code = SERVER_ERRORS[int(roll * 1000) % len(SERVER_ERRORS)]
+            raise ClientError({"Error": {"Code": code, "Message": "Simulated server error"}}, operation)
+        response = self._match(body)
+        if malformed:
+            response["content"][0]["text"] = self._malform(response["content"][0]["text"])
+        usage = response.setdefault("usage", {})
+        usage.setdefault("input_tokens", len(body) // 4)
+        usage.setdefault("output_tokens", len(response["content"][0]["text"]) // 4)
+        return response, delay + usage["output_tokens"] * self.seconds_per_output_token
+
+    def _malform(self, text):
+        start = text.find("<output>")
+        if start == -1:
+            return text
+        with self._lock:
+            kind = self._random.choice(MALFORMATIONS)
+        if kind == "truncated":
+            return text[:start + len("<output>") + (text.find("</output>", start) - start) // 2]
+        # a trailing comma, the most common way a model breaks its json
+        end = text.rfind("}", start, text.find("</output>", start))
+        return text[:end] + ",}" + text[end + 1:]
+
+    def invoke_model(self, body, modelId, accept="application/json", contentType="application/json", **kwargs):
+        response, delay = self._respond(body, modelId, "InvokeModel")
+        response["model"] = modelId
+        time.sleep(delay)
+        return {"body": io.BytesIO(json.dumps(response).encode("utf-8")), "ResponseMetadata": {"HTTPStatusCode": 200, "RetryAttempts": 0}}
+
+    def invoke_model_with_response_stream(self, body, modelId, accept="application/json", contentType="application/json", **kwargs):
+        response, delay = self._respond(body, modelId, "InvokeModelWithResponseStream")
+        return {"body": FakeEventStream(response, delay, self.chunk_chars), "ResponseMetadata": {"HTTPStatusCode": 200, "RetryAttempts": 0}}
+
+    def run_batch(self, input_path, output_path, modelId):
+        """Answer a batch-inference input file the way a Bedrock batch job does, without the latency.
+
+        Every {"recordId", "modelInput"} line of input_path comes back in output_path (Bedrock names
+        it <input file>.out) with its modelOutput, or with an error in its place when the simulated
+        call fails. A real job retries throttling internally, here it becomes the record's error too.
+        """
+        with open(input_path) as records, open(output_path, "w") as out:
+            for line in records:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                try:
+                    response, _ = self._respond(json.dumps(record["modelInput"]), modelId, "InvokeModel")
+                    response["model"] = modelId
+                    record["modelOutput"] = response
+                except ClientError as e:
+                    error = e.response["Error"]
+                    record["error"] = {"errorCode": BATCH_ERROR_CODES.get(error["Code"], 500), "errorMessage": error["Message"]}
+                out.write(json.dumps(record) + "\n")
+        return output_path
+
+
+class FakeEventStream:
+    """Yields the same event sequence as a Bedrock messages stream, spreading the delay over the deltas."""
+
+    def __init__(self, response, delay, chunk_chars):
+        self.response = response
+        self.delay = delay
+        self.chunk_chars = chunk_chars
+        self.closed = False
+
+    def _event(self, payload):
+        return {"chunk": {"bytes": json.dumps(payload).encode("utf-8")}}
+
+    def __iter__(self):
+        text = self.response["content"][0]["text"]
+        usage = self.response["usage"]
+        chunks = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)] or [""]
+        yield self._event({"type": "message_start", "message": {"usage": {"input_tokens": usage["input_tokens"], "output_tokens": 1}}})
+        yield self._event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        for chunk in chunks:
+            if self.closed:
+                return
+            time.sleep(self.delay / len(chunks))
+            yield self._event({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": chunk}})
+        yield self._event({"type": "content_block_stop", "index": 0})
+        yield self._event({"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": usage["output_tokens"]}})
+        yield self._event({"type": "message_stop"})
+
+    def close(self):
+        self.closed = True
+
+
+class RecordingBedrock:
+    """Wraps a real client and saves every non-streaming response so it can be replayed by FakeBedrock."""
+
+    def __init__(self, client, path):
+        self.client = client
+        self.path = path
+        self._lock = threading.Lock()
+
+    def invoke_model(self, body, modelId, accept="application/json", contentType="application/json", **kwargs):
+        response = self.client.invoke_model(body=body, modelId=modelId, accept=accept, contentType=contentType, **kwargs)
+        payload = response["body"].read()
+        with self._lock:
+            try:
+                with open(self.path) as f:
+                    recordings = json.load(f)
+            except FileNotFoundError:
+                recordings = {"responses": []}
+            recordings["responses"].append({"system_sha256": system_sha256(body), "response": json.loads(payload)})
+            with open(self.path, "w") as f:
+                json.dump(recordings, f, indent=2)
+        response["body"] = io.BytesIO(payload)
+        return response
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        return self.client.invoke_model_with_response_stream(**kwargs)
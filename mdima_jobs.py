@@ -0,0 +1,334 @@
+"""Persistent extraction job queue and the worker processes that drain it.
+
+Usage:
+    python mdima_jobs.py worker --workers 4
+    python mdima_jobs.py submit agreement.pdf [--tiering] [--fast-path] [--incremental [--previous <document hash>]] [--no-normalize]
+    python mdima_jobs.py status [<job id>]
+
+Jobs live in a local SQLite file (jobs_path, default .mdima_jobs.sqlite3) shared by every
+process on the machine: the Streamlit UI and the submit command add jobs, any number of
+worker processes claim and run them, and the UI polls the store for progress and results.
+A job whose worker stops heartbeating (crash, kill, reboot) is handed to another worker, up
+to max_attempts times. Start more workers against the same file to add capacity. Finished
+records are also added to the indexed result store (see mdima_store) unless store_results=false.
+
+Each worker process runs its own Bedrock scheduler, so the workers started together split the
+scheduler_rpm / scheduler_tpm / scheduler_quotas / scheduler_max_concurrency budget between them.
+When other processes use the same account at the same time (more worker commands, mdima_batch.py),
+set scheduler_processes to the total number of processes instead.
+"""
+import argparse
+import atexit
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import mdima_config
+from mdima_store import STORE_RESULTS, ResultStore
+
+DEFAULT_PATH = os.getenv('jobs_path', '.mdima_jobs.sqlite3')
+# a running job whose worker has not checked in for this long is considered abandoned
+LEASE_SECONDS = int(os.getenv('jobs_lease_seconds', 300))
+MAX_ATTEMPTS = int(os.getenv('jobs_max_attempts', 3))
+# worker processes the Streamlit server starts for itself; 0 leaves the queue to `python mdima_jobs.py worker`
+LOCAL_WORKERS = int(os.getenv('jobs_local_workers', 2))
+POLL_INTERVAL = 1.0
+
+JOB_STATUSES = ("queued", "running", "done", "failed")
+# run_pipeline keyword arguments a job may carry
+JOB_OPTIONS = ("max_workers", "mode", "top_k", "token_budget", "stream", "stop_early", "tiering", "fast_path", "incremental", "previous", "normalize")
+
+
+class JobStore:
+    """SQLite-backed job queue; safe to share between threads and processes."""
+
+    def __init__(self, path=DEFAULT_PATH, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, file_name TEXT NOT NULL, pdf BLOB,"
+            " options TEXT NOT NULL, sections TEXT NOT NULL DEFAULT '{}', result TEXT, summary TEXT, error TEXT,"
+            " worker TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL, started REAL, heartbeat REAL, finished REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+
+    def submit(self, pdf_bytes, file_name, **options):
+        unknown = set(options) - set(JOB_OPTIONS)
+        if unknown:
+            raise ValueError(f"unknown job options: {', '.join(sorted(unknown))}")
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, file_name, pdf, options, created) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, file_name, pdf_bytes, json.dumps(options), time.time()),
+            )
+        return job_id
+
+    def claim(self, worker):
+        """Take the oldest queued (or abandoned) job for worker; returns the job with its PDF, or None."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # abandoned jobs that have used up their attempts are failed rather than retried forever
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', finished = ?, pdf = NULL,"
+                    " error = 'worker stopped responding ' || attempts || ' times'"
+                    " WHERE status = 'running' AND heartbeat < ? AND attempts >= ?",
+                    (now, now - self.lease_seconds, self.max_attempts),
+                )
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' OR (status = 'running' AND heartbeat < ?)"
+                    " ORDER BY created LIMIT 1",
+                    (now - self.lease_seconds,),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, started = ?, heartbeat = ?,"
+                    " sections = '{}' WHERE id = ?",
+                    (worker, now, now, row[0]),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row[0], with_pdf=True)
+
+    def heartbeat(self, job_id, worker):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND status = 'running'", (time.time(), job_id, worker)
+            )
+
+    # the updates below only apply while worker still holds the job: once its lease expired and another
+    # worker claimed it, the stale worker can no longer finish, fail or re-queue it
+
+    def section_done(self, job_id, worker, section, result):
+        # partial results, so a polling UI can show each section as soon as it finishes
+        value = {key: result.get(key) for key in ("json", "confidence", "show_work", "error", "citations")}
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET sections = json_set(sections, '$.' || json_quote(?), json(?)), heartbeat = ?"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (section, json.dumps(value), time.time(), job_id, worker),
+            )
+
+    def complete(self, job_id, worker, record, summary=None):
+        # returns whether the job was still worker's to complete
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, summary = ?, finished = ?, pdf = NULL, error = NULL"
+                " WHERE id = ? AND worker = ? AND status = 'running'",
+                (json.dumps(record), json.dumps(summary, default=str), time.time(), job_id, worker),
+            )
+        return cursor.rowcount > 0
+
+    def fail(self, job_id, worker, error):
+        # retried by the next claim while attempts remain, otherwise failed for good
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, error = ?,"
+                " finished = CASE WHEN attempts < ? THEN NULL ELSE ? END,"
+                " pdf = CASE WHEN attempts < ? THEN pdf ELSE NULL END WHERE id = ? AND worker = ? AND status = 'running'",
+                (self.max_attempts, error, self.max_attempts, time.time(), self.max_attempts, job_id, worker),
+            )
+        return cursor.rowcount > 0
+
+    def get(self, job_id, with_pdf=False):
+        columns = "id, status, file_name, options, sections, result, summary, error, worker, attempts, created, started, heartbeat, finished"
+        with self._lock:
+            row = self._conn.execute(f"SELECT {columns}{', pdf' if with_pdf else ''} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(columns.split(", ") + (["pdf"] if with_pdf else []), row))
+        for key in ("options", "sections", "result", "summary"):
+            job[key] = json.loads(job[key]) if job[key] is not None else None
+        return job
+
+    def jobs(self, status=None, limit=50):
+        # newest first, without the heavy columns
+        query = "SELECT id, status, file_name, error, worker, attempts, created, started, finished FROM jobs"
+        params = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY created DESC LIMIT ?", params + (limit,)).fetchall()
+        keys = ("id", "status", "file_name", "error", "worker", "attempts", "created", "started", "finished")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: 0 for status in JOB_STATUSES} | dict(rows)
+
+
+def run_job(store, job, worker, results=None):
+    # imported here so the store can be used (e.g. by the UI) without loading the pipeline twice
+    from mdima_metrics import Metrics, default_sink
+    from mdima_pipeline import run_pipeline
+
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(store.lease_seconds / 3):
+            store.heartbeat(job["id"], worker)
+
+    threading.Thread(target=beat, daemon=True).start()
+    metrics = Metrics(sink=default_sink(), job_id=job["id"], file_name=job["file_name"])
+    try:
+        record = run_pipeline(job["pdf"], job["file_name"], metrics=metrics,
+                              on_section=lambda section, result: store.section_done(job["id"], worker, section, result), **job["options"])
+    except Exception as e:
+        store.fail(job["id"], worker, f"{type(e).__name__}: {e}")
+        return False
+    except KeyboardInterrupt:
+        # put the job straight back in the queue instead of waiting for its lease to expire
+        store.fail(job["id"], worker, "worker interrupted")
+        raise
+    finally:
+        stop.set()
+    # False when the lease expired and another worker has the job now; its result is the one kept
+    if not store.complete(job["id"], worker, record, metrics.summary()):
+        return False
+    if results is not None:
+        results.add(record)
+    return True
+
+
+def run_worker(path=DEFAULT_PATH, worker=None, poll_interval=POLL_INTERVAL, stop=None, log=sys.stderr, scheduler_processes=None):
+    """Claim and run jobs until stop (a threading/multiprocessing Event) is set.
+
+    scheduler_processes, when given, is the number of processes sharing the Bedrock quotas; it has
+    to be set before the pipeline is imported (run_job imports it on the first job).
+    """
+    if scheduler_processes:
+        os.environ['scheduler_processes'] = str(scheduler_processes)
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    store = JobStore(path)
+    results = ResultStore() if STORE_RESULTS else None
+    try:
+        while stop is None or not stop.is_set():
+            job = store.claim(worker)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+            print(f"{worker} running {job['id']} ({job['file_name']}, attempt {job['attempts']})", file=log, flush=True)
+            ok = run_job(store, job, worker, results)
+            print(f"{worker} {'finished' if ok else 'failed'} {job['id']}", file=log, flush=True)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_workers(count, path=DEFAULT_PATH):
+    """Start count worker processes in the background; returns (processes, stop event).
+
+    The workers are not daemonic: a daemonic process cannot start the process pool extract_pages
+    uses for long PDFs. Setting stop (done automatically when the calling process exits) lets each
+    worker finish its current job and return.
+    """
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    # runs before multiprocessing joins its children at exit, so the join does not wait forever
+    atexit.register(stop.set)
+    # every worker has its own scheduler, so each gets its share of the quotas
+    scheduler_processes = int(os.getenv('scheduler_processes') or count)
+    processes = []
+    for n in range(count):
+        process = context.Process(target=run_worker, kwargs={"path": path, "stop": stop, "scheduler_processes": scheduler_processes},
+                                  name=f"mdima-worker-{n}")
+        process.start()
+        processes.append(process)
+    return processes, stop
+
+
+def launch_workers(count, path=DEFAULT_PATH):
+    """Run `mdima_jobs.py worker` as a child process that exits together with the calling process.
+
+    For callers such as a Streamlit server, whose main module multiprocessing cannot re-import.
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--jobs", path, "worker", "--workers", str(count), "--exit-with", str(os.getpid())]
+    return subprocess.Popen(command)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", default=DEFAULT_PATH, help="job store file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    worker = commands.add_parser("worker", help="run worker processes until interrupted")
+    worker.add_argument("--workers", type=int, default=1, help="worker processes to start")
+    worker.add_argument("--exit-with", type=int, help="stop once the process with this pid has exited")
+    submit = commands.add_parser("submit", help="queue PDFs and print their job ids")
+    submit.add_argument("pdfs", nargs="+")
+    submit.add_argument("--mode", choices=("sections", "combined", "chunked"))
+    submit.add_argument("--tiering", action="store_true", default=None)
+    submit.add_argument("--fast-path", action="store_true", default=None)
+    submit.add_argument("--incremental", action="store_true", default=None, help="diff against the earlier version and reuse unchanged sections")
+    submit.add_argument("--previous", help="document hash of the version these PDFs amend (default: best page match)")
+    submit.add_argument("--no-normalize", action="store_false", dest="normalize", default=None, help="send the raw page text, headers and footers included")
+    status = commands.add_parser("status", help="show one job, or the queue counts and latest jobs")
+    status.add_argument("job_id", nargs="?")
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        processes, stop = start_workers(args.workers, path=args.jobs)
+        try:
+            while any(process.is_alive() for process in processes):
+                processes[0].join(POLL_INTERVAL)
+                if args.exit_with and not _alive(args.exit_with):
+                    # workers finish the job they are on before stopping
+                    stop.set()
+        except KeyboardInterrupt:
+            # Ctrl-C reaches the workers too; each one re-queues the job it was running before exiting
+            stop.set()
+            for process in processes:
+                process.join()
+        return 0
+
+    store = JobStore(args.jobs)
+    if args.command == "submit":
+        options = {key: value for key, value in (("mode", args.mode), ("tiering", args.tiering), ("fast_path", args.fast_path),
+                                                 ("incremental", args.incremental), ("previous", args.previous),
+                                                 ("normalize", args.normalize)) if value is not None}
+        for path in args.pdfs:
+            with open(path, "rb") as f:
+                print(store.submit(f.read(), os.path.basename(path), **options))
+        return 0
+    if args.job_id:
+        job = store.get(args.job_id)
+        if job is None:
+            print(f"no job {args.job_id}", file=sys.stderr)
+            return 1
+        print(json.dumps(job, indent=2, default=str))
+        return 0
+    print(json.dumps({"counts": store.counts(), "jobs": store.jobs(limit=20)}, indent=2, default=str))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# per-section fields summed into the run totals
+TOKEN_FIELDS = ("input_tokens", "output_tokens", "retries")
+
+# JSONL path -> the process's one sink writing to it
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+class Metrics:
+    """Collects structured timing and token-usage records for one run.
+
+    Every record is kept in memory (for the UI summary) and forwarded to the optional sink,
+    which is any callable taking the record dict.
+    """
+
+    def __init__(self, sink=None, **context):
+        self.sink = sink
+        self.context = context
+        self.records = []
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        record = {"event": event, "timestamp": time.time(), **self.context, **fields}
+        with self._lock:
+            self.records.append(record)
+        if self.sink is not None:
+            self.sink(record)
+        return record
+
+    @contextmanager
+    def timer(self, event, **fields):
+        # the yielded dict can be filled in by the caller before the record is emitted
+        started = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            fields["seconds"] = time.perf_counter() - started
+            self.emit(event, **fields)
+
+    def summary(self):
+        stages = {}
+        sections = []
+        totals = {field: 0 for field in TOKEN_FIELDS}
+        totals["cache_hits"] = 0
+        with self._lock:
+            records = list(self.records)
+        for record in records:
+            if record["event"] in ("section", "combined"):
+                sections.append({key: value for key, value in record.items() if key not in ("event", "timestamp", *self.context)})
+                for field in TOKEN_FIELDS:
+                    totals[field] += record.get(field) or 0
+                totals["cache_hits"] += 1 if record.get("cached") else 0
+            if "seconds" in record:
+                stage = stages.setdefault(record["event"], {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+                stage["count"] += 1
+                stage["seconds"] += record["seconds"]
+                stage["max_seconds"] = max(stage["max_seconds"], record["seconds"])
+        return {"stages": stages, "sections": sections, "totals": totals, "tiering": tiering_summary(records),
+                "fast_path": fast_path_summary(records), "parsing": parsing_summary(records),
+                "normalization": normalization_summary(records)}
+
+
+def tiering_summary(records):
+    # how often sections escalated past the first model tier, and what staying on it saved
+    summary = {"sections": 0, "escalated": 0, "escalation_rate": 0.0, "kept_on_first_tier": 0,
+               "first_tier_tokens": 0, "escalated_tokens": 0, "seconds_lost_to_escalation": 0.0, "by_section": {}}
+    for record in records:
+        attempts = record.get("attempts") if record["event"] == "section" else None
+        if not attempts or record.get("tiers", 1) < 2:
+            continue
+        section = summary["by_section"].setdefault(record["section"], {"runs": 0, "escalated": 0})
+        section["runs"] += 1
+        summary["sections"] += 1
+        tokens = [(attempt.get("input_tokens") or 0) + (attempt.get("output_tokens") or 0) for attempt in attempts]
+        if len(attempts) > 1:
+            section["escalated"] += 1
+            summary["escalated"] += 1
+            summary["escalated_tokens"] += sum(tokens)
+            summary["seconds_lost_to_escalation"] += sum(attempt.get("time_to_last_token") or 0 for attempt in attempts[:-1])
+        else:
+            summary["kept_on_first_tier"] += 1
+            summary["first_tier_tokens"] += tokens[0]
+    if summary["sections"]:
+        summary["escalation_rate"] = summary["escalated"] / summary["sections"]
+    return summary
+
+
+def fast_path_summary(records):
+    # how often each section was answered by the deterministic rules instead of the model
+    summary = {"sections": 0, "fast_path": 0, "fast_path_rate": 0.0, "by_section": {}}
+    for record in records:
+        if record["event"] != "section" or "fast_path" not in record:
+            continue
+        section = summary["by_section"].setdefault(record["section"], {"runs": 0, "fast_path": 0, "rate": 0.0})
+        section["runs"] += 1
+        summary["sections"] += 1
+        if record["fast_path"]:
+            section["fast_path"] += 1
+            summary["fast_path"] += 1
+    for section in summary["by_section"].values():
+        section["rate"] = section["fast_path"] / section["runs"]
+    if summary["sections"]:
+        summary["fast_path_rate"] = summary["fast_path"] / summary["sections"]
+    return summary
+
+
+def parsing_summary(records):
+    # completions that failed their section schema, and how many the repair prompt fixed
+    summary = {"completions": 0, "parse_failures": 0, "repairs": 0, "repaired": 0, "unrepaired": 0,
+               "combined_fallbacks": 0, "by_section": {}}
+    for record in records:
+        if record["event"] == "combined":
+            summary["combined_fallbacks"] += len(record.get("parse_errors") or {})
+        if record["event"] != "section":
+            continue
+        for attempt in record.get("attempts") or []:
+            if attempt.get("cached"):
+                continue
+            section = summary["by_section"].setdefault(record["section"], {"completions": 0, "parse_failures": 0, "repaired": 0})
+            section["completions"] += 1
+            summary["completions"] += 1
+            if "parse_error" not in attempt:
+                continue
+            section["parse_failures"] += 1
+            summary["parse_failures"] += 1
+            summary["repairs"] += attempt.get("repairs", 0)
+            if attempt.get("repaired"):
+                section["repaired"] += 1
+                summary["repaired"] += 1
+            else:
+                summary["unrepaired"] += 1
+    return summary
+
+
+def normalization_summary(records):
+    # estimated document tokens before and after boilerplate stripping, per document and in total
+    summary = {"documents": 0, "tokens_before": 0, "tokens_after": 0, "saved_fraction": 0.0, "by_document": []}
+    for record in records:
+        if record["event"] != "normalize":
+            continue
+        summary["documents"] += 1
+        summary["tokens_before"] += record["tokens_before"]
+        summary["tokens_after"] += record["tokens_after"]
+        summary["by_document"].append({"file_name": record.get("file_name"), "pages": record["pages"], "tokens_before": record["tokens_before"],
+                                       "tokens_after": record["tokens_after"], "removed_lines": record["removed_lines"]})
+    if summary["tokens_before"]:
+        summary["saved_fraction"] = 1 - summary["tokens_after"] / summary["tokens_before"]
+    return summary
+
+
+class JsonlSink:
+    """Appends every record to a JSON lines file."""
+
+    def __init__(self, path):
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def stdout_sink(record):
+    print(json.dumps(record, default=str), flush=True)
+
+
+def default_sink():
+    # metrics_sink=stdout prints records, any other value is a JSONL file path, unset keeps them in memory only.
+    # A file is opened once per process and shared by every run, so a long-running server does not leak handles
+    target = os.getenv('metrics_sink')
+    if not target:
+        return None
+    if target == "stdout":
+        return stdout_sink
+    with _sinks_lock:
+        if target not in _sinks:
+            _sinks[target] = JsonlSink(target)
+        return _sinks[target]
@@ -0,0 +1,106 @@
+import math
+import re
+from collections import Counter
+
+from mdima_retrieval import estimate_tokens
+from mdima_rules import SIGNATURE_FIELD
+
+# lines this close to the top or bottom of a page are checked for running headers and footers
+EDGE_LINES = 3
+# an edge line whose shape (digits masked) is on at least this fraction of the pages, and on at least
+# MIN_REPEAT_COUNT of them, is a header or footer; two signature pages are not a running footer
+REPEAT_FRACTION = 0.5
+MIN_REPEAT_COUNT = 3
+# edge lines that are only a page number: "7", "Page 7", "Page 7 of 24"; a bare number also has to
+# be within the page count, so amounts and years ("2008") are kept
+PAGE_NUMBER = re.compile(r"^(?:(page\s+)?(\d{1,4})(?:\s+of\s+\d{1,4})?)$", re.I)
+# "Label: value" lines (signature fields, "Effective Date: ...") are content even when they repeat
+FIELD_LINE = re.compile(r"^[A-Za-z][A-Za-z .'&/-]{0,40}:\s+\S")
+# a word broken over a line end: "invest-" / "ment"
+BROKEN_WORD = re.compile(r"(\w+)-\n([a-z]\w*) *")
+HYPHENATED_WORD = re.compile(r"\b\w+-\w+\b")
+DIGITS = re.compile(r"\d+")
+
+
+def _shape(line):
+    # running headers and footers differ only in their numbers ("Page 3 of 24", ".../dex102.htm 3/24")
+    return DIGITS.sub("#", " ".join(line.lower().split()))
+
+
+def _edges(lines):
+    # indexes of the first and last EDGE_LINES non-blank lines
+    filled = [index for index, line in enumerate(lines) if line.strip()]
+    return set(filled[:EDGE_LINES] + filled[-EDGE_LINES:])
+
+
+def repeated_shapes(pages):
+    # shapes of the edge lines found on enough pages to be running headers or footers
+    counts = Counter()
+    for text in pages.values():
+        lines = text.splitlines()
+        counts.update({_shape(lines[index]) for index in _edges(lines)})
+    needed = max(MIN_REPEAT_COUNT, math.ceil(REPEAT_FRACTION * len(pages)))
+    return {shape for shape, count in counts.items() if count >= needed and shape}
+
+
+def _page_number(line, page_count):
+    match = PAGE_NUMBER.match(line)
+    return bool(match) and (bool(match.group(1)) or int(match.group(2)) <= page_count)
+
+
+def boilerplate(line, shapes, page_count):
+    # whether an edge line is a running header/footer or a page number; field lines never are
+    if SIGNATURE_FIELD.match(line) or FIELD_LINE.match(line):
+        return False
+    return _page_number(line, page_count) or _shape(line) in shapes
+
+
+def _join_words(text, hyphenated):
+    # "invest-\nment" -> "investment", unless the document spells the word with its hyphen elsewhere ("non-discretionary")
+    def join(match):
+        word = f"{match.group(1)}-{match.group(2)}"
+        return (word if word.lower() in hyphenated else match.group(1) + match.group(2)) + "\n"
+    text = BROKEN_WORD.sub(join, text)
+    # the rest of the word moved up, which can leave the next line empty
+    return "\n".join(line for line in text.splitlines() if line)
+
+
+def normalize_pages(pages):
+    """Strip boilerplate and layout noise from {page number: text} before it is sent to the model.
+
+    Removes running headers and footers (edge lines repeated across pages) and page-number lines,
+    rejoins words hyphenated over a line break, collapses runs of spaces and drops blank lines.
+    Line breaks are kept, clause numbering relies on them. Returns ({page number: cleaned text},
+    report) with the same page numbers, so anything found in the cleaned text can still be cited
+    by page; the report has the token estimate before and after and the lines removed per page.
+    """
+    shapes = repeated_shapes(pages)
+    hyphenated = {word.lower() for text in pages.values() for word in HYPHENATED_WORD.findall(text)}
+    cleaned = {}
+    removed = {}
+    for number in sorted(pages):
+        lines = pages[number].replace("\u00ad", "").splitlines()
+        edges = _edges(lines)
+        kept = []
+        for index, line in enumerate(lines):
+            line = " ".join(line.split())
+            if not line:
+                continue
+            if index in edges and boilerplate(line, shapes, len(pages)):
+                removed.setdefault(number, []).append(line)
+                continue
+            kept.append(line)
+        cleaned[number] = _join_words("\n".join(kept), hyphenated)
+    report = {
+        "pages": len(pages),
+        "tokens_before": sum(estimate_tokens(text) for text in pages.values()),
+        "tokens_after": sum(estimate_tokens(text) for text in cleaned.values()),
+        "repeated_lines": sorted(shapes),
+        "removed_lines": removed,
+    }
+    return cleaned, report
+
+
+def marked_text(pages):
+    # the document as one text with a short page marker in place of the page numbers that were stripped
+    return "\n".join(f"[Page {number}]\n{pages[number]}" for number in sorted(pages))
@@ -0,0 +1,139 @@
+import json
+import re
+
+# tags every section completion is asked to return, in order
+COMPLETION_TAGS = ("scratchpad", "output", "confidence", "show_work")
+
+OBJECTIVE_CATEGORIES = [
+    "Capital Preservation", "Income Generation", "Growth", "Balanced Growth and Income", "Aggressive Growth",
+    "Tax-efficient investing", "Socially Responsible Investing", "Retirement Planning", "Education Funding", "Other or Not Found",
+]
+
+
+def _strings(*names):
+    # an object with exactly these string fields
+    return {"type": "object", "required": list(names), "properties": {name: {"type": "string"} for name in names}}
+
+
+# JSON schema (the subset validate() understands) of each section's <output>
+SECTION_SCHEMAS = {
+    "Party": {
+        "type": "object",
+        "required": ["Parties Involved"],
+        "properties": {"Parties Involved": _strings("Client Name", "Client Firm", "Investment Manager Name", "Investment Manager Firm")},
+    },
+    "Objective": {
+        "type": "object",
+        "required": ["Investment Objectives"],
+        "properties": {
+            "Investment Objectives": {
+                "type": "object",
+                "minProperties": 1,
+                "patternProperties": {r"^Objective\d+$": {"type": "string", "enum": OBJECTIVE_CATEGORIES}},
+                "additionalProperties": False,
+            }
+        },
+    },
+    "Custodian and Brokerage": {
+        "type": "object",
+        "required": ["Custodian and Brokerage"],
+        "properties": {"Custodian and Brokerage": _strings("Custodian", "Brokerage")},
+    },
+    "Fee": {
+        "type": "object",
+        "required": ["Fee"],
+        "properties": {"Fee": _strings("Fee Structure", "Compensation Details")},
+    },
+    "Effective Date": {
+        "type": "object",
+        "required": ["Effective Date"],
+        "properties": {"Effective Date": _strings("Effective Date", "Client Signature Date", "Investment Firm Signature Date")},
+    },
+}
+
+CONFIDENCE_SCHEMA = {"type": "string", "enum": ["High", "Medium", "Low"]}
+
+JSON_TYPES = {"object": dict, "array": list, "string": str, "number": (int, float), "integer": int, "boolean": bool, "null": type(None)}
+
+
+def normalize_confidence(value):
+    # "high", " High. " and "MEDIUM" are the answer the prompt asked for, only written differently
+    return value.strip().rstrip(".!,;:").strip().title()
+
+
+def parse_tags(text, tags=COMPLETION_TAGS):
+    """Split a completion into {tag: content} in one pass over the text.
+
+    Only top-level tags count: once a tag is open, everything up to its own closing tag is its
+    content, so an <output> quoted inside the scratchpad is not mistaken for the answer. The first
+    complete occurrence of each tag wins; a tag that is opened but never closed (a truncated
+    response) is missing from the result.
+    """
+    pattern = re.compile(r"<(/?)(" + "|".join(re.escape(tag) for tag in tags) + r")>")
+    values = {}
+    open_tag = None
+    start = 0
+    for match in pattern.finditer(text):
+        closing, tag = match.group(1), match.group(2)
+        if open_tag is None:
+            if not closing:
+                open_tag, start = tag, match.end()
+        elif closing and tag == open_tag:
+            values.setdefault(tag, text[start:match.start()])
+            open_tag = None
+    return values
+
+
+def validate(value, schema, path="$"):
+    """Return the first way value breaks schema, or None when it conforms.
+
+    Covers the JSON schema keywords the section schemas use: type, enum, required, properties,
+    patternProperties, additionalProperties and minProperties.
+    """
+    expected = JSON_TYPES[schema.get("type", "object")]
+    if not isinstance(value, expected) or (expected is not bool and isinstance(value, bool)):
+        return f"{path} should be a {schema.get('type', 'object')}"
+    if "enum" in schema and value not in schema["enum"]:
+        return f"{path} is {json.dumps(value)}, expected one of {', '.join(schema['enum'])}"
+    if not isinstance(value, dict):
+        return None
+    for name in schema.get("required", []):
+        if name not in value:
+            return f"{path} is missing \"{name}\""
+    if len(value) < schema.get("minProperties", 0):
+        return f"{path} needs at least {schema['minProperties']} entries"
+    for name, child in value.items():
+        child_path = f"{path}.{name}"
+        if name in schema.get("properties", {}):
+            problem = validate(child, schema["properties"][name], child_path)
+        else:
+            patterns = [sub for pattern, sub in schema.get("patternProperties", {}).items() if re.search(pattern, name)]
+            if patterns:
+                problem = validate(child, patterns[0], child_path)
+            elif schema.get("additionalProperties", True) is False:
+                problem = f"{child_path} is not an expected field"
+            else:
+                problem = None
+        if problem:
+            return problem
+    return None
+
+
+def check_completion(section, tags):
+    """Describe what is wrong with a parsed section completion ({tag: content}), or None when it is usable.
+
+    The <confidence> value is normalized in place first, so a usable completion is cached as "High", not "high.".
+    """
+    if "output" not in tags:
+        return "no complete <output> tag"
+    try:
+        value = json.loads(tags["output"])
+    except ValueError as e:
+        return f"invalid json in <output>: {e}"
+    problem = validate(value, SECTION_SCHEMAS[section])
+    if problem:
+        return problem
+    if "confidence" not in tags:
+        return "no complete <confidence> tag"
+    tags["confidence"] = normalize_confidence(tags["confidence"])
+    return validate(tags["confidence"], CONFIDENCE_SCHEMA, "<confidence>")
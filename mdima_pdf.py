@@ -0,0 +1,106 @@
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pdfplumber
+
+import mdima_config
+
+# documents shorter than this are extracted in-process, a pool costs more than it saves
+MIN_PARALLEL_PAGES = int(os.getenv('pdf_min_parallel_pages', 32))
+# pages handed to a worker at a time
+PAGES_PER_TASK = int(os.getenv('pdf_pages_per_task', 16))
+
+# per-worker copy of the document, set once by the pool initializer
+_worker_source = None
+_worker_pdf = None
+
+
+def read_source(pdf):
+    # accept raw bytes, a path, or a file-like object such as a Streamlit upload
+    if isinstance(pdf, (bytes, bytearray)):
+        return bytes(pdf)
+    if isinstance(pdf, (str, os.PathLike)):
+        with open(pdf, "rb") as f:
+            return f.read()
+    if hasattr(pdf, "getvalue"):
+        return pdf.getvalue()
+    return pdf.read()
+
+
+def _extract_range(pdf, start, stop):
+    # returns ({page number: text}, {page number: seconds spent extracting it})
+    pages = {}
+    seconds = {}
+    for index in range(start, stop):
+        started = time.perf_counter()
+        page = pdf.pages[index]
+        pages[index + 1] = page.extract_text() or ""
+        # drop the parsed layout so memory stays flat on long documents
+        page.close()
+        seconds[index + 1] = time.perf_counter() - started
+    return pages, seconds
+
+
+def _init_worker(pdf_bytes):
+    global _worker_source, _worker_pdf
+    _worker_source = pdf_bytes
+    _worker_pdf = None
+
+
+def _worker_range(start, stop):
+    global _worker_pdf
+    if _worker_pdf is None:
+        _worker_pdf = pdfplumber.open(io.BytesIO(_worker_source))
+    return _extract_range(_worker_pdf, start, stop)
+
+
+def extract_pages(pdf, processes=None, timings=None):
+    """Return {page number (1-based): text} for every page of the PDF.
+
+    When a dict is passed as timings it is filled with {page number: extraction seconds}.
+    """
+    timings = {} if timings is None else timings
+    pdf_bytes = read_source(pdf)
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as document:
+        total = len(document.pages)
+        if processes == 1 or total < MIN_PARALLEL_PAGES:
+            pages, seconds = _extract_range(document, 0, total)
+            timings.update(seconds)
+            return pages
+
+    ranges = [(start, min(start + PAGES_PER_TASK, total)) for start in range(0, total, PAGES_PER_TASK)]
+    processes = min(processes or os.cpu_count() or 1, len(ranges))
+    pages = {}
+    # spawned, not forked: callers run on thread pools, and a forked child can inherit a lock another thread held
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_worker, initargs=(pdf_bytes,)) as pool:
+        for chunk, seconds in pool.map(_worker_range, *zip(*ranges)):
+            pages.update(chunk)
+            timings.update(seconds)
+    return dict(sorted(pages.items()))
+
+
+def extract_tables(pdf, page_numbers):
+    """Return {page number: [table rows]} for the given pages, skipping pages without tables.
+
+    Table detection is far slower than text extraction, so callers pick the pages worth scanning.
+    """
+    tables = {}
+    if not page_numbers:
+        return tables
+    with pdfplumber.open(io.BytesIO(read_source(pdf))) as document:
+        for number in page_numbers:
+            page = document.pages[number - 1]
+            found = page.extract_tables()
+            page.close()
+            if found:
+                tables[number] = found
+    return tables
+
+
+def join_pages(pages):
+    # one join over all pages instead of growing a string page by page
+    return "\n".join(pages[number] for number in sorted(pages))
@@ -0,0 +1,1010 @@
+import boto3
+import botocore
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# loads .env before any of our modules reads its settings
+import mdima_config
+from mdima_cache import ResultCache, hash_bytes, section_key
+from mdima_chunking import merge_partials, page_windows, window_text
+from mdima_metrics import Metrics
+from mdima_normalize import marked_text, normalize_pages
+from mdima_parsing import COMPLETION_TAGS, check_completion, normalize_confidence, parse_tags
+from mdima_pdf import extract_pages, extract_tables, join_pages, read_source
+from mdima_retrieval import ClauseIndex
+import mdima_rules
+from mdima_scheduler import BedrockScheduler
+from mdima_streaming import TagStreamParser
+import mdima_versions
+from mdima_versions import VersionStore
+
+model_id = "anthropic.claude-3-sonnet-20240229-v1:0"
+# number of section extractors allowed to call Bedrock at the same time (1 runs them back-to-back)
+max_workers = int(os.getenv('max_workers', 5))
+# "sections" sends one request per section, "combined" asks for every section in a single request,
+# "chunked" runs every section over overlapping page windows and merges the answers (for very long agreements)
+EXTRACTION_MODES = ("sections", "combined", "chunked")
+extraction_mode = os.getenv('extraction_mode', 'sections')
+# chunked mode: estimated tokens per window, and pages shared by consecutive windows
+chunk_tokens = int(os.getenv('chunk_tokens', 24000))
+chunk_overlap_pages = int(os.getenv('chunk_overlap_pages', 1))
+# when above 0 each extractor only receives its top-k clauses (within the token budget) instead of the whole document
+retrieval_top_k = int(os.getenv('retrieval_top_k', 0))
+retrieval_token_budget = int(os.getenv('retrieval_token_budget', 3000))
+# model tiering: run each section on a fast model first and only re-run it on the next tier when the
+# answer is not High confidence or its output fails validation
+model_tiering = os.getenv('model_tiering', 'false').lower() == 'true'
+fast_model_id = os.getenv('fast_model_id', "anthropic.claude-3-haiku-20240307-v1:0")
+# stream section completions so <output>/<confidence> can be shown before the rest of the response arrives
+streaming = os.getenv('streaming', 'false').lower() == 'true'
+# try the deterministic rules in mdima_rules first and skip Bedrock for any section they answer completely
+fast_path = os.getenv('fast_path', 'false').lower() == 'true'
+# record every processed document's page hashes and section sources, and when a new document is an amended
+# version of one of them only re-run the sections whose source pages changed
+incremental = os.getenv('incremental', 'false').lower() == 'true'
+# strip running headers/footers and page numbers, rejoin hyphenated words and collapse whitespace before the
+# text reaches the extractors; the cleaned text is sent with [Page N] markers so answers stay traceable
+normalize_text = os.getenv('normalize_text', 'true').lower() == 'true'
+# how many times a section whose completion fails its schema is re-asked (with a short corrective prompt,
+# not the document) before it is reported as failed
+repair_attempts = int(os.getenv('repair_attempts', 1))
+
+# every Bedrock call in the process goes through one scheduler (quotas, adaptive concurrency, retries)
+# unless bedrock_scheduler=false; scheduler_quotas='{"<model>": {"rpm": ..., "tpm": ...}}' sets per-model quotas
+bedrock_scheduler = os.getenv('bedrock_scheduler', 'true').lower() == 'true'
+# the quotas above are the account's; when scheduler_processes processes call Bedrock at the same time (job
+# workers, batch runs) each one's scheduler gets an equal share of them. The job workers set it to their own
+# count unless it is set explicitly. Throttle backoff and interactive-before-batch priority stay per process
+scheduler_processes = max(1, int(os.getenv('scheduler_processes', 1)))
+
+
+def _quota_share(value):
+    return max(1, int(value) // scheduler_processes)
+
+
+scheduler_options = {
+    "requests_per_minute": _quota_share(os.getenv('scheduler_rpm', 500)),
+    "tokens_per_minute": _quota_share(os.getenv('scheduler_tpm', 1000000)),
+    "max_concurrency": _quota_share(os.getenv('scheduler_max_concurrency', 16)),
+    "quotas": {model: {name: _quota_share(value) for name, value in quota.items()}
+               for model, quota in json.loads(os.getenv('scheduler_quotas', '{}')).items()},
+}
+
+# the Bedrock client and the cache are created on first use so importing this module has no side effects
+_bedrock = None
+_cache = None
+_versions = None
+_lock = threading.Lock()
+
+
+def get_bedrock():
+    # any object with the bedrock-runtime invoke_model / invoke_model_with_response_stream methods works
+    # as the model client; bedrock_replay=<recordings.json> swaps in the local FakeBedrock
+    global _bedrock
+    with _lock:
+        if _bedrock is None:
+            if os.getenv('bedrock_replay'):
+                from mdima_fake_bedrock import FakeBedrock
+                client = FakeBedrock.from_file(os.getenv('bedrock_replay'))
+            else:
+                # setting default session with AWS CLI Profile
+                boto3.setup_default_session(profile_name=os.getenv('profile_name'))
+                # Setup Bedrock client, leaving retries to the scheduler when it is on so it sees every throttle;
+                # it also retries the connection errors and read timeouts botocore would have
+                retries = {'mode': 'standard', 'max_attempts': 1} if bedrock_scheduler else None
+                config = botocore.config.Config(connect_timeout=300, read_timeout=300, retries=retries)
+                client = boto3.client('bedrock-runtime' , 'us-east-1', config = config)
+            _bedrock = BedrockScheduler(client, **scheduler_options) if bedrock_scheduler else client
+    return _bedrock
+
+
+def set_bedrock(client):
+    global _bedrock
+    with _lock:
+        _bedrock = client
+
+
+def get_cache():
+    # content-addressed cache for PDF text and parsed section outputs, shared by every caller in the process
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = ResultCache()
+    return _cache
+
+
+def set_cache(cache):
+    global _cache
+    with _lock:
+        _cache = cache
+
+
+def get_versions():
+    # the processed-document history incremental runs diff against
+    global _versions
+    with _lock:
+        if _versions is None:
+            _versions = VersionStore()
+    return _versions
+
+
+def set_versions(versions):
+    global _versions
+    with _lock:
+        _versions = versions
+
+
+
+def parse_xml(xml, tag):
+    # content of the first complete top-level <tag>, "" when there is none; the completion tags are
+    # tracked as well so a tag quoted inside the scratchpad is skipped
+    return parse_tags(xml, tuple(dict.fromkeys(COMPLETION_TAGS + (tag,)))).get(tag, "")
+
+
+
+def request_body(system_prompt, content, max_tokens, temperature=0.5, messages=None):
+    # the Bedrock messages request for one extraction; messages, when given, replace the single <document> user message
+    return {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "system": system_prompt,
+        "messages": messages or [    
+            {
+                "role": "user",
+                "content": f"<document> {content} </document>"
+            }
+        ]
+    }
+
+
+def call_bedrock(system_prompt, content, max_tokens, temperature=0.5, model_id=model_id, stats=None, stream=False, on_result=None, stop_early=False,
+                 messages=None):
+    # stats, when given, is filled with the call's timings, token usage and retry count; messages, when
+    # given, replace the single <document> user message
+    stats = {} if stats is None else stats
+    build_started = time.perf_counter()
+    prompt = json.dumps(request_body(system_prompt, content, max_tokens, temperature, messages))
+    stats["request_build"] = time.perf_counter() - build_started
+    stats["model_id"] = model_id
+
+    started = time.monotonic()
+    if stream:
+        return _stream_bedrock(prompt, model_id, started, stats, on_result, stop_early)
+
+    response = get_bedrock().invoke_model(body=prompt, modelId=model_id, accept="application/json", contentType="application/json")
+    response_body = json.loads(response.get('body').read())
+    stats["time_to_last_token"] = time.monotonic() - started
+    stats["retries"] = response.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    usage = response_body.get("usage", {})
+    stats["input_tokens"] = usage.get("input_tokens")
+    stats["output_tokens"] = usage.get("output_tokens")
+    return response_body['content'][0]['text']
+
+
+def _stream_bedrock(prompt, model_id, started, stats, on_result, stop_early):
+    # on_result(output, confidence) fires as soon as both tags have closed; with stop_early the
+    # rest of the response (the show_work explanation) is not consumed
+    response = get_bedrock().invoke_model_with_response_stream(body=prompt, modelId=model_id, accept="application/json", contentType="application/json")
+    stats["retries"] = response.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    body = response.get('body')
+    parser = TagStreamParser(("output", "confidence"))
+    for event in body:
+        chunk = json.loads(event["chunk"]["bytes"])
+        if chunk["type"] == "message_start":
+            stats["input_tokens"] = chunk["message"].get("usage", {}).get("input_tokens")
+        elif chunk["type"] == "message_delta":
+            stats["output_tokens"] = chunk.get("usage", {}).get("output_tokens")
+        elif chunk["type"] == "content_block_delta":
+            if parser.feed(chunk["delta"].get("text", "")) and parser.complete() and "time_to_result" not in stats:
+                stats["time_to_result"] = time.monotonic() - started
+                if on_result is not None:
+                    on_result(parser.values["output"], parser.values["confidence"])
+                if stop_early:
+                    stats["stopped_early"] = True
+                    body.close()
+                    break
+    stats["time_to_last_token"] = time.monotonic() - started
+    return parser.text
+
+
+def parse_completion(llmOutput):
+    # (scratch, output, confidence, show_work), "" for any tag that is missing or never closed
+    tags = parse_tags(llmOutput)
+    if "confidence" in tags:
+        tags["confidence"] = normalize_confidence(tags["confidence"])
+    return tuple(tags.get(tag, "") for tag in COMPLETION_TAGS)
+
+
+REPAIR_PROMPT = """Your previous answer could not be used: {problem}
+Do not repeat your analysis. Using the instructions and <example_format> you were given, return the corrected answer only:
+the valid json in <output> xml tags, your confidence level (Low, Medium, or High) in <confidence> xml tags
+and your explanation in <show_work> xml tags
+
+<previous_answer>
+{previous}
+</previous_answer>"""
+
+
+def repair_section(system_prompt, previous, problem, max_tokens, temperature=0.5, model_id=model_id, stats=None):
+    # re-asks the section's own prompt to fix its answer; the document is not sent again, so the
+    # request costs the system prompt plus the previous answer
+    tags = parse_tags(previous)
+    # the analysis is enough to rebuild a truncated answer, but not worth sending back when the output arrived
+    kept = previous if "output" not in tags else "\n".join(f"<{tag}>{tags[tag]}</{tag}>" for tag in COMPLETION_TAGS[1:] if tag in tags)
+    messages = [{"role": "user", "content": REPAIR_PROMPT.format(problem=problem, previous=kept.strip())}]
+    return call_bedrock(system_prompt, "", max_tokens, temperature, model_id, stats=stats, messages=messages)
+
+
+def repair_completion(section, system_prompt, llmOutput, tags, problem, max_tokens, temperature=0.5, model_id=model_id, stats=None):
+    # re-asks for a completion that failed its schema up to repair_attempts times; returns the final
+    # (tags, problem) and records parse_error, repairs and repaired in stats
+    stats = {} if stats is None else stats
+    stats["parse_error"] = problem
+    stats["repairs"] = 0
+    while problem and stats["repairs"] < repair_attempts:
+        stats["repairs"] += 1
+        repair = {}
+        repaired = repair_section(system_prompt, llmOutput, problem, max_tokens, temperature, model_id, stats=repair)
+        for field in ("input_tokens", "output_tokens", "retries"):
+            stats[field] = (stats.get(field) or 0) + (repair.get(field) or 0)
+        repaired_tags = parse_tags(repaired)
+        problem = check_completion(section, repaired_tags)
+        # the repair only answers output, confidence and show_work; keep the original analysis
+        if "scratchpad" in tags:
+            repaired_tags.setdefault("scratchpad", tags["scratchpad"])
+        tags = repaired_tags
+        llmOutput = repaired
+    stats["repaired"] = problem is None
+    if problem:
+        stats["parse_error"] = problem
+    return tags, problem
+
+
+def invoke_section(system_prompt, content, max_tokens, temperature=0.5, model_id=model_id, stats=None, stream=False, on_result=None, stop_early=False,
+                   section=None):
+    # identical document + prompt + model settings come straight back from the cache. With section
+    # set, the completion is checked against the section's schema and repaired up to repair_attempts
+    # times; stats then records the parse_error, repairs and whether it was repaired
+    stats = {} if stats is None else stats
+    key = section_key(content, system_prompt, model_id, max_tokens, temperature)
+    cached = get_cache().get("section", key)
+    if cached is not None:
+        stats["cached"] = True
+        stats["model_id"] = model_id
+        return tuple(cached)
+
+    llmOutput = call_bedrock(system_prompt, content, max_tokens, temperature, model_id, stats=stats, stream=stream, on_result=on_result, stop_early=stop_early)
+    parse_started = time.perf_counter()
+    tags = parse_tags(llmOutput)
+    problem = check_completion(section, tags) if section else validate_json(tags.get("output", ""))
+    stats["parse"] = time.perf_counter() - parse_started
+
+    if problem and section:
+        tags, problem = repair_completion(section, system_prompt, llmOutput, tags, problem, max_tokens, temperature, model_id, stats=stats)
+
+    scratch, output, confidence, show_work = (tags.get(tag, "") for tag in COMPLETION_TAGS)
+    # only keep completions whose output can actually be used, and not ones cut short before show_work
+    if problem is None and not stats.get("stopped_early"):
+        get_cache().set("section", key, [scratch, output, confidence, show_work])
+
+    return scratch, output, confidence, show_work
+
+
+def invoke_combined(content, temperature=0.5, model_id=model_id, stats=None):
+    # one request for every section; returns section -> (scratch, output, confidence, show_work)
+    stats = {} if stats is None else stats
+    key = section_key(content, COMBINED_SYSTEM_PROMPT, model_id, COMBINED_MAX_TOKENS, temperature)
+    cached = get_cache().get("combined", key)
+    if cached is not None:
+        stats["cached"] = True
+    else:
+        llmOutput = call_bedrock(COMBINED_SYSTEM_PROMPT, content, COMBINED_MAX_TOKENS, temperature, model_id, stats=stats)
+        parse_started = time.perf_counter()
+        # sections that come back missing or invalid are retried individually and cached on their own,
+        # so the combined completion is worth keeping even when it is incomplete
+        results = parse_tags(llmOutput, [f"{tag}_result" for tag in COMBINED_TAGS.values()])
+        cached = {section: parse_completion(results.get(f"{tag}_result", "")) for section, tag in COMBINED_TAGS.items()}
+        stats["parse"] = time.perf_counter() - parse_started
+        get_cache().set("combined", key, cached)
+    return {section: tuple(completion) for section, completion in cached.items()}
+
+
+PARTY_SYSTEM_PROMPT="""
+You are an AI Data Processor whose goal is to identify and extract key information from an Investment Management Agreement for a wealth management client. You will be provided a Wealth Management Agreement (DIMA, IMA, or MDIMA)
+Using the context of the provided agreement Identify and Extract the following information and return it in json format:
+    Parties Involved
+        Client Name (name of the person acting as or on behalf of the client - often times this will be the Signee for the Client)
+        Client Firm (Client Firm name, "individual" if no associated client firm)
+        Investment Manager Name (name of the person acting as or on behalf of the client - often times this will be the Signee for the Investment Firm)
+        Investment Manager Firm (Investment Firm name, "individual" if no associated investment firm)
+
+<example_format>
+{
+  "Parties Involved": {
+    "Client Name": "(Client Name)",
+    "Client Firm": "(Client Firm Name or "individual")",
+    "Investment Manager Name": "(Investment Manager Name)",
+    "Investment Manager Firm": "(Investment Management Firm, or "individual")"
+  }
+}
+</example_format>
+
+Also return your confidence level representing how confident you that you were able to accurately identify and categorize the requested information. Your confidence value should be one of "High", "Medium", or "Low"
+Use High Confidence in cases you have no doubt you have identified and captured ALL the correct information and there was no ambiguity and there is no need for a human to review
+Use Medium Confidence in cases where you are reasonably confident you have identified most of the information, but there might be some ambiguity and a human review would be beneficial
+Use Low Confidence in cases where you are not confident in the information you have captured or the data provided didn't include enough information, and a human needs to review
+
+
+Think through each step of your thought process and write your thoughts down in <scratchpad> xml tags
+return the valid json array with the extracted details in <output> xml tags, only including the valid json
+return your confidence level (Low, Medium, or High) in <confidence> xml tags
+record your explanation for your response and cite your work and reasoning in <show_work> xml tags
+
+"""
+
+
+def extract_party_info(content):
+    system_prompt, max_tokens = SECTION_PROMPTS["Party"]
+    return invoke_section(system_prompt, content, max_tokens=max_tokens, section="Party")
+
+
+
+OBJECTIVE_SYSTEM_PROMPT="""
+You are an AI Data Processor whose goal is to identify and extract key information from an Investment Management Agreement for a wealth management client. You will be provided a Wealth Management Agreement (DIMA, IMA, or MDIMA)
+Using the document context of the provided agreement Categorize the Investment Objective using valid categories provided in <valid_categories> -- do not make any assumptions when determining your categorization (if no objective is mentioned or there are reference to other documents not provided that would contain this information select "Other or Not Found" and use a "Low" confidence rating)
+Return your Categorization in a valid json object using the <example_format> provided below 
+If multiple categories apply, include all applicable categories in the json object
+
+Only the below categories are valid options
+<valid_categories>
+Capital Preservation
+Income Generation
+Growth
+Balanced Growth and Income
+Aggressive Growth
+Tax-efficient investing
+Socially Responsible Investing
+Retirement Planning
+Education Funding
+Other or Not Found
+</valid_categories>
+
+<example_format>
+{
+  "Investment Objectives": {
+    "Objective1": "(Objective)",
+    "ObjectiveX": "(Objective - X representing the next number in order, only include these if there were multiple categories identified)"
+  }
+}
+</example_format>
+
+Also return your confidence level representing how confident you that you were able to accurately identify and categorize the requested information. Your confidence value should be one of "High", "Medium", or "Low"
+Use High Confidence in cases you have no doubt you have identified and captured ALL the correct information and there was no ambiguity and there is no need for a human to review
+Use Medium Confidence in cases where you are reasonably confident you have identified most of the information, but there might be some ambiguity and a human review would be beneficial
+Use Low Confidence in cases where you are not confident in the information you have captured or the data provided didn't include enough information, and a human needs to review
+
+
+Think through each step of your thought process and write your thoughts down in <scratchpad> xml tags
+return the valid json array with the extracted details in <output> xml tags, only including the valid json
+return your confidence level (Low, Medium, or High) in <confidence> xml tags
+record your explanation for your response and cite your work and reasoning in <show_work> xml tags
+
+"""
+
+
+def extract_investment_objectives(content):
+    system_prompt, max_tokens = SECTION_PROMPTS["Objective"]
+    return invoke_section(system_prompt, content, max_tokens=max_tokens, section="Objective")
+
+
+CUSTODIAN_SYSTEM_PROMPT="""
+You are an AI Data Processor whose goal is to identify and extract key information from an Investment Management Agreement for a wealth management client. You will be provided a Wealth Management Agreement (DIMA, IMA, or MDIMA)
+Using the document context of the provided agreement Identify and extract (making no changes) the details of information relevant to the roles, respososbilites, and all other information pertatining to the Custodian and Brokerage agreements present in the agreement. Make sure to capture all pertinent agreement information and relevant passages
+Return your Results in a valid json object using the <example_format> provided below
+
+<custodian_example>
+"1. The assets comprising the Client's account shall be held by ABC Trust Company, a nationally recognized custodian, or such other custodian as the parties may mutually agree upon in writing." 
+"2. XYZ Custodial Services, LLC, shall act as the custodian for the Client's account and shall provide custody and safekeeping services for the assets in the account." 
+"3. The Client's assets shall be held in a separate account at DEF Bank, a member of the Federal Deposit Insurance Corporation (FDIC)."
+</custodian_example>
+
+
+<brokerage_example>
+"1. All transactions for the Client's account shall be executed through GHI Brokerage Firm, a registered broker-dealer and member of the Financial Industry Regulatory Authority (FINRA)." 
+"2. The Investment Manager is authorized to select and utilize various broker-dealers for the execution of transactions on behalf of the Client's account, provided that such broker-dealers are registered with the Securities and Exchange Commission (SEC) and are members of FINRA." 
+"3. JKL Securities, LLC, shall serve as the introducing broker-dealer for the Client's account, and all transactions shall be cleared and settled through MNO Clearing Corporation."
+
+</brokerage_example>
+
+<example_format>
+{
+    "Custodian and Brokerage": {
+        "Custodian": "(Information Pertinent to the Custodian agreements)",
+        "Brokerage": "(Information Pertinent to the Brokerage agreements)"
+    }
+}
+</example_format>
+
+Also return your confidence level representing how confident you that you were able to accurately identify and extract the requested information. Your confidence value should be one of "High", "Medium", or "Low"
+Use High Confidence in cases you have no doubt you have identified and captured ALL the correct information and there was no ambiguity and there is no need for a human to review
+Use Medium Confidence in cases where you are reasonably confident you have identified most of the information, but there might be some ambiguity and a human review would be beneficial
+Use Low Confidence in cases where you are not confident in the information you have captured, and a human needs to review
+
+
+Think through each step of your thought process and write your thoughts down in <scratchpad> xml tags
+return the valid json array with the extracted details in <output> xml tags, only including the valid json
+return your confidence level (Low, Medium, or High) in <confidence> xml tags
+record your explanation for your response and cite your work and reasoning in <show_work> xml tags, ask yourself did i capture ALL of the pertinent Custodian and Brokerage information in the agreement?
+
+"""
+
+
+def extract_custodian_info(content):
+    system_prompt, max_tokens = SECTION_PROMPTS["Custodian and Brokerage"]
+    return invoke_section(system_prompt, content, max_tokens=max_tokens, section="Custodian and Brokerage")
+
+
+FEE_SYSTEM_PROMPT="""
+You are an AI Data Processor whose goal is to identify and extract key information from an Investment Management Agreement for a wealth management client. You will be provided a Wealth Management Agreement (DIMA, IMA, or MDIMA)
+Using the document context of the provided agreement Extract the Fee Structure and Compensation details in the agreement and Categorize the Fee type
+Categorize the Fee Structure into one of the provided categories (Dont make assumptions - if no objective is mentioned or there are reference to other documents not provided that would contain this information select "Other or Not Found" and use a "Low" confidence rating)
+Return your Categorization in a valid json object using the <example_format> provided below 
+If multiple categories apply, include all applicable categories in the json object
+
+Only the below categories are valid options
+<valid_categories>
+Asset-based Fee
+Tiered Asset-based Fee
+Performance-based fee
+Fixed Fee
+Hourly or Project-based Fee
+Subscription or Retainer Fee
+Transaction-based Fee
+Additional Expenses
+Other or Not Found
+</valid_categories>
+
+<example_format>
+{
+  "Fee": {
+    "Fee Structure": "(Identified Fee Structure, if multiple apply include as comma separated value)",
+    "Compensation Details": "(Details of the Fee Structure and Compensation - Example: "The Investment Manager's fee shall be calculated based on the following tiered schedule: - First $1,000,000 of assets: [X%] - Next $2,000,000 of assets: [Y%] - Assets over $3,000,000: [Z%]")"
+  }
+}
+</example_format>
+
+Also return your confidence level representing how confident you that you were able to accurately identify and extract, and categorize the requested information. Your confidence value should be one of "High", "Medium", or "Low"
+Use High Confidence in cases you have no doubt you have identified and captured ALL the correct information and there was no ambiguity and there is no need for a human to review
+Use Medium Confidence in cases where you are reasonably confident you have identified most of the information, but there might be some ambiguity and a human review would be beneficial
+Use Low Confidence in cases where you are not confident in the information you have captured or the data provided didn't include enough information, and a human needs to review
+
+
+Think through each step of your thought process and write your thoughts down in <scratchpad> xml tags
+return the valid json array with the extracted details in <output> xml tags, only including the valid json
+return your confidence level (Low, Medium, or High) in <confidence> xml tags
+record your explanation for your response and cite your work and reasoning in <show_work> xml tags
+
+"""
+
+
+def extract_fee_info(content):
+    system_prompt, max_tokens = SECTION_PROMPTS["Fee"]
+    return invoke_section(system_prompt, content, max_tokens=max_tokens, section="Fee")
+
+
+EFFECTIVE_DATE_SYSTEM_PROMPT="""
+You are an AI Data Processor whose goal is to identify and extract key information from an Investment Management Agreement for a wealth management client. You will be provided a Wealth Management Agreement (DIMA, IMA, or MDIMA)
+Using the document context of the provided agreement Identify and extract (making no changes)Effective Date of the Agreement
+Also capture the signature dates for the Client and the Investment Firm
+Return your Results in a valid json object using the <example_format> provided below
+
+<example_format>
+{
+    "Effective Date": {
+        "Effective Date": "(The Effective Date of the Agreement)",
+        "Client Signature Date": "(The Date the Client Signed the Agreement)",
+        "Investment Firm Signature Date": "(The Date the Investment Firm Signed the agreement)"
+    }
+}
+</example_format>
+
+Also return your confidence level representing how confident you that you were able to accurately identify and extract the requested information. Your confidence value should be one of "High", "Medium", or "Low"
+Use High Confidence in cases you have no doubt you have identified and captured ALL the correct information and there was no ambiguity and there is no need for a human to review
+Use Medium Confidence in cases where you are reasonably confident you have identified most of the information, but there might be some ambiguity and a human review would be beneficial
+Use Low Confidence in cases where you are not confident in the information you have captured or the data provided didn't include enough information, and a human needs to review
+
+
+Think through each step of your thought process and write your thoughts down in <scratchpad> xml tags
+return the valid json array with the extracted details in <output> xml tags, only including the valid json
+return your confidence level (Low, Medium, or High) in <confidence> xml tags
+record your explanation for your response and cite your work and reasoning in <show_work> xml tags
+
+"""
+
+
+def extract_effective_date(content):
+    system_prompt, max_tokens = SECTION_PROMPTS["Effective Date"]
+    return invoke_section(system_prompt, content, max_tokens=max_tokens, section="Effective Date")
+
+
+# section name -> (system prompt, max_tokens) used by its extractor
+SECTION_PROMPTS = {
+    "Party": (PARTY_SYSTEM_PROMPT, 2000),
+    "Objective": (OBJECTIVE_SYSTEM_PROMPT, 2000),
+    "Custodian and Brokerage": (CUSTODIAN_SYSTEM_PROMPT, 3000),
+    "Fee": (FEE_SYSTEM_PROMPT, 2000),
+    "Effective Date": (EFFECTIVE_DATE_SYSTEM_PROMPT, 3000),
+}
+
+# section name -> (search terms, opening clauses always included) for clause retrieval;
+# the parties and the effective date are usually named in the preamble
+SECTION_QUERIES = {
+    "Party": (["between", "client", "investment manager", "manager", "party", "parties", "company", "incorporated", "signed", "name", "by", "director", "individual"], 5),
+    "Objective": (["investment objective", "objectives", "guidelines", "strategy", "growth", "income", "capital preservation", "risk", "return", "portfolio", "retirement", "tax", "restrictions"], 0),
+    "Custodian and Brokerage": (["custodian", "custody", "safekeeping", "broker", "brokers", "brokerage", "dealer", "execution", "transactions", "settlement", "clearing", "counterparty", "account"], 0),
+    "Fee": (["fee", "fees", "compensation", "remuneration", "percent", "%", "per annum", "basis points", "expenses", "payable", "quarterly", "invoice", "charges", "performance"], 0),
+    "Effective Date": (["effective", "date", "dated", "commence", "commencement", "signed", "day", "witness", "executed", "signature", "term"], 5),
+}
+
+
+# section name -> models to try in order when tiering; section_tiers='{"Fee": ["<model>", ...]}' overrides entries
+SECTION_TIERS = {section: [fast_model_id, model_id] for section in SECTION_PROMPTS}
+SECTION_TIERS.update(json.loads(os.getenv('section_tiers', '{}')))
+
+# section name -> deterministic extractor tried before the model when the fast path is on
+FAST_PATH_RULES = {
+    "Effective Date": mdima_rules.effective_date,
+    "Fee": mdima_rules.fee,
+}
+
+# top-level key each section's output json must contain
+SECTION_OUTPUT_KEYS = {
+    "Party": "Parties Involved",
+    "Objective": "Investment Objectives",
+    "Custodian and Brokerage": "Custodian and Brokerage",
+    "Fee": "Fee",
+    "Effective Date": "Effective Date",
+}
+
+
+# tag each section's answer is wrapped in when every section is requested in one call
+COMBINED_TAGS = {
+    "Party": "party",
+    "Objective": "objective",
+    "Custodian and Brokerage": "custodian_brokerage",
+    "Fee": "fee",
+    "Effective Date": "effective_date",
+}
+# Claude 3 caps a single response at 4096 output tokens
+COMBINED_MAX_TOKENS = 4096
+
+COMBINED_SYSTEM_PROMPT = """
+You are an AI Data Processor whose goal is to identify and extract key information from an Investment Management Agreement for a wealth management client. You will be provided a Wealth Management Agreement (DIMA, IMA, or MDIMA)
+You have {count} separate extraction tasks to complete against the same agreement. The full instructions for each task are given in its own xml tag below
+Complete every task independently, following its instructions exactly, and wrap that task's complete answer (its scratchpad, output, confidence and show_work xml tags) in the matching result tag listed at the end, in the order listed
+Keep every scratchpad brief so that all of the results fit in a single response
+
+{instructions}
+
+Return your results as:
+{result_tags}
+""".format(
+    count=len(COMBINED_TAGS),
+    instructions="\n\n".join(f"<{tag}_task>\n{SECTION_PROMPTS[section][0].strip()}\n</{tag}_task>" for section, tag in COMBINED_TAGS.items()),
+    result_tags="\n".join(f"<{tag}_result> ... </{tag}_result>" for tag in COMBINED_TAGS.values()),
+)
+
+# section name -> extractor, in final_json order
+SECTIONS = {
+    "Party": extract_party_info,
+    "Objective": extract_investment_objectives,
+    "Custodian and Brokerage": extract_custodian_info,
+    "Fee": extract_fee_info,
+    "Effective Date": extract_effective_date,
+}
+
+
+def final_json(party_json, objective_json, custodian_json, fee_json, effective_date_json, file_name):
+    final_json = {
+        "File Name": file_name,
+        "Data": {
+            "Party": party_json,
+            "Objective": objective_json,
+            "Custodian and Brokerage": custodian_json,
+            "Fee": fee_json,
+            "Effective Date": effective_date_json
+        }
+    }
+    return final_json
+
+
+def load_pages(pdf, metrics=None):
+    # page-indexed text for the PDF, straight from the cache when these exact bytes were seen before
+    metrics = Metrics() if metrics is None else metrics
+    with metrics.timer("pdf_load") as record:
+        pdf_bytes = read_source(pdf)
+        pdf_key = hash_bytes(pdf_bytes)
+        record.update(document_hash=pdf_key, bytes=len(pdf_bytes))
+        cached_pages = get_cache().get("pdf_pages", pdf_key)
+        record["cached"] = cached_pages is not None
+        if cached_pages is not None:
+            # json object keys come back as strings
+            pages = {int(number): page_text for number, page_text in cached_pages.items()}
+        else:
+            timings = {}
+            pages = extract_pages(pdf_bytes, timings=timings)
+            for page_number, seconds in timings.items():
+                metrics.emit("page_text", page=page_number, seconds=seconds, chars=len(pages[page_number]))
+            get_cache().set("pdf_pages", pdf_key, pages)
+        record["pages"] = len(pages)
+    return pdf_key, pages
+
+
+def prepare_text(pages, metrics=None, normalize=normalize_text):
+    # (pages, document text) the extractors work from: normalized pages when normalize is set, the raw text otherwise
+    metrics = Metrics() if metrics is None else metrics
+    if not normalize:
+        return pages, join_pages(pages)
+    with metrics.timer("normalize") as record:
+        pages, report = normalize_pages(pages)
+        record.update(pages=report["pages"], tokens_before=report["tokens_before"], tokens_after=report["tokens_after"],
+                      removed_lines=sum(len(lines) for lines in report["removed_lines"].values()))
+    return pages, marked_text(pages)
+
+
+def run_fast_path(pdf, document_hash, pages, metrics=None):
+    # section -> completion for every section the rules answered completely; the rest go to the model
+    metrics = Metrics() if metrics is None else metrics
+    completions = {}
+    with metrics.timer("fast_path") as record:
+        cached_tables = get_cache().get("pdf_tables", document_hash)
+        if cached_tables is not None:
+            tables = {int(number): page_tables for number, page_tables in cached_tables.items()}
+        else:
+            tables = extract_tables(pdf, mdima_rules.table_pages(pages))
+            get_cache().set("pdf_tables", document_hash, tables)
+        record["table_pages"] = len(tables)
+        for section, rule in FAST_PATH_RULES.items():
+            answer = rule(pages, tables)
+            if answer is None:
+                continue
+            output, show_work = answer
+            completion = ("", json.dumps(output), "High", show_work)
+            if escalation_reason(section, completion) is None:
+                completions[section] = completion
+        record["sections"] = list(completions)
+    return completions
+
+
+def validate_json(output):
+    try:
+        json.loads(output)
+    except ValueError as e:
+        return f"invalid json: {e}"
+    return None
+
+
+def validate_output(section, output):
+    # returns a description of what is wrong with a section's <output>, or None when it matches the section's schema
+    # parse_completion leaves output "" when the tag never closed
+    return check_completion(section, {"output": output, "confidence": "High"} if output else {})
+
+
+def escalation_reason(section, completion):
+    # why a tier's answer is not good enough to keep, or None
+    scratch, output, confidence, show_work = completion
+    problem = validate_output(section, output)
+    if problem:
+        return problem
+    if confidence.strip().lower() != "high":
+        return f"{confidence.strip() or 'no'} confidence"
+    return None
+
+
+def _section_result(section, completion):
+    # raises ValueError when the output does not match the section's schema
+    scratch, output, confidence, show_work = completion
+    problem = validate_output(section, output)
+    if problem:
+        raise ValueError(f"unusable output: {problem}")
+    return {"json": json.loads(output), "confidence": normalize_confidence(confidence), "show_work": show_work, "error": None}
+
+
+def run_windows(section, pages, windows, executor):
+    # map: the section's extractor over every window on the shared executor; reduce: one merged answer
+    # with per-field page citations. Windows that fail or return unusable output are left out of the merge
+    system_prompt, max_tokens = SECTION_PROMPTS[section]
+
+    def one(window):
+        attempt = {}
+        return invoke_section(system_prompt, window_text(pages, window), max_tokens, stats=attempt, section=section), attempt
+
+    futures = [executor.submit(contextvars.copy_context().run, one, window) for window in windows]
+    stats = {"attempts": [], "input_tokens": 0, "output_tokens": 0, "retries": 0, "windows": len(windows), "failed_windows": 0}
+    partials = []
+    errors = []
+    for window, future in zip(windows, futures):
+        try:
+            completion, attempt = future.result()
+        except Exception as e:
+            errors.append(f"pages {window[0]}-{window[-1]}: {type(e).__name__}: {e}")
+            stats["failed_windows"] += 1
+            continue
+        attempt["pages"] = [window[0], window[-1]]
+        stats["attempts"].append(attempt)
+        for field in ("input_tokens", "output_tokens", "retries"):
+            stats[field] += attempt.get(field) or 0
+        scratch, output, confidence, show_work = completion
+        problem = validate_output(section, output)
+        if problem:
+            errors.append(f"pages {window[0]}-{window[-1]}: {problem}")
+            stats["failed_windows"] += 1
+            continue
+        partials.append((window, json.loads(output), normalize_confidence(confidence), show_work))
+    if not partials:
+        # failed, but with its stats so the failed windows are still counted
+        return {"json": None, "confidence": "", "show_work": "", "error": f"ValueError: no window returned a usable answer ({'; '.join(errors)})",
+                "stats": stats}
+    merged, confidence, show_work, citations = merge_partials(SECTION_OUTPUT_KEYS[section], partials, pages)
+    result = {"json": merged, "confidence": confidence, "show_work": show_work, "error": None, "citations": citations}
+    result["stats"] = stats
+    return result
+
+
+def section_content(section, text, index=None):
+    # the whole document, or only the section's most relevant clauses when a clause index is given
+    if index is None:
+        return text
+    query, lead_clauses = SECTION_QUERIES[section]
+    return index.context(query, lead_clauses=lead_clauses)
+
+
+def build_index(pages, top_k=retrieval_top_k, token_budget=retrieval_token_budget):
+    return ClauseIndex(pages, top_k=top_k, token_budget=token_budget) if top_k > 0 else None
+
+
+def run_sections(text, max_workers=max_workers, on_section=None, mode=extraction_mode, index=None, stream=streaming, stop_early=False,
+                 on_partial=None, metrics=None, tiering=model_tiering, fast_results=None, pages=None, reused_results=None):
+    # run the section extractors concurrently; on_section(section, result) is called from the
+    # calling thread as each one finishes, so UI code can safely render from it. When streaming,
+    # on_partial(section, {"json", "confidence"}) is also called (from the calling thread) as soon
+    # as a section's <output> and <confidence> have arrived. Sections in fast_results (from
+    # run_fast_path) are finished straight away and never sent to Bedrock, and so are the sections in
+    # reused_results (from plan_amendment, carried over from an earlier version). Chunked mode needs
+    # the page-indexed text in pages and ignores index, tiering and streaming
+    metrics = Metrics() if metrics is None else metrics
+    results = {}
+
+    def finish(section, result):
+        results[section] = result
+        stats = result.get("stats", {})
+        if fast_results is not None:
+            stats = {"fast_path": section in fast_results, **stats}
+        if reused_results is not None:
+            stats = {"reused": section in reused_results, **stats}
+        # the flags go on the result too, so callers can tell how each section was answered
+        result["stats"] = stats
+        metrics.emit("section", section=section, error=result["error"], **stats)
+        if on_section is not None:
+            on_section(section, result)
+
+    for section, result in (reused_results or {}).items():
+        finish(section, result)
+    for section, completion in (fast_results or {}).items():
+        if section not in results:
+            finish(section, _section_result(section, completion))
+
+    if mode == "combined" and len(results) < len(SECTIONS):
+        # a single request for all sections, anything missing or invalid falls through to its own call below
+        stats = {}
+        try:
+            completions = invoke_combined(text, stats=stats)
+        except Exception as e:
+            # the error reaches the metrics in the "combined" record; every section falls back to its own call
+            completions = {}
+            stats["error"] = f"{type(e).__name__}: {e}"
+        usable = {}
+        for section, completion in completions.items():
+            if section in results:
+                continue
+            try:
+                usable[section] = _section_result(section, completion)
+            except ValueError as e:
+                stats.setdefault("parse_errors", {})[section] = str(e)
+        metrics.emit("combined", **stats)
+        for section, result in usable.items():
+            finish(section, result)
+
+    # worker threads only post events, the calling thread runs every callback
+    events = queue.Queue()
+
+    def run(section):
+        if windows is not None:
+            started = time.perf_counter()
+            result = run_windows(section, pages, windows, window_executor)
+            result["stats"]["seconds"] = time.perf_counter() - started
+            return result
+        system_prompt, max_tokens = SECTION_PROMPTS[section]
+        content = section_content(section, text, index)
+        tiers = SECTION_TIERS[section] if tiering else [model_id]
+        stats = {"attempts": [], "input_tokens": 0, "output_tokens": 0, "retries": 0}
+        started = time.perf_counter()
+
+        for tier, tier_model in enumerate(tiers):
+            final_tier = tier == len(tiers) - 1
+
+            def early_result(output, confidence):
+                # only show an early answer that will not be replaced by an escalation or a repair
+                completion = ("", output, confidence, "")
+                if escalation_reason(section, completion) if not final_tier else validate_output(section, output):
+                    return
+                events.put(("partial", section, {"json": json.loads(output), "confidence": normalize_confidence(confidence)}))
+
+            attempt = {}
+            completion = invoke_section(system_prompt, content, max_tokens, model_id=tier_model, stats=attempt, stream=stream,
+                                        on_result=early_result if on_partial else None, stop_early=stop_early, section=section)
+            reason = escalation_reason(section, completion) if not final_tier else None
+            attempt["escalation_reason"] = reason
+            stats["attempts"].append(attempt)
+            for field in ("input_tokens", "output_tokens", "retries"):
+                stats[field] += attempt.get(field) or 0
+            if reason is None:
+                break
+
+        # the answer that was kept decides the headline numbers
+        stats.update({key: value for key, value in attempt.items() if key not in ("input_tokens", "output_tokens", "retries")})
+        stats["tier"] = tier
+        stats["tiers"] = len(tiers)
+        stats["escalated"] = tier > 0
+        stats["seconds"] = time.perf_counter() - started
+        try:
+            result = _section_result(section, completion)
+        except ValueError as e:
+            # failed after its repairs, but with its stats so the parse failure is still reported
+            result = {"json": None, "confidence": "", "show_work": "", "error": f"{type(e).__name__}: {e}"}
+        result["stats"] = stats
+        return result
+
+    pending = [section for section in SECTIONS if section not in results]
+    windows = None
+    if mode == "chunked":
+        pages = pages or {1: text}
+        windows = page_windows(pages, chunk_tokens, chunk_overlap_pages)
+        metrics.emit("chunking", windows=len(windows), pages=len(pages), window_tokens=chunk_tokens, overlap_pages=chunk_overlap_pages)
+    # window requests of every section share one pool, the section threads only wait on them and merge
+    with ThreadPoolExecutor(max_workers=max_workers) as window_executor, ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for section in pending:
+            # carry the caller's context (e.g. its scheduler priority) into the worker thread
+            future = executor.submit(contextvars.copy_context().run, run, section)
+            future.add_done_callback(lambda future, section=section: events.put(("done", section, future)))
+        for _ in pending:
+            kind, section, payload = events.get()
+            while kind == "partial":
+                on_partial(section, payload)
+                kind, section, payload = events.get()
+            try:
+                result = payload.result()
+            except Exception as e:
+                # a failed section should not throw away the ones that already completed
+                result = {"json": None, "confidence": "", "show_work": "", "error": f"{type(e).__name__}: {e}"}
+            finish(section, result)
+    return {section: results[section] for section in SECTIONS}
+
+
+def build_final_json(results, file_name):
+    return final_json(*(results[section]["json"] for section in SECTIONS), file_name)
+
+
+def result_record(combined_json, results, document_hash, amendment=None):
+    # final_json plus the per-section confidence, explanation and errors (and, for an amended version,
+    # what changed since the previous one), one line of batch output
+    record = dict(combined_json)
+    record["Document Hash"] = document_hash
+    record["Confidence"] = {section: result["confidence"] for section, result in results.items()}
+    record["Explanation"] = {section: result["show_work"] for section, result in results.items()}
+    citations = {section: result["citations"] for section, result in results.items() if result.get("citations")}
+    if citations:
+        record["Citations"] = citations
+    errors = {section: result["error"] for section, result in results.items() if result["error"]}
+    if errors:
+        record["Errors"] = errors
+    if amendment:
+        record["Amendment"] = amendment
+    return record
+
+
+def section_sources(pages):
+    # section -> pages its answer can be drawn from: the clauses its search terms select
+    index = ClauseIndex(pages, top_k=mdima_versions.PROVENANCE_TOP_K, token_budget=float("inf"))
+    return {section: mdima_versions.query_pages(pages, query, lead_clauses, index=index) for section, (query, lead_clauses) in SECTION_QUERIES.items()}
+
+
+def plan_amendment(document_hash, pages, previous=None, metrics=None):
+    """Diff a document against the earlier version it amends.
+
+    previous is that version's document hash; without it the processed document sharing the
+    most pages is used. Returns None when there is no earlier version, otherwise a plan with
+    the previous version, the page diff and reused: section -> result for every section whose
+    source pages are unchanged in both versions (citations moved to the new page numbers).
+    """
+    metrics = Metrics() if metrics is None else metrics
+    with metrics.timer("amendment_diff") as record:
+        hashes = mdima_versions.page_hashes(pages)
+        prior = get_versions().get(previous) if previous else get_versions().match(hashes)
+        record["matched"] = prior is not None
+        if prior is None:
+            return None
+        changed_old, changed_new, mapping = mdima_versions.diff_pages(prior["page_hashes"], hashes)
+        sources = section_sources(pages)
+        reused = {}
+        for section in SECTIONS:
+            result = prior["results"].get(section)
+            if result is None or result.get("error"):
+                continue
+            # a section re-runs when a page it was drawn from changed, or a changed page is now among its sources
+            if set(prior["provenance"].get(section, [])) & set(changed_old) or set(sources[section]) & set(changed_new):
+                continue
+            reused[section] = mdima_versions.remap_result(result, mapping)
+        record.update(previous=prior["document_hash"], changed_pages=len(changed_new), removed_pages=len(changed_old), reused=list(reused))
+    return {"previous": prior, "hashes": hashes, "sources": sources, "changed_pages": changed_new, "removed_pages": changed_old, "mapping": mapping, "reused": reused}
+
+
+def record_version(document_hash, file_name, pages, results, plan=None):
+    # stores the document's page hashes, results and section sources; returns the amendment report when it had a previous version
+    sources = plan["sources"] if plan else section_sources(pages)
+    provenance = {}
+    for section, result in results.items():
+        if plan and section in plan["reused"]:
+            old_pages = plan["previous"]["provenance"].get(section, [])
+            provenance[section] = sorted(plan["mapping"][number] for number in old_pages if number in plan["mapping"])
+        else:
+            provenance[section] = sorted(set(sources[section]) | set(mdima_versions.answer_pages(pages, result)))
+    previous = plan["previous"] if plan else None
+    if previous and previous["document_hash"] == document_hash:
+        # the same document again: keep the link to the version before it
+        previous = get_versions().get(previous["previous"]) if previous["previous"] else None
+    get_versions().save(document_hash, file_name, plan["hashes"] if plan else mdima_versions.page_hashes(pages), provenance, results,
+                        previous=previous["document_hash"] if previous else None)
+    if plan is None:
+        return None
+    return {
+        "Previous Document Hash": plan["previous"]["document_hash"],
+        "Previous File Name": plan["previous"]["file_name"],
+        "Changed Pages": plan["changed_pages"],
+        "Removed Pages": plan["removed_pages"],
+        "Re-extracted": [section for section in results if section not in plan["reused"]],
+        "Reused": list(plan["reused"]),
+        "Fields": mdima_versions.field_report(plan["previous"]["results"], results, plan["reused"]),
+    }
+
+
+def run_pipeline(pdf, file_name, max_workers=max_workers, on_section=None, mode=extraction_mode, top_k=retrieval_top_k,
+                 token_budget=retrieval_token_budget, stream=streaming, stop_early=False, metrics=None, tiering=model_tiering,
+                 fast_path=fast_path, incremental=incremental, previous=None, normalize=normalize_text, on_partial=None, on_pages=None):
+    # with incremental, previous optionally names (by document hash) the version this one amends.
+    # Versions are diffed and recorded on the raw page text, the extractors get the normalized pages.
+    # on_section and on_partial are passed to run_sections; on_pages(pages, text) is called with the
+    # text the extractors will get, before any of them run
+    metrics = Metrics() if metrics is None else metrics
+    with metrics.timer("document", file_name=file_name, mode=mode):
+        # read once, the fast path opens the PDF again for its tables
+        pdf = read_source(pdf)
+        document_hash, raw_pages = load_pages(pdf, metrics=metrics)
+        plan = plan_amendment(document_hash, raw_pages, previous, metrics=metrics) if incremental else None
+        pages, text = prepare_text(raw_pages, metrics=metrics, normalize=normalize)
+        fast_results = run_fast_path(pdf, document_hash, pages, metrics=metrics) if fast_path else None
+        with metrics.timer("index_build", top_k=top_k):
+            index = build_index(pages, top_k=top_k, token_budget=token_budget)
+        if on_pages is not None:
+            on_pages(pages, text)
+        results = run_sections(text, max_workers=max_workers, on_section=on_section, mode=mode, index=index,
+                               stream=stream, stop_early=stop_early, on_partial=on_partial, metrics=metrics, tiering=tiering,
+                               fast_results=fast_results, pages=pages, reused_results=plan["reused"] if plan else None)
+        amendment = record_version(document_hash, file_name, raw_pages, results, plan) if incremental else None
+    return result_record(build_final_json(results, file_name), results, document_hash, amendment)
@@ -0,0 +1,113 @@
+import math
+import re
+from collections import Counter
+
+# a clause starts at a numbered heading ("9.", "9.1", "(a)", "(iv)", "A.") or an all-caps heading line
+CLAUSE_START = re.compile(r"^\s*(?:\d{1,3}(?:\.\d{1,3})*\.?|\([a-z]{1,4}\)|\(\d{1,3}\)|[A-Z]\.)\s+\S|^\s*[A-Z][A-Z0-9 ,;:'&()\-]{6,}$")
+CLAUSE_NUMBER = re.compile(r"^\s*(\d{1,3}(?:\.\d{1,3})*(?=\.?\s)|\([a-z0-9]{1,4}\)|[A-Z](?=\.\s))")
+TOKEN = re.compile(r"[a-z0-9$%]+")
+STOPWORDS = frozenset(
+    "a an and any are as at be by for from has have in is it its of on or shall such that the this to under was which will with".split()
+)
+
+# a single line this short is treated as a heading and kept together with the clause that follows it
+HEADING_WORDS = 6
+# clauses longer than this are split so a single schedule cannot swallow the whole budget
+MAX_CLAUSE_WORDS = 250
+# rough token estimate used for the per-section budget
+CHARS_PER_TOKEN = 4
+
+
+def tokenize(text):
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def split_clauses(pages):
+    """Split {page number: text} into numbered clauses/paragraphs, each remembering the pages it spans."""
+    clauses = []
+    current = None
+    for page_number in sorted(pages):
+        for line in pages[page_number].splitlines():
+            if not line.strip():
+                continue
+            is_heading = current is not None and len(current["lines"]) == 1 and len(current["words"]) <= HEADING_WORDS
+            starts_clause = current is None or (CLAUSE_START.match(line) and not is_heading)
+            if starts_clause or len(current["words"]) >= MAX_CLAUSE_WORDS:
+                number = CLAUSE_NUMBER.match(line)
+                current = {"number": number.group(1) if number else "", "pages": [page_number], "lines": [], "words": []}
+                clauses.append(current)
+            elif current["pages"][-1] != page_number:
+                current["pages"].append(page_number)
+            current["lines"].append(line.strip())
+            current["words"].extend(line.split())
+    return [
+        {"id": index, "number": clause["number"], "pages": clause["pages"], "text": "\n".join(clause["lines"])}
+        for index, clause in enumerate(clauses)
+    ]
+
+
+class ClauseIndex:
+    """In-process BM25 index over a document's clauses; no network or GPU needed."""
+
+    def __init__(self, pages, top_k=8, token_budget=3000, k1=1.5, b=0.75):
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self.k1 = k1
+        self.b = b
+        self.clauses = split_clauses(pages)
+        self._terms = [Counter(tokenize(clause["text"])) for clause in self.clauses]
+        self._lengths = [sum(terms.values()) for terms in self._terms]
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+        document_frequency = Counter(term for terms in self._terms for term in terms)
+        total = len(self.clauses)
+        self._idf = {
+            term: math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+            for term, frequency in document_frequency.items()
+        }
+
+    def search(self, query, k=None):
+        """Return [(score, clause)] for the k best matching clauses, best first."""
+        query_terms = set(tokenize(" ".join(query) if isinstance(query, (list, tuple)) else query))
+        scored = []
+        for clause, terms, length in zip(self.clauses, self._terms, self._lengths):
+            score = 0.0
+            for term in query_terms:
+                frequency = terms.get(term)
+                if frequency:
+                    norm = self.k1 * (1 - self.b + self.b * length / (self._avg_length or 1))
+                    score += self._idf[term] * frequency * (self.k1 + 1) / (frequency + norm)
+            if score > 0:
+                scored.append((score, clause))
+        scored.sort(key=lambda item: (-item[0], item[1]["id"]))
+        return scored[: k or self.top_k]
+
+    def select(self, query, lead_clauses=0):
+        """Pick the top-k clauses for the query (plus the opening clauses if asked) within the token budget."""
+        chosen = {clause["id"]: clause for clause in self.clauses[:lead_clauses]}
+        used = sum(estimate_tokens(clause["text"]) for clause in chosen.values())
+        for score, clause in self.search(query):
+            if clause["id"] in chosen:
+                continue
+            cost = estimate_tokens(clause["text"])
+            if used + cost > self.token_budget:
+                continue
+            chosen[clause["id"]] = clause
+            used += cost
+        # hand the passages to the model in document order
+        return [chosen[clause_id] for clause_id in sorted(chosen)]
+
+    def context(self, query, lead_clauses=0):
+        """Render the selected passages, with page citations, as the content for one extractor."""
+        passages = []
+        for clause in self.select(query, lead_clauses):
+            pages = clause["pages"]
+            cite = str(pages[0]) if len(pages) == 1 else f"{pages[0]}-{pages[-1]}"
+            passages.append(f'<passage page="{cite}" clause="{clause["number"]}">\n{clause["text"]}\n</passage>')
+        return (
+            "The passages below are the parts of the agreement most relevant to this task, each cited with its page number.\n"
+            + "\n".join(passages)
+        )
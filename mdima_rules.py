@@ -0,0 +1,258 @@
+import datetime
+import re
+
+from mdima_retrieval import split_clauses
+
+# deterministic extractors for the sections whose answers follow predictable forms; each returns
+# (output json, show_work) only when the answer is complete and unambiguous, otherwise None so the
+# section goes to the model as usual
+
+MONTHS = ("january", "february", "march", "april", "may", "june", "july", "august", "september", "october", "november", "december")
+# month number for every abbreviation of at least three letters ("dec", "decem", "december")
+MONTH_PREFIXES = {name[:length]: index + 1 for index, name in enumerate(MONTHS) for length in range(3, len(name) + 1)}
+MONTH = r"(?:Jan(?:uary)?|Feb(?:ruary)?|Mar(?:ch)?|Apr(?:il)?|May|June?|July?|Aug(?:ust)?|Sep(?:t(?:ember)?)?|Oct(?:ober)?|Nov(?:ember)?|Dec(?:ember)?)"
+# "20th December 2007", "the 20th day of December, 2007", "December 20, 2007", "12/20/2007", "2007-12-20"
+DATE = re.compile(
+    rf"\b\d{{1,2}}(?:st|nd|rd|th)?\s+(?:day\s+of\s+)?{MONTH}\.?,?\s+\d{{4}}\b"
+    rf"|\b{MONTH}\.?\s+\d{{1,2}}(?:st|nd|rd|th)?,?\s+\d{{4}}\b"
+    r"|\b\d{1,2}/\d{1,2}/\d{4}\b|\b\d{4}-\d{2}-\d{2}\b",
+    re.I,
+)
+PERCENT = re.compile(r"\b\d{1,3}(?:\.\d+)?\s?(?:%|percent\b|per cent\b)|\b\d+(?:\.\d+)?\s+basis\s+points\b", re.I)
+CURRENCY = re.compile(r"(?:[$£€]|\b(?:USD|GBP|EUR)\s?)\s?\d[\d,]*(?:\.\d+)?(?:\s?(?:million|billion|m|bn)\b)?", re.I)
+
+# sentences that state the effective date outright
+EFFECTIVE_DATE_STATEMENTS = [
+    re.compile(rf"effective\s+date[”\"’']?\s+(?:of\s+this\s+agreement\s+)?(?:is|shall\s+be|means)\s+(?:the\s+)?({DATE.pattern})", re.I),
+    re.compile(rf"(?:effective|commenc\w*)\s+(?:as\s+of|from|on)\s+(?:the\s+)?({DATE.pattern})", re.I),
+    re.compile(rf"(?:dated|made|entered\s+into)\s+(?:as\s+of\s+)?(?:this\s+|the\s+)?({DATE.pattern})", re.I),
+]
+
+# signature block fields; a block starts at "By:" and runs until the next one
+SIGNATURE_FIELD = re.compile(r"^\s*(By|Name|Title|Date|Dated)\s*:\s*(.*)$", re.I)
+SIGNATURE_LINES = 6
+CLIENT_LABEL = re.compile(r"\b(?:client|customer|investor)\b", re.I)
+MANAGER_LABEL = re.compile(r"\b(?:investment\s+manager|manager|advis[eo]r|investment\s+firm)\b", re.I)
+# words that mark a firm name as the investment firm when the blocks carry no role labels
+MANAGER_FIRM = re.compile(r"\b(?:investments?|advis[eo]rs?|advisory|management|managers?|asset|capital|wealth)\b", re.I)
+
+FEE_CLAUSE = re.compile(r"\b(?:fees?|compensation|remuneration)\b", re.I)
+# "First $1,000,000", "Next $2,000,000", "Over $3,000,000", "thereafter"
+TIER_WORD = re.compile(r"\b(?:first|next|over|above|in\s+excess\s+of|thereafter|balance|remaining|up\s+to|from)\b", re.I)
+ASSET_BASIS = re.compile(r"\b(?:market\s+value|net\s+asset\s+value|assets\s+under\s+management|value\s+of\s+the\s+(?:portfolio|account|assets)|managed\s+assets)\b", re.I)
+# fee types the rules do not categorize; a fee clause mentioning any of them is left to the model
+OTHER_FEES = re.compile(
+    r"\b(?:performance|incentive)\s+(?:fee|allocation|compensation)|carried\s+interest|high[- ]water\s+mark|hurdle|"
+    r"\bhourly\b|per\s+hour|retainer|subscription|fixed\s+fee|flat\s+fee|per\s+(?:transaction|trade)|ticket\s+charge",
+    re.I,
+)
+# a sub-clause number inside merged clause text ("... Fees 5.1 The Client ...")
+SUBCLAUSE = re.compile(r"(?:^|\s)\d{1,3}(?:\.\d{1,3})+\s")
+EXPENSES = re.compile(r"\b(?:pay|bear|reimburse|responsible\s+for|debit)\b[^.]{0,120}\bexpenses\b", re.I)
+
+
+def _date_key(text):
+    # textual dates compare by calendar day so "20th December 2007" and "December 20, 2007" agree
+    words = re.findall(r"[a-z]+|\d+", text.lower())
+    month = next((MONTH_PREFIXES[word] for word in words if word in MONTH_PREFIXES), None)
+    numbers = [int(word) for word in words if word.isdigit()]
+    if month is None or len(numbers) != 2:
+        return text.lower()
+    day, year = sorted(numbers)
+    return (year, month, day)
+
+
+def parse_date(text):
+    """The first date written in text as a datetime.date, or None; slashed dates are read month first."""
+    match = DATE.search(text or "")
+    if not match:
+        return None
+    value = match.group(0)
+    iso = re.fullmatch(r"(\d{4})-(\d{2})-(\d{2})", value)
+    slashed = re.fullmatch(r"(\d{1,2})/(\d{1,2})/(\d{4})", value)
+    try:
+        if iso:
+            return datetime.date(int(iso.group(1)), int(iso.group(2)), int(iso.group(3)))
+        if slashed:
+            return datetime.date(int(slashed.group(3)), int(slashed.group(1)), int(slashed.group(2)))
+        key = _date_key(value)
+        return datetime.date(*key) if isinstance(key, tuple) else None
+    except ValueError:
+        return None
+
+
+def _cite(clause):
+    pages = ", ".join(str(page) for page in clause["pages"])
+    label = f"Clause {clause['number']}" if clause["number"] else "The clause"
+    return f"{label} on page{'s' if len(clause['pages']) > 1 else ''} {pages}"
+
+
+def _sentence(text, start, end):
+    # the sentence around text[start:end], on one line
+    left = text.rfind(". ", 0, start) + 1
+    for number in SUBCLAUSE.finditer(text, 0, start):
+        left = max(left, number.end())
+    right = text.find(". ", end)
+    return text[left:right + 1 if right != -1 else len(text)].strip()
+
+
+def signature_blocks(pages):
+    """Return the signature blocks found in {page number: text}.
+
+    Each block is {"page", "party", "label", "by", "name", "title", "date"}; party is the line above
+    "By:" (usually the firm name) and label the line above that (e.g. "CLIENT:").
+    """
+    blocks = []
+    for page_number in sorted(pages):
+        lines = [line.strip() for line in pages[page_number].splitlines() if line.strip()]
+        for index, line in enumerate(lines):
+            field = SIGNATURE_FIELD.match(line)
+            if not field or field.group(1).lower() != "by":
+                continue
+            block = {"page": page_number, "party": "", "label": "", "by": field.group(2).strip(), "name": "", "title": "", "date": ""}
+            above = [text for text in lines[max(0, index - 2):index] if not SIGNATURE_FIELD.match(text)]
+            if above:
+                block["party"] = above[-1]
+                block["label"] = " ".join(above[:-1])
+            for text in lines[index + 1:index + 1 + SIGNATURE_LINES]:
+                field = SIGNATURE_FIELD.match(text)
+                if not field:
+                    continue
+                key = field.group(1).lower()
+                if key == "by":
+                    break
+                block["date" if key == "dated" else key] = field.group(2).strip()
+            blocks.append(block)
+    return blocks
+
+
+def _signature_roles(blocks):
+    # (client block, investment firm block), or None when the two signers cannot be told apart
+    dated = [block for block in blocks if DATE.fullmatch(block["date"])]
+    if len(dated) != 2:
+        return None
+    # role labels ("CLIENT:", "Investment Manager:") decide first, then which firm name reads like an investment firm
+    def labelled_client(block):
+        context = f"{block['label']} {block['party']}"
+        return CLIENT_LABEL.search(context) and not MANAGER_LABEL.search(context)
+
+    for is_client in (labelled_client, lambda block: not MANAGER_FIRM.search(block["party"])):
+        clients = [block for block in dated if is_client(block)]
+        if len(clients) == 1:
+            return clients[0], next(block for block in dated if block is not clients[0])
+    return None
+
+
+def effective_date(pages, tables=None):
+    clauses = split_clauses(pages)
+    found = []
+    for clause in clauses:
+        text = " ".join(clause["text"].split())
+        for statement in EFFECTIVE_DATE_STATEMENTS:
+            for match in statement.finditer(text):
+                found.append((match.group(1), clause))
+    if not found or len({_date_key(date) for date, clause in found}) != 1:
+        return None
+    blocks = signature_blocks(pages)
+    roles = _signature_roles(blocks)
+    if roles is None:
+        return None
+    client, firm = roles
+    date, clause = found[0]
+    output = {
+        "Effective Date": {
+            "Effective Date": date,
+            "Client Signature Date": client["date"],
+            "Investment Firm Signature Date": firm["date"],
+        }
+    }
+    show_work = (
+        f"{_cite(clause)} states the Effective Date as {date}. "
+        f"The signature block for {client['party'] or 'the client'} on page {client['page']} is dated {client['date']} and "
+        f"the signature block for {firm['party'] or 'the investment firm'} on page {firm['page']} is dated {firm['date']}."
+    )
+    return output, show_work
+
+
+def table_pages(pages):
+    # pages worth running pdfplumber's (slow) table extraction on: a fee and at least two lines carrying a rate,
+    # as any tier schedule has
+    return [number for number, text in sorted(pages.items())
+            if FEE_CLAUSE.search(text) and sum(1 for line in text.splitlines() if PERCENT.search(line)) >= 2]
+
+
+def _tier_rows(rows):
+    # [(label, rate)] for the rows of a table or the lines of a clause that read as fee tiers
+    tiers = []
+    for cells in rows:
+        cells = [" ".join((cell or "").split()) for cell in cells]
+        rates = [cell for cell in cells if PERCENT.fullmatch(cell)]
+        labels = [cell for cell in cells if cell and cell not in rates]
+        if len(rates) == 1 and labels and any(CURRENCY.search(label) or TIER_WORD.search(label) for label in labels):
+            tiers.append((" ".join(labels), rates[0]))
+    return tiers
+
+
+def _tier_lines(text):
+    tiers = []
+    for line in text.splitlines():
+        rates = PERCENT.findall(line)
+        if len(rates) == 1 and CURRENCY.search(line) and TIER_WORD.search(line):
+            label = " ".join(PERCENT.sub("", line).strip(" -:;,.").split())
+            tiers.append((label, rates[0].strip()))
+    return tiers
+
+
+def fee(pages, tables=None):
+    """Tiered or flat asset-based fees from fee clauses and pdfplumber tables ({page: [table rows]})."""
+    clauses = split_clauses(pages)
+    fee_clauses = [clause for clause in clauses if FEE_CLAUSE.search(clause["text"])]
+    if any(OTHER_FEES.search(clause["text"]) for clause in fee_clauses):
+        return None
+
+    schedules = []
+    for page_number, page_tables in sorted((tables or {}).items()):
+        for rows in page_tables:
+            tiers = _tier_rows(rows)
+            if len(tiers) >= 2:
+                schedules.append((tiers, f"The fee table on page {page_number}"))
+    for clause in fee_clauses:
+        tiers = _tier_lines(clause["text"])
+        if len(tiers) >= 2:
+            schedules.append((tiers, _cite(clause)))
+
+    flat = []
+    for clause in fee_clauses:
+        text = " ".join(clause["text"].split())
+        for match in PERCENT.finditer(text):
+            sentence = _sentence(text, match.start(), match.end())
+            if ASSET_BASIS.search(sentence) and len(PERCENT.findall(sentence)) == 1 and not CURRENCY.search(sentence):
+                flat.append((match.group(0), sentence, clause))
+
+    if len(schedules) == 1 and not flat:
+        tiers, source = schedules[0]
+        structure = ["Tiered Asset-based Fee"]
+        details = "The Investment Manager's fee is calculated on the following tiered schedule: " + " ".join(f"- {label}: {rate}" for label, rate in tiers)
+        show_work = f"{source} sets out {len(tiers)} fee tiers."
+    elif not schedules and len({rate for rate, sentence, clause in flat}) == 1:
+        rate, sentence, clause = flat[0]
+        structure = ["Asset-based Fee"]
+        details = sentence
+        show_work = f"{_cite(clause)} sets a single asset-based rate of {rate}."
+    else:
+        return None
+
+    # expenses are often a separate clause of the fee article ("9.3 The Client shall bear ...")
+    fee_articles = {clause["number"].split(".")[0] for clause in fee_clauses if clause["number"]}
+    expense_clauses = [clause for clause in clauses if clause in fee_clauses or clause["number"].split(".")[0] in fee_articles]
+    for clause in expense_clauses:
+        text = " ".join(clause["text"].split())
+        match = EXPENSES.search(text)
+        if match:
+            structure.append("Additional Expenses")
+            details += " " + _sentence(text, match.start(), match.end())
+            show_work += f" {_cite(clause)} makes the client responsible for expenses."
+            break
+
+    output = {"Fee": {"Fee Structure": ", ".join(structure), "Compensation Details": details}}
+    return output, show_work
@@ -0,0 +1,241 @@
+import contextvars
+import heapq
+import io
+import itertools
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError, IncompleteReadError
+
+# lower runs first: interactive UI work goes ahead of batch backfills
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+THROTTLE_ERRORS = frozenset({"ThrottlingException", "TooManyRequestsException"})
+RETRYABLE_ERRORS = THROTTLE_ERRORS | {"ServiceUnavailableException", "ModelTimeoutException", "InternalServerException", "ModelNotReadyException"}
+# connection failures, read timeouts and cut-off responses, which botocore's own retries would otherwise have covered
+TRANSIENT_ERRORS = (ConnectionError, HTTPClientError, IncompleteReadError)
+
+# priority of the requests made by the current thread; run_sections copies it into its workers
+_priority = contextvars.ContextVar("bedrock_priority", default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def priority(level):
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Refills continuously at rate_per_minute up to one minute's worth of capacity."""
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        # seconds until amount can be taken; a request bigger than the bucket only waits for a full bucket
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.tokens -= amount
+
+    def give(self, amount):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class BedrockScheduler:
+    """Process-wide gate in front of the bedrock-runtime client.
+
+    Requests wait in priority order for a concurrency slot and for room in per-model
+    requests-per-minute and tokens-per-minute buckets. Concurrency adapts AIMD style: it grows by
+    one slot per window of successful requests and halves on throttling. Throttles and transient
+    server errors are retried with full-jitter exponential backoff, re-queued at the same priority,
+    and so are connection errors and read timeouts, which the client's own retries are turned off for.
+    """
+
+    def __init__(self, client, requests_per_minute=500, tokens_per_minute=1000000, quotas=None,
+                 max_concurrency=16, min_concurrency=1, max_retries=8, base_delay=1.0, max_delay=60.0, seed=None):
+        self.client = client
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        # modelId -> {"rpm": ..., "tpm": ...} for models whose quotas differ from the defaults
+        self.quotas = quotas or {}
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.counters = {"requests": 0, "throttled": 0, "retries": 0, "errors": 0, "decreases": 0}
+        self._buckets = {}
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._last_decrease = 0.0
+        self._random = random.Random(seed)
+        self._condition = threading.Condition()
+
+    def _model_buckets(self, model_id):
+        if model_id not in self._buckets:
+            quota = self.quotas.get(model_id, {})
+            self._buckets[model_id] = (TokenBucket(quota.get("rpm", self.requests_per_minute)),
+                                       TokenBucket(quota.get("tpm", self.tokens_per_minute)))
+        return self._buckets[model_id]
+
+    def _acquire(self, model_id, tokens, level):
+        with self._condition:
+            ticket = (level, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    timeout = None
+                    if self._waiting[0] == ticket and self.in_flight < int(self.limit):
+                        requests, token_bucket = self._model_buckets(model_id)
+                        timeout = max(requests.wait_time(1), token_bucket.wait_time(tokens))
+                        if timeout == 0:
+                            requests.take(1)
+                            token_bucket.take(tokens)
+                            self.in_flight += 1
+                            return
+                    self._condition.wait(timeout)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+
+    def _release(self, model_id, estimated, actual=None, throttled=False, failed=False):
+        with self._condition:
+            self.in_flight -= 1
+            if actual is not None:
+                # settle the token estimate against what the response says was used
+                self._model_buckets(model_id)[1].give(estimated - actual)
+            if throttled:
+                # one multiplicative decrease per burst of throttles, not one per failed request
+                now = time.monotonic()
+                if now - self._last_decrease > 1.0:
+                    self.limit = max(float(self.min_concurrency), self.limit / 2)
+                    self._last_decrease = now
+                    self.counters["decreases"] += 1
+            elif not failed:
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / max(self.limit, 1.0))
+            self._condition.notify_all()
+
+    def _count(self, name, amount=1):
+        with self._condition:
+            self.counters[name] += amount
+
+    def _estimate(self, body):
+        # Bedrock reserves max_tokens of output against the tokens-per-minute quota up front
+        request = json.loads(body)
+        return len(body) // 4 + request.get("max_tokens", 0)
+
+    def _backoff(self, attempt):
+        self._count("retries")
+        time.sleep(self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def _call(self, operation, body, model_id, kwargs, read=None):
+        # returns (response, estimate, read(response)) with the slot still taken; read runs inside the attempt, so a
+        # response body that times out is retried like the call itself and never leaves the slot taken
+        estimated = self._estimate(body)
+        level = _priority.get()
+        attempt = 0
+        while True:
+            self._acquire(model_id, estimated, level)
+            self._count("requests")
+            try:
+                response = getattr(self.client, operation)(body=body, modelId=model_id, **kwargs)
+                result = read(response) if read else None
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code", "")
+                throttled = code in THROTTLE_ERRORS
+                self._count("throttled", int(throttled))
+                self._release(model_id, estimated, actual=0 if throttled else None, throttled=throttled, failed=True)
+                if code not in RETRYABLE_ERRORS or attempt >= self.max_retries:
+                    self._count("errors")
+                    raise
+                self._backoff(attempt)
+                attempt += 1
+                continue
+            except TRANSIENT_ERRORS:
+                self._release(model_id, estimated, failed=True)
+                if attempt >= self.max_retries:
+                    self._count("errors")
+                    raise
+                self._backoff(attempt)
+                attempt += 1
+                continue
+            except Exception:
+                self._count("errors")
+                self._release(model_id, estimated, failed=True)
+                raise
+            response.setdefault("ResponseMetadata", {})["RetryAttempts"] = attempt
+            return response, estimated, result
+
+    def invoke_model(self, body, modelId, **kwargs):
+        response, estimated, usage = self._call("invoke_model", body, modelId, kwargs, read=_read_body)
+        self._release(modelId, estimated, actual=usage.get("input_tokens", 0) + usage.get("output_tokens", 0) or None)
+        return response
+
+    def invoke_model_with_response_stream(self, body, modelId, **kwargs):
+        # the slot stays taken until the stream has been read to the end or closed
+        response, estimated, _ = self._call("invoke_model_with_response_stream", body, modelId, kwargs)
+        response["body"] = _ScheduledStream(response["body"], lambda actual: self._release(modelId, estimated, actual=actual))
+        return response
+
+    def stats(self):
+        with self._condition:
+            return {**self.counters, "concurrency_limit": self.limit, "in_flight": self.in_flight, "waiting": len(self._waiting)}
+
+
+def _read_body(response):
+    # buffers the body so the caller can still read it, and returns the usage it reports
+    payload = response["body"].read()
+    response["body"] = io.BytesIO(payload)
+    return json.loads(payload).get("usage", {})
+
+
+class _ScheduledStream:
+    def __init__(self, stream, on_done):
+        self._stream = stream
+        self._on_done = on_done
+        self._usage = 0
+        self._done = False
+
+    def __iter__(self):
+        try:
+            for event in self._stream:
+                chunk = json.loads(event["chunk"]["bytes"]) if "chunk" in event else {}
+                if chunk.get("type") == "message_start":
+                    self._usage += chunk["message"].get("usage", {}).get("input_tokens", 0)
+                elif chunk.get("type") == "message_delta":
+                    self._usage += chunk.get("usage", {}).get("output_tokens", 0)
+                yield event
+        finally:
+            self._finish()
+
+    def close(self):
+        self._stream.close()
+        self._finish()
+
+    def _finish(self):
+        if not self._done:
+            self._done = True
+            self._on_done(self._usage or None)
@@ -0,0 +1,320 @@
+"""Persistent, indexed store of extracted agreements for cross-portfolio queries.
+
+Usage:
+    python mdima_store.py import results.jsonl [more.jsonl ...]
+    python mdima_store.py query --fee-structure "Tiered Asset-based Fee" --custodian "ABC Trust"
+    python mdima_store.py query --client "IPCRe Limited" --effective-from 2007-01-01 --min-confidence Medium --count
+
+Every result record (the batch output / run_pipeline return value) is flattened into one row
+of a local SQLite file (results_path, default .mdima_results.sqlite3): the parties, dates and
+fee structure go into indexed columns, the objective categories and fee types into indexed
+side tables, and the custodian, brokerage and free-text fields into a full-text index. The
+per-section confidence and show_work explanations are kept alongside, together with the full
+record. Queries only read these indexes; nothing is sent to Bedrock.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import mdima_config
+from mdima_rules import parse_date
+
+DEFAULT_PATH = os.getenv('results_path', '.mdima_results.sqlite3')
+# the UI, the job workers and the batch CLI add every finished document unless store_results=false
+STORE_RESULTS = os.getenv('store_results', 'true').lower() == 'true'
+# records per transaction when loading in bulk; loads at least this large refresh the planner statistics
+BULK_ROWS = 1000
+# rows ANALYZE samples per index, enough for the planner to tell a selective filter from a common one
+ANALYSIS_LIMIT = 1000
+
+CONFIDENCE_RANK = {"High": 0, "Medium": 1, "Low": 2}
+# record field -> column, for the indexed single-valued fields
+COLUMNS = {
+    ("Party", "Parties Involved", "Client Name"): "client_name",
+    ("Party", "Parties Involved", "Client Firm"): "client_firm",
+    ("Party", "Parties Involved", "Investment Manager Name"): "manager_name",
+    ("Party", "Parties Involved", "Investment Manager Firm"): "manager_firm",
+    ("Fee", "Fee", "Fee Structure"): "fee_structure",
+    ("Fee", "Fee", "Compensation Details"): "compensation_details",
+    ("Custodian and Brokerage", "Custodian and Brokerage", "Custodian"): "custodian",
+    ("Custodian and Brokerage", "Custodian and Brokerage", "Brokerage"): "brokerage",
+    ("Effective Date", "Effective Date", "Effective Date"): "effective_date",
+    ("Effective Date", "Effective Date", "Client Signature Date"): "client_signature_date",
+    ("Effective Date", "Effective Date", "Investment Firm Signature Date"): "firm_signature_date",
+}
+# full-text columns; a query on one only searches that column
+TEXT_COLUMNS = ("parties", "custodian", "brokerage", "compensation_details")
+
+
+def _text(value):
+    return value if isinstance(value, str) else json.dumps(value) if value is not None else None
+
+
+def _iso(text):
+    date = parse_date(text) if text else None
+    return date.isoformat() if date else None
+
+
+def flatten(record):
+    """Split a result record into (agreement row, objective categories, fee types, full-text row)."""
+    data = record.get("Data") or {}
+    row = {column: None for column in COLUMNS.values()}
+    for (section, key, field), column in COLUMNS.items():
+        value = ((data.get(section) or {}).get(key) or {})
+        row[column] = _text(value.get(field)) if isinstance(value, dict) else None
+    confidence = record.get("Confidence") or {}
+    ranks = [CONFIDENCE_RANK.get(str(value).strip(), len(CONFIDENCE_RANK)) for value in confidence.values()]
+    row.update(
+        document_hash=record["Document Hash"],
+        file_name=record.get("File Name", ""),
+        effective_on=_iso(row["effective_date"]),
+        client_signed_on=_iso(row["client_signature_date"]),
+        firm_signed_on=_iso(row["firm_signature_date"]),
+        min_confidence=max(ranks) if ranks else len(CONFIDENCE_RANK),
+        confidence=json.dumps(confidence),
+        show_work=json.dumps(record.get("Explanation") or {}),
+        errors=json.dumps(record["Errors"]) if record.get("Errors") else None,
+        record=json.dumps(record),
+    )
+    objectives = ((data.get("Objective") or {}).get("Investment Objectives") or {})
+    categories = list(dict.fromkeys(str(value).strip() for value in objectives.values() if str(value).strip())) if isinstance(objectives, dict) else []
+    fee_types = list(dict.fromkeys(part.strip() for part in (row["fee_structure"] or "").split(",") if part.strip()))
+    parties = " ".join(row[column] or "" for column in ("client_name", "client_firm", "manager_name", "manager_firm"))
+    text = {"parties": parties, "custodian": row["custodian"], "brokerage": row["brokerage"], "compensation_details": row["compensation_details"]}
+    return row, categories, fee_types, text
+
+
+def _phrase(column, value):
+    # an fts5 phrase query against one column; double quotes inside the phrase are escaped by doubling
+    return f'{column} : "{value.replace(chr(34), chr(34) * 2)}"'
+
+
+class ResultStore:
+    """SQLite store of flattened result records; safe to share between threads and processes."""
+
+    ROW_COLUMNS = ("document_hash", "file_name", "stored", *COLUMNS.values(), "effective_on", "client_signed_on", "firm_signed_on",
+                   "min_confidence", "confidence", "show_work", "errors", "record")
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS agreements ("
+            " id INTEGER PRIMARY KEY, document_hash TEXT NOT NULL UNIQUE, file_name TEXT NOT NULL, stored REAL NOT NULL,"
+            + "".join(f" {column} TEXT," for column in COLUMNS.values())
+            + " effective_on TEXT, client_signed_on TEXT, firm_signed_on TEXT, min_confidence INTEGER NOT NULL,"
+            " confidence TEXT NOT NULL, show_work TEXT NOT NULL, errors TEXT, record TEXT NOT NULL)"
+        )
+        for column in ("client_name", "client_firm", "manager_name", "manager_firm", "fee_structure", "file_name"):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS agreements_{column} ON agreements ({column} COLLATE NOCASE)")
+        for column in ("effective_on", "client_signed_on", "firm_signed_on", "min_confidence"):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS agreements_{column} ON agreements ({column})")
+        for table, column in (("objectives", "objective"), ("fee_types", "fee_type")):
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (agreement_id INTEGER NOT NULL, {column} TEXT NOT NULL)")
+            # category first to list its agreements in id order, agreement first to check one agreement's categories
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_{column} ON {table} ({column} COLLATE NOCASE, agreement_id)")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_agreement ON {table} (agreement_id, {column} COLLATE NOCASE)")
+        self._conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS agreements_text USING fts5({', '.join(TEXT_COLUMNS)})")
+
+    def add(self, record):
+        self.add_many([record])
+
+    def add_many(self, records):
+        """Insert or replace (by document hash) result records, BULK_ROWS per transaction; returns the count added."""
+        added = 0
+        records = list(records)
+        for start in range(0, len(records), BULK_ROWS):
+            # the last copy of a document wins, as it would across separate calls
+            flattened = list({record["Document Hash"]: flatten(record) for record in records[start:start + BULK_ROWS]}.values())
+            now = time.time()
+            hashes = [row["document_hash"] for row, categories, fee_types, text in flattened]
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    # records already in the store are replaced
+                    existing = self._conn.execute(
+                        f"SELECT id FROM agreements WHERE document_hash IN ({', '.join('?' for _ in hashes)})", hashes
+                    ).fetchall()
+                    for row in existing:
+                        self._delete(row)
+                    for row, categories, fee_types, text in flattened:
+                        row["stored"] = now
+                        agreement_id = self._conn.execute(
+                            f"INSERT INTO agreements ({', '.join(self.ROW_COLUMNS)}) VALUES ({', '.join('?' for _ in self.ROW_COLUMNS)})",
+                            [row[column] for column in self.ROW_COLUMNS],
+                        ).lastrowid
+                        self._conn.executemany("INSERT INTO objectives (agreement_id, objective) VALUES (?, ?)",
+                                               [(agreement_id, category) for category in categories])
+                        self._conn.executemany("INSERT INTO fee_types (agreement_id, fee_type) VALUES (?, ?)",
+                                               [(agreement_id, fee_type) for fee_type in fee_types])
+                        self._conn.execute(f"INSERT INTO agreements_text (rowid, {', '.join(TEXT_COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+                                           [agreement_id, *(text[column] or "" for column in TEXT_COLUMNS)])
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            added += len(flattened)
+        if added >= BULK_ROWS:
+            with self._lock:
+                self._conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+                self._conn.execute("ANALYZE")
+        return added
+
+    def _delete(self, row):
+        # row is the (id,) of an agreement
+        for table in ("objectives", "fee_types"):
+            self._conn.execute(f"DELETE FROM {table} WHERE agreement_id = ?", row)
+        self._conn.execute("DELETE FROM agreements_text WHERE rowid = ?", row)
+        self._conn.execute("DELETE FROM agreements WHERE id = ?", row)
+
+    def _where(self, client=None, manager=None, objective=None, fee_structure=None, custodian=None, brokerage=None, text=None,
+               effective_from=None, effective_to=None, min_confidence=None, file_name=None):
+        # every filter is answered from an index: the NOCASE column indexes, the side tables or the full-text index.
+        # The side tables are joined rather than used as subqueries so the planner can start from whichever
+        # filter is most selective, and read a category's agreements straight off its index in id order
+        joins = ""
+        clauses = []
+        params = []
+        for value, columns in ((client, ("client_name", "client_firm")), (manager, ("manager_name", "manager_firm"))):
+            if value:
+                clauses.append("(" + " OR ".join(f"{column} = ? COLLATE NOCASE" for column in columns) + ")")
+                params.extend([value] * len(columns))
+        for value, table, column in ((objective, "objectives", "objective"), (fee_structure, "fee_types", "fee_type")):
+            if value:
+                joins += f" JOIN {table} ON {table}.agreement_id = agreements.id"
+                clauses.append(f"{table}.{column} = ? COLLATE NOCASE")
+                params.append(value)
+        searches = [_phrase(column, value) for column, value in (("custodian", custodian), ("brokerage", brokerage)) if value]
+        if text:
+            searches.append(_phrase("{" + " ".join(TEXT_COLUMNS) + "}", text))
+        if searches:
+            clauses.append("agreements.id IN (SELECT rowid FROM agreements_text WHERE agreements_text MATCH ?)")
+            params.append(" AND ".join(searches))
+        if effective_from:
+            clauses.append("effective_on >= ?")
+            params.append(str(effective_from))
+        if effective_to:
+            clauses.append("effective_on <= ?")
+            params.append(str(effective_to))
+        if min_confidence:
+            clauses.append("min_confidence <= ?")
+            params.append(CONFIDENCE_RANK[min_confidence])
+        if file_name:
+            clauses.append("file_name = ? COLLATE NOCASE")
+            params.append(file_name)
+        return joins + (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def query(self, limit=100, full=False, **filters):
+        """Agreements matching every given filter, most recently stored first.
+
+        Filters: client and manager (a name or firm, case-insensitive), objective and
+        fee_structure (one category), custodian, brokerage and text (phrase searches),
+        effective_from and effective_to (ISO dates, inclusive), min_confidence (every section
+        at least this confident) and file_name. With full each row carries the whole record.
+        """
+        where, params = self._where(**filters)
+        columns = ["document_hash", "file_name", *COLUMNS.values(), "effective_on", "confidence", "show_work", "errors"]
+        if full:
+            columns.append("record")
+        with self._lock:
+            cursor = self._conn.execute(f"SELECT agreements.id, {', '.join('agreements.' + column for column in columns)} FROM agreements{where}"
+                                        " ORDER BY agreements.id DESC LIMIT ?", [*params, limit])
+            rows = cursor.fetchall()
+            agreement_ids = [row[0] for row in rows]
+            placeholders = ", ".join("?" for _ in agreement_ids)
+            objectives = self._conn.execute(
+                f"SELECT agreement_id, objective FROM objectives WHERE agreement_id IN ({placeholders})", agreement_ids
+            ).fetchall()
+        categories = {}
+        for agreement_id, objective in objectives:
+            categories.setdefault(agreement_id, []).append(objective)
+        results = []
+        for row in rows:
+            result = dict(zip(columns, row[1:]))
+            result["objectives"] = categories.get(row[0], [])
+            for column in ("confidence", "show_work", "errors", "record"):
+                if result.get(column):
+                    result[column] = json.loads(result[column])
+            results.append(result)
+        return results
+
+    def count(self, **filters):
+        where, params = self._where(**filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM agreements{where}", params).fetchone()[0]
+
+    def get(self, document_hash):
+        # the full record as it was stored
+        with self._lock:
+            row = self._conn.execute("SELECT record FROM agreements WHERE document_hash = ?", (document_hash,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+
+def iter_records(paths):
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=DEFAULT_PATH, help="store file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    load = commands.add_parser("import", help="bulk load result records from JSONL files (e.g. mdima_batch.py output)")
+    load.add_argument("files", nargs="+")
+    query = commands.add_parser("query", help="print the matching records as JSON lines")
+    query.add_argument("--client", help="client name or firm")
+    query.add_argument("--manager", help="investment manager name or firm")
+    query.add_argument("--objective", help="investment objective category")
+    query.add_argument("--fee-structure", help="fee structure category, e.g. \"Tiered Asset-based Fee\"")
+    query.add_argument("--custodian", help="phrase in the custodian details")
+    query.add_argument("--brokerage", help="phrase in the brokerage details")
+    query.add_argument("--text", help="phrase in the parties, custodian, brokerage or compensation details")
+    query.add_argument("--effective-from", help="earliest effective date, YYYY-MM-DD")
+    query.add_argument("--effective-to", help="latest effective date, YYYY-MM-DD")
+    query.add_argument("--min-confidence", choices=tuple(CONFIDENCE_RANK), help="every section at least this confident")
+    query.add_argument("--file-name")
+    query.add_argument("--limit", type=int, default=100)
+    query.add_argument("--full", action="store_true", help="print the whole stored record")
+    query.add_argument("--count", action="store_true", help="only print the number of matches")
+    args = parser.parse_args(argv)
+
+    store = ResultStore(args.path)
+    started = time.perf_counter()
+    if args.command == "import":
+        added = 0
+        records = iter_records(args.files)
+        while True:
+            chunk = [record for _, record in zip(range(BULK_ROWS), records)]
+            if not chunk:
+                break
+            added += store.add_many(chunk)
+        print(f"imported {added} records in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        return 0
+
+    filters = {name: getattr(args, name) for name in ("client", "manager", "objective", "fee_structure", "custodian", "brokerage", "text",
+                                                      "effective_from", "effective_to", "min_confidence", "file_name")}
+    if args.count:
+        print(store.count(**filters))
+        matched = None
+    else:
+        rows = store.query(limit=args.limit, full=args.full, **filters)
+        for row in rows:
+            print(json.dumps(row))
+        matched = len(rows)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"{'counted' if matched is None else f'{matched} results'} in {elapsed:.1f} ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+from mdima_parsing import COMPLETION_TAGS, parse_tags
+
+
+class TagStreamParser:
+    """Incrementally watches a streamed completion for closing xml tags.
+
+    feed() is called with each text delta and returns the tags that closed in it, so a caller
+    can act on <output>/<confidence> the moment they are complete instead of after the last token.
+    Tags are matched with parse_tags, so a closing tag quoted inside the scratchpad does not count.
+    """
+
+    def __init__(self, tags):
+        self.tags = tuple(tags)
+        # the other completion tags are tracked too, so the watched ones are only matched at the top level
+        self._all_tags = tuple(dict.fromkeys(COMPLETION_TAGS + self.tags))
+        self.values = {}
+        self._chunks = []
+        self._tail = ""
+        self._longest = max(len(f"</{tag}>") for tag in self.tags)
+
+    @property
+    def text(self):
+        return "".join(self._chunks)
+
+    def complete(self):
+        return len(self.values) == len(self.tags)
+
+    def feed(self, delta):
+        self._chunks.append(delta)
+        # only the tail of the previous text can hold the start of a closing tag split across deltas
+        window = self._tail + delta
+        self._tail = window[-self._longest:]
+        if not any(tag not in self.values and f"</{tag}>" in window for tag in self.tags):
+            return []
+        found = parse_tags(self.text, self._all_tags)
+        closed = [tag for tag in self.tags if tag not in self.values and tag in found]
+        for tag in closed:
+            self.values[tag] = found[tag]
+        return closed
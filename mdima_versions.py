@@ -0,0 +1,185 @@
+import difflib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import mdima_config
+from mdima_cache import hash_bytes
+from mdima_retrieval import ClauseIndex
+
+DEFAULT_PATH = os.getenv('versions_path', '.mdima_versions.sqlite3')
+# a processed document is taken as an earlier version of a new one when at least this fraction of
+# the new document's pages are identical to its pages
+MATCH_THRESHOLD = float(os.getenv('amendment_match_threshold', 0.5))
+# clauses per section that count as its sources, on top of the pages its answer was found on
+PROVENANCE_TOP_K = 8
+# answers shorter than this ("Growth", "individual") are too common to locate in the text
+MIN_LOCATABLE_CHARS = 8
+# long extracted passages are located by their opening words
+LOCATE_CHARS = 80
+
+
+def _normalize(text):
+    return " ".join(str(text).lower().split())
+
+
+def page_hashes(pages):
+    # one hash per page in page order; whitespace-only differences (re-rendering, re-OCR) do not count as changes
+    return [hash_bytes(_normalize(pages[number])) for number in sorted(pages)]
+
+
+def diff_pages(old_hashes, new_hashes):
+    """Align two versions' pages by content.
+
+    Returns (changed old pages, changed new pages, {old page: new page}) with 1-based page
+    numbers; pages that only moved (because pages were inserted or removed before them) are
+    mapped rather than reported as changed.
+    """
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    mapping = {}
+    for old_start, new_start, size in matcher.get_matching_blocks():
+        for offset in range(size):
+            mapping[old_start + offset + 1] = new_start + offset + 1
+    changed_old = [number for number in range(1, len(old_hashes) + 1) if number not in mapping]
+    matched_new = set(mapping.values())
+    changed_new = [number for number in range(1, len(new_hashes) + 1) if number not in matched_new]
+    return changed_old, changed_new, mapping
+
+
+def fields(value, prefix=""):
+    # {"Fee.Fee Structure": leaf} for a section's output json
+    if isinstance(value, dict):
+        leaves = {}
+        for key, child in value.items():
+            leaves.update(fields(child, f"{prefix}.{key}" if prefix else key))
+        return leaves
+    return {prefix: value}
+
+
+def query_pages(pages, query, lead_clauses=0, index=None):
+    # pages of the clauses a section's search terms point at; these are where its answer can come from
+    index = index or ClauseIndex(pages, top_k=PROVENANCE_TOP_K, token_budget=float("inf"))
+    return sorted({number for clause in index.select(query, lead_clauses) for number in clause["pages"]})
+
+
+def answer_pages(pages, result):
+    # pages holding the section's answer: its citations when it has them, otherwise wherever the values appear
+    found = {number for cited in (result.get("citations") or {}).values() for number in cited}
+    normalized = {number: _normalize(text) for number, text in pages.items()}
+    for value in fields(result.get("json") or {}).values():
+        needle = _normalize(value)[:LOCATE_CHARS]
+        if len(needle) < MIN_LOCATABLE_CHARS:
+            continue
+        found.update(number for number, text in normalized.items() if needle in text)
+    return sorted(found)
+
+
+def remap_result(result, mapping):
+    # a reused result with its page citations moved to the new page numbers
+    result = dict(result)
+    if result.get("citations"):
+        result["citations"] = {field: [mapping[number] for number in cited if number in mapping]
+                               for field, cited in result["citations"].items()}
+    return result
+
+
+def field_report(previous, results, reused):
+    """Per-field changes between two versions' section results.
+
+    previous and results map section -> result; reused lists the sections carried over without
+    a model call. Returns {"<Output Key>.<Field>": {"section", "status", "reused"}} where status
+    is unchanged, changed, added or removed; changed fields also carry the previous and current values.
+    """
+    report = {}
+    for section, result in results.items():
+        before = fields((previous.get(section) or {}).get("json") or {})
+        after = fields(result.get("json") or {})
+        for field in list(dict.fromkeys([*before, *after])):
+            entry = {"section": section, "reused": section in reused}
+            if field not in after:
+                entry["status"] = "removed"
+            elif field not in before:
+                entry["status"] = "added"
+            elif _normalize(before[field]) == _normalize(after[field]):
+                entry["status"] = "unchanged"
+            else:
+                entry["status"] = "changed"
+            if entry["status"] != "unchanged":
+                entry["previous"] = before.get(field)
+                entry["current"] = after.get(field)
+            report[field] = entry
+    return report
+
+
+class VersionStore:
+    """SQLite record of every processed document: page hashes, section results and their source pages.
+
+    New documents are matched against it by shared page hashes, so an amended agreement can be
+    diffed against the version that was processed before it.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, match_threshold=MATCH_THRESHOLD):
+        self.path = path
+        self.match_threshold = match_threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " document_hash TEXT PRIMARY KEY, file_name TEXT NOT NULL, processed REAL NOT NULL,"
+            " page_hashes TEXT NOT NULL, provenance TEXT NOT NULL, results TEXT NOT NULL, previous TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " page_hash TEXT NOT NULL, document_hash TEXT NOT NULL, page INTEGER NOT NULL, PRIMARY KEY (document_hash, page))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_hash ON pages (page_hash)")
+
+    def save(self, document_hash, file_name, hashes, provenance, results, previous=None):
+        # results are stored without their run stats; provenance maps section -> source pages
+        stored = {section: {key: value for key, value in result.items() if key != "stats"} for section, result in results.items()}
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO documents (document_hash, file_name, processed, page_hashes, provenance, results, previous)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (document_hash, file_name, time.time(), json.dumps(hashes), json.dumps(provenance), json.dumps(stored), previous),
+                )
+                self._conn.execute("DELETE FROM pages WHERE document_hash = ?", (document_hash,))
+                self._conn.executemany("INSERT INTO pages (page_hash, document_hash, page) VALUES (?, ?, ?)",
+                                       [(page_hash, document_hash, number) for number, page_hash in enumerate(hashes, start=1)])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get(self, document_hash):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT document_hash, file_name, processed, page_hashes, provenance, results, previous FROM documents WHERE document_hash = ?",
+                (document_hash,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"document_hash": row[0], "file_name": row[1], "processed": row[2], "page_hashes": json.loads(row[3]),
+                "provenance": json.loads(row[4]), "results": json.loads(row[5]), "previous": row[6]}
+
+    def match(self, hashes):
+        """The most recently processed document sharing the most pages with hashes, or None below the threshold."""
+        if not hashes:
+            return None
+        placeholders = ", ".join("?" for _ in set(hashes))
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT pages.document_hash, COUNT(DISTINCT pages.page_hash) AS shared FROM pages"
+                " JOIN documents ON documents.document_hash = pages.document_hash"
+                f" WHERE pages.page_hash IN ({placeholders})"
+                " GROUP BY pages.document_hash ORDER BY shared DESC, MAX(documents.processed) DESC LIMIT 1",
+                list(set(hashes)),
+            ).fetchone()
+        if row is None or row[1] / len(set(hashes)) < self.match_threshold:
+            return None
+        return self.get(row[0])
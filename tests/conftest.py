@@ -0,0 +1,6 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules live at the repository root, the synthetic PDF writer in benchmarks/
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
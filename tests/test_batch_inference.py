@@ -0,0 +1,43 @@
+import io
+import json
+import os
+
+import mdima_batch_inference
+import mdima_pipeline
+from bench_pdf import synthetic_pdf
+from bench_pipeline import CLOSING_LINES, RECORDINGS
+from mdima_cache import ResultCache
+from mdima_fake_bedrock import FakeBedrock
+
+
+def test_record_ids_are_base62():
+    key = "f" * 64
+    assert mdima_batch_inference.record_id(key) == mdima_batch_inference.record_id(key)
+    ids = {mdima_batch_inference.record_id(f"{n:064x}") for n in range(1000)}
+    assert len(ids) == 1000
+    assert all(len(id) == 11 and id.isalnum() and id.isascii() for id in ids)
+
+
+def test_colliding_records_are_skipped_and_retried(tmp_path, monkeypatch):
+    pdfs = tmp_path / "pdfs"
+    pdfs.mkdir()
+    for n in range(2):
+        (pdfs / f"agreement_{n}.pdf").write_bytes(synthetic_pdf(3, lines_per_page=30, title=f"Agreement {n}", closing_lines=CLOSING_LINES))
+    mdima_pipeline.set_cache(ResultCache(str(tmp_path / "cache.sqlite3")))
+    mdima_pipeline.set_bedrock(FakeBedrock.from_file(RECORDINGS))
+    # every request gets the same id, so only the first one is exported
+    monkeypatch.setattr(mdima_batch_inference, "record_id", lambda key: "A" * 11)
+    export_dir = str(tmp_path / "batch")
+    log = io.StringIO()
+
+    counts = mdima_batch_inference.export_batch(str(pdfs), export_dir, log=log)
+    assert counts["documents"] == 2 and counts["records"] == 1
+    assert counts["collisions"] == 9
+    mdima_batch_inference.simulate(export_dir, RECORDINGS, seed=0)
+    output = str(tmp_path / "results.jsonl")
+    ingested = mdima_batch_inference.ingest_batch(export_dir, [], output, log=log)
+
+    assert ingested == {"completed": 0, "incomplete": 2}
+    with open(output + ".retry.jsonl") as f:
+        assert sorted(json.loads(line)["file_name"] for line in f) == ["agreement_0.pdf", "agreement_1.pdf"]
+    assert os.path.getsize(output) == 0
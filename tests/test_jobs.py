@@ -0,0 +1,47 @@
+import os
+import time
+
+from bench_pdf import synthetic_pdf
+from conftest import ROOT
+from mdima_jobs import JobStore, start_workers
+from mdima_pdf import MIN_PARALLEL_PAGES
+
+RECORDINGS = os.path.join(ROOT, "benchmarks", "recordings", "dima_sample.json")
+
+
+def test_worker_runs_long_pdf(tmp_path, monkeypatch):
+    # long PDFs are read by a process pool, which a worker process has to be allowed to start
+    for name, value in (("cache_path", "cache.sqlite3"), ("results_path", "results.sqlite3"), ("versions_path", "versions.sqlite3")):
+        monkeypatch.setenv(name, str(tmp_path / value))
+    monkeypatch.setenv("bedrock_replay", RECORDINGS)
+    path = str(tmp_path / "jobs.sqlite3")
+    store = JobStore(path)
+    job_id = store.submit(synthetic_pdf(MIN_PARALLEL_PAGES + 8), "long.pdf")
+
+    processes, stop = start_workers(1, path=path)
+    try:
+        deadline = time.monotonic() + 120
+        while store.get(job_id)["status"] in ("queued", "running") and time.monotonic() < deadline:
+            time.sleep(0.5)
+    finally:
+        stop.set()
+        for process in processes:
+            process.join(60)
+    job = store.get(job_id)
+    assert job["status"] == "done", job["error"]
+    assert job["attempts"] == 1
+    assert "Errors" not in job["result"]
+
+
+def test_stale_worker_cannot_finish_or_requeue(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"), lease_seconds=0)
+    job_id = store.submit(b"%PDF", "a.pdf")
+    store.claim("stale")
+    # the lease has expired, so the next claim hands the job to another worker
+    assert store.claim("current")["worker"] == "current"
+    assert not store.fail(job_id, "stale", "boom")
+    assert not store.complete(job_id, "stale", {"File Name": "a.pdf"})
+    job = store.get(job_id)
+    assert (job["status"], job["worker"], job["result"]) == ("running", "current", None)
+    assert store.complete(job_id, "current", {"File Name": "a.pdf"})
+    assert store.get(job_id)["status"] == "done"
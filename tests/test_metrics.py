@@ -0,0 +1,14 @@
+import json
+
+from mdima_metrics import Metrics, default_sink
+
+
+def test_default_sink_is_opened_once_per_path(tmp_path, monkeypatch):
+    path = tmp_path / "metrics.jsonl"
+    monkeypatch.setenv("metrics_sink", str(path))
+    sinks = [default_sink() for _ in range(3)]
+    assert sinks[0] is sinks[1] is sinks[2]
+    for n, sink in enumerate(sinks):
+        Metrics(sink=sink, run=n).emit("document")
+    with open(path) as f:
+        assert [json.loads(line)["run"] for line in f] == [0, 1, 2]
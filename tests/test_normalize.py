@@ -0,0 +1,75 @@
+import mdima_rules
+from mdima_normalize import marked_text, normalize_pages
+
+
+CLAUSES = ["Appointment", "Services", "Fees", "Custody", "Reports", "Termination", "Notices", "Governing Law"]
+
+
+def agreement(pages=6):
+    # every page has a running header, a "Page N of M" footer and a URL footer with the page number
+    return {
+        number: "\n".join([
+            "6/26/24, 6:28 PM Investment Management Agreement",
+            f"{number}. {CLAUSES[number]}",
+            f"The Manager shall   provide the {CLAUSES[number].lower()} described here.",
+            f"Page {number} of {pages}",
+            f"https://www.sec.gov/Archives/dex102.htm {number}/{pages}",
+        ])
+        for number in range(1, pages + 1)
+    }
+
+
+def test_strips_running_headers_and_footers():
+    cleaned, report = normalize_pages(agreement())
+    assert sorted(cleaned) == [1, 2, 3, 4, 5, 6]
+    assert cleaned[3] == "3. Custody\nThe Manager shall provide the custody described here."
+    assert report["removed_lines"][3] == ["6/26/24, 6:28 PM Investment Management Agreement", "Page 3 of 6",
+                                          "https://www.sec.gov/Archives/dex102.htm 3/6"]
+    assert report["tokens_after"] < report["tokens_before"]
+
+
+def test_keeps_signature_dates_on_separate_pages():
+    pages = {
+        1: "1. The Effective Date of this Agreement is 1st March 2023.\n2. The Manager shall manage the Portfolio.\n3. Fees are set out below.",
+        2: "4. The Client shall pay the Manager an annual fee.\n5. This Agreement is governed by English law.",
+        3: "CLIENT:\nJOHN SMITH\nBy: John Smith\nDate: March 2, 2023",
+        4: "INVESTMENT MANAGER:\nACME WEALTH MANAGEMENT LLC\nBy: Jane Doe\nDate: March 1, 2023",
+    }
+    cleaned, report = normalize_pages(pages)
+    assert report["removed_lines"] == {}
+    assert "Date: March 2, 2023" in cleaned[3] and "Date: March 1, 2023" in cleaned[4]
+    assert mdima_rules.effective_date(cleaned) == mdima_rules.effective_date(pages) is not None
+
+
+def test_keeps_field_lines_that_repeat_on_every_page():
+    pages = {number: f"Client: IPCRe Limited\n{number}. {CLAUSES[number]}\nInitials: JS" for number in range(1, 5)}
+    cleaned, report = normalize_pages(pages)
+    assert report["removed_lines"] == {}
+
+
+def test_page_numbers_only_bare_integers_within_the_page_count():
+    pages = {number: f"{number}. {CLAUSES[number]}" for number in range(1, 5)}
+    pages[1] += "\n10%"
+    pages[2] += "\n$250"
+    pages[3] += "\n(3)"
+    pages[4] = "2008\n" + pages[4] + "\n4"
+    cleaned, report = normalize_pages(pages)
+    assert report["removed_lines"] == {4: ["4"]}
+    assert cleaned[1].endswith("10%") and cleaned[2].endswith("$250") and cleaned[3].endswith("(3)")
+    assert cleaned[4].startswith("2008\n")
+
+
+def test_rejoins_words_broken_over_lines():
+    pages = {1: "the invest-\nment manager and the non-\ndiscretionary\nservices",
+             2: "non-discretionary services are excluded"}
+    cleaned, _ = normalize_pages(pages)
+    assert cleaned[1] == "the investment\nmanager and the non-discretionary\nservices"
+
+
+def test_collapses_whitespace_and_blank_lines():
+    cleaned, _ = normalize_pages({1: "  1.1   The   Client\t shall\n\n\n\n1.2 pay\u00a0fees  \n"})
+    assert cleaned[1] == "1.1 The Client shall\n1.2 pay fees"
+
+
+def test_marked_text_keeps_page_numbers():
+    assert marked_text({2: "b", 1: "a"}) == "[Page 1]\na\n[Page 2]\nb"
@@ -0,0 +1,17 @@
+import json
+
+from mdima_parsing import check_completion, parse_tags
+
+OUTPUT = json.dumps({"Fee": {"Fee Structure": "Tiered Asset-based Fee", "Compensation Details": "1% of assets"}})
+
+
+def test_confidence_is_normalized_before_validation():
+    for written in ("high", "High.", " HIGH ", "High!"):
+        tags = parse_tags(f"<output>{OUTPUT}</output><confidence>{written}</confidence>")
+        assert check_completion("Fee", tags) is None
+        assert tags["confidence"] == "High"
+
+
+def test_unknown_confidence_is_still_rejected():
+    tags = parse_tags(f"<output>{OUTPUT}</output><confidence>very sure</confidence>")
+    assert "expected one of High, Medium, Low" in check_completion("Fee", tags)
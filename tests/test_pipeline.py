@@ -0,0 +1,25 @@
+import os
+
+import mdima_pipeline
+from bench_pipeline import RECORDINGS
+from conftest import ROOT
+from mdima_cache import ResultCache
+from mdima_fake_bedrock import FakeBedrock
+
+PDF = os.path.join(ROOT, "Discretionary Investment Management Agreement.pdf")
+
+
+def test_cached_escalations_keep_their_model(tmp_path):
+    mdima_pipeline.set_cache(ResultCache(str(tmp_path / "cache.sqlite3")))
+    mdima_pipeline.set_bedrock(FakeBedrock.from_file(RECORDINGS))
+    runs = []
+    for _ in range(2):
+        stats = {}
+        mdima_pipeline.run_pipeline(PDF, "agreement.pdf", tiering=True, on_section=lambda section, result: stats.update({section: result["stats"]}))
+        runs.append(stats)
+    first, second = runs
+    escalated = [section for section in first if first[section]["escalated"]]
+    assert escalated
+    for section in escalated:
+        assert second[section]["cached"] and second[section]["escalated"]
+        assert second[section]["model_id"] == first[section]["model_id"] == mdima_pipeline.SECTION_TIERS[section][-1]
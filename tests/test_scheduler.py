@@ -0,0 +1,48 @@
+import io
+import json
+
+import pytest
+from botocore.exceptions import ReadTimeoutError
+
+from mdima_scheduler import BedrockScheduler
+
+BODY = json.dumps({"max_tokens": 10, "messages": []})
+
+
+class BrokenBody:
+    def read(self):
+        raise ReadTimeoutError(endpoint_url="https://bedrock-runtime.us-east-1.amazonaws.com")
+
+
+class Client:
+    # answers every call with a body whose read fails for the first `failures` calls
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def invoke_model(self, body, modelId, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            return {"body": BrokenBody()}
+        return {"body": io.BytesIO(json.dumps({"usage": {"input_tokens": 3, "output_tokens": 2}}).encode())}
+
+
+def test_failed_body_read_releases_the_slot():
+    scheduler = BedrockScheduler(Client(failures=2), max_concurrency=2, max_retries=0)
+    for _ in range(2):
+        with pytest.raises(ReadTimeoutError):
+            scheduler.invoke_model(BODY, modelId="model")
+    assert scheduler.stats()["in_flight"] == 0
+    response = scheduler.invoke_model(BODY, modelId="model")
+    assert json.loads(response["body"].read())["usage"]["output_tokens"] == 2
+    assert scheduler.stats()["in_flight"] == 0
+
+
+def test_read_timeouts_are_retried():
+    client = Client(failures=2)
+    scheduler = BedrockScheduler(client, max_concurrency=2, base_delay=0.0)
+    response = scheduler.invoke_model(BODY, modelId="model")
+    assert json.loads(response["body"].read())["usage"]["input_tokens"] == 3
+    assert response["ResponseMetadata"]["RetryAttempts"] == 2
+    assert client.calls == 3
+    assert scheduler.stats()["retries"] == 2 and scheduler.stats()["in_flight"] == 0